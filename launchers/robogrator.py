@@ -3,8 +3,356 @@
 from RuoteAMQP.launcher import Launcher
 
 import os, socket
-from glob import iglob
 import json
+import threading
+import time
+from Queue import Queue, Empty
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class ProcessEntry(object):
+    """A process definition with its parsed configuration.
+
+    If the definition can't be launched error holds the reason and notify
+    tells whether it should be announced.
+    """
+
+    def __init__(self, path, config=None, process=None, error=None,
+                 notify=False):
+        self.path = path
+        self.config = config
+        self.process = process
+        self.error = error
+        self.notify = notify
+
+
+class ProcessStore(object):
+    """In-memory index of the process store.
+
+    Process definitions and their configurations are read and parsed when
+    they change, so looking up processes for an event does no disk I/O.
+    Changes are noticed with inotify if pyinotify is available, otherwise
+    and in addition the store is scanned every `interval` seconds. Only
+    directories whose files changed are read again.
+
+    :param path: Process store root directory
+    :param log: Logger
+    :param interval: Seconds between scans
+    """
+
+    def __init__(self, path, log, interval=10):
+        self.path = path
+        self.log = log
+        self.interval = interval
+        # {(project dir, trigger): (ProcessEntry, ...)}
+        self._index = {}
+        # {project dir: (file signatures, {trigger: entries})}
+        self._dirs = {}
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._notifier = None
+
+    def get(self, trigger, project):
+        """Get process entries for trigger in project.
+
+        :param trigger: The triggering event
+        :param project: Project name
+        :returns: Tuple of ProcessEntry objects in launch order
+        """
+        key = (os.path.normpath(project.replace(':', '/')), trigger)
+        with self._lock:
+            return self._index.get(key, ())
+
+    def start(self):
+        """Build the index and start watching for changes."""
+        self.scan()
+        if pyinotify is not None:
+            manager = pyinotify.WatchManager()
+            self._notifier = pyinotify.ThreadedNotifier(
+                    manager, lambda event: self._wakeup.set())
+            self._notifier.daemon = True
+            self._notifier.start()
+            manager.add_watch(self.path, pyinotify.ALL_EVENTS &
+                    ~(pyinotify.IN_ACCESS | pyinotify.IN_OPEN |
+                      pyinotify.IN_CLOSE_NOWRITE),
+                    rec=True, auto_add=True)
+        self._thread = threading.Thread(target=self._run,
+                name="process-store-scanner")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching for changes."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Scanner thread."""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            if self._stopped.is_set():
+                break
+            self._wakeup.clear()
+            try:
+                self.scan()
+            except Exception:
+                self.log.exception("Process store scan failed")
+
+    def scan(self):
+        """Update the index from changed process store directories."""
+        with self._scan_lock:
+            self._scan()
+
+    def _scan(self):
+        """Walk the process store and rebuild the index."""
+        dirs = {}
+        # symlinked project directories are followed, except links back to
+        # a directory above them, which would loop forever
+        # {directory: (st_dev, st_ino) of the directories above it}
+        ancestors = {}
+        for dirpath, dirnames, filenames in os.walk(self.path,
+                                                    followlinks=True):
+            above = ancestors.pop(dirpath, frozenset())
+            try:
+                stat = os.stat(dirpath)
+            except OSError:
+                dirnames[:] = []
+                continue
+            if (stat.st_dev, stat.st_ino) in above:
+                dirnames[:] = []
+                continue
+            above = above | frozenset([(stat.st_dev, stat.st_ino)])
+            for name in dirnames:
+                ancestors[os.path.join(dirpath, name)] = above
+            project = os.path.normpath(os.path.relpath(dirpath, self.path))
+            signature = []
+            for name in sorted(filenames):
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                signature.append((name, stat.st_mtime, stat.st_ctime,
+                                  stat.st_size))
+            signature = tuple(signature)
+            cached = self._dirs.get(project)
+            if cached is not None and cached[0] == signature:
+                dirs[project] = cached
+            else:
+                dirs[project] = (signature, self._read_dir(dirpath,
+                    [entry[0] for entry in signature]))
+
+        index = {}
+        for project, (_, triggers) in dirs.iteritems():
+            for trigger, entries in triggers.iteritems():
+                index[(project, trigger)] = entries
+        with self._lock:
+            self._dirs = dirs
+            self._index = index
+
+    def _read_dir(self, dirpath, filenames):
+        """Read and parse process definitions in a directory.
+
+        :returns: {trigger: (ProcessEntry, ...)}
+        """
+        triggers = {}
+        for name in filenames:
+            if "." not in name:
+                # OLD name for backward compat
+                filename = os.path.join(dirpath, name)
+                process = self._read(filename)
+                if process is not None:
+                    self.log.warning("Found old style pdef %s" % filename)
+                    self.log.warning("*"*80)
+                    self.log.warning("DEPRECATED: please rename process at "
+                                     "\n%s" % filename)
+                    self.log.warning("*"*80)
+                    triggers.setdefault(name, []).insert(0,
+                            ProcessEntry(filename, process=process))
+            elif name.endswith(".pdef") and name.count(".") >= 2:
+                entry = self._read_pdef(os.path.join(dirpath, name))
+                if entry is not None:
+                    triggers.setdefault(name.split(".", 1)[0],
+                                        []).append(entry)
+        return dict((trigger, tuple(entries))
+                    for trigger, entries in triggers.iteritems())
+
+    def _read(self, filename):
+        """Read file contents or None if it can't be read."""
+        try:
+            with open(filename, 'r') as pdef_file:
+                return pdef_file.read()
+        except IOError as exc:
+            # Any weird errors due to race conditions are ignored
+            # for example the file is removed before or while reading it
+            self.log.info("I/O error({0}): {1} {2}".format(exc.errno,
+                          exc.strerror, exc.filename))
+            return None
+
+    def _read_pdef(self, filename):
+        """Read new style process definition and its configuration."""
+        process = self._read(filename)
+        if process is None:
+            return None
+        self.log.info("Found pdef %s" % filename)
+
+        try:
+            config = None
+            with open("%s.conf" % filename[:-5], 'r') as config_file:
+                lines = [line.strip() if not line.strip().startswith('#') \
+                         else "" for line in config_file.readlines()]
+                config = json.loads("\n".join(lines))
+            self.log.info("Found valid conf %s.conf" % filename[:-5])
+        except IOError as exc:
+            # we don't care if there is no .conf file
+            # so we ignore errorcode 2 which is file not found
+            # otherwise log the error and don't launch the process
+            if not exc.errno == 2:
+                err = "I/O error({0}): {1} {2}".format(exc.errno,
+                                                       exc.strerror,
+                                                       exc.filename)
+                self.log.error(err)
+                return ProcessEntry(filename, error=err)
+        except ValueError, error:
+            # if a .conf was found but is invalid don't launch the process
+            err = "invalid conf file %s.conf\n%s" % (filename, error)
+            self.log.error(err)
+            return ProcessEntry(filename, error=err, notify=True)
+
+        return ProcessEntry(filename, config=config, process=process)
+
+
+class LaunchQueue(object):
+    """Launches processes from a background thread.
+
+    Queued launches are published in batches of up to `batch_size` messages
+    over the launcher's persistent channel, so event dispatching never waits
+    for the broker. Launches are plain publishes, the amqplib channel of the
+    launcher has no publisher confirms and a channel transaction per event
+    would make dispatching wait for a commit round trip again.
+
+    The event is acknowledged when it has been queued, so launches still in
+    the queue are lost if the process dies. stats() reports the queue depth
+    bounding that loss, and stop() publishes whatever is still queued on a
+    clean shutdown.
+
+    :param launcher: RuoteAMQP Launcher, only used from the worker thread
+    :param log: Logger
+    :param batch_size: Maximum number of launches per batch
+    :param report_interval: Seconds between statistics log lines
+    """
+
+    def __init__(self, launcher, log, batch_size=50, report_interval=60):
+        self.launcher = launcher
+        self.log = log
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._reported = time.time()
+        self._stats = {"launched": 0, "failed": 0, "batches": 0,
+                       "latency_total": 0.0, "latency_max": 0.0}
+
+    def start(self):
+        """Start the worker thread."""
+        self._thread = threading.Thread(target=self._run, name="launcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Launch queued processes and stop the worker thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def put(self, process, fields):
+        """Queue process launch.
+
+        :param process: Process definition
+        :param fields: Workitem fields, must not be modified afterwards
+        """
+        self._queue.put((time.time(), process, fields))
+
+    def join(self):
+        """Wait until all queued processes have been launched."""
+        self._queue.join()
+
+    def stats(self):
+        """Returns launch statistics.
+
+        :returns: dict with queue depth, launched and failed counts, number
+            of batches and average and maximum latency in seconds from
+            queueing to publishing
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        latency_total = stats.pop("latency_total")
+        stats["latency_avg"] = latency_total / stats["launched"] \
+                if stats["launched"] else 0.0
+        stats["depth"] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        """Worker thread."""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            try:
+                if batch:
+                    self._launch(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+            if stop:
+                break
+
+    def _launch(self, batch):
+        """Publish a batch of launches."""
+        launched = []
+        failed = 0
+        for queued, process, fields in batch:
+            try:
+                self.launcher.launch(process, fields)
+                launched.append(queued)
+            except Exception:
+                failed += 1
+                self.log.exception("Failed to launch process for %s",
+                                   fields.get("project"))
+
+        now = time.time()
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["failed"] += failed
+            self._stats["launched"] += len(launched)
+            for queued in launched:
+                self._stats["latency_total"] += now - queued
+                self._stats["latency_max"] = max(self._stats["latency_max"],
+                                                 now - queued)
+        if now - self._reported >= self.report_interval:
+            self._reported = now
+            self.log.info("Launch queue: %s" % json.dumps(self.stats(),
+                                                          sort_keys=True))
 
 
 class ParticipantHandler(object):
@@ -12,10 +360,13 @@ class ParticipantHandler(object):
     def __init__(self):
 
         self.process_store = None
+        self.store = None
         self.irc_botport = None
         self.irc_bothost = None
         self.launcher = None
+        self.launches = None
         self.irc_channel = None
+        self._notices = None
 
     def notify(self, msg):
         """ This irc notifier will go.
@@ -27,7 +378,17 @@ class ParticipantHandler(object):
             not to rely on the presence of ircbot around (use python
             logging instead)
             See https://projects.maemo.org/bugzilla/show_bug.cgi?id=277361
+
+        Messages are sent from a separate thread once the participant has
+        been started, so a slow ircbot doesn't hold up event dispatching.
         """
+        if self._notices is not None:
+            self._notices.put(msg)
+        else:
+            self._notify(msg)
+
+    def _notify(self, msg):
+        """Send notification to ircbot and log."""
         if self.irc_bothost:
             ircbot = socket.socket()
             ircbot.connect((self.irc_bothost, self.irc_botport))
@@ -35,6 +396,17 @@ class ParticipantHandler(object):
             ircbot.close()
         self.log.info(msg)
 
+    def _notifier(self, notices):
+        """Notification thread."""
+        while True:
+            msg = notices.get()
+            if msg is None:
+                break
+            try:
+                self._notify(msg)
+            except Exception:
+                self.log.exception("Failed to send notification")
+
     def handle_wi_control(self, ctrl):
         pass
 
@@ -53,6 +425,28 @@ class ParticipantHandler(object):
             amqp_vhost = ctrl.config.get("boss","amqp_vhost")
             self.launcher = Launcher(amqp_host=amqp_host,  amqp_user=amqp_user,
                                      amqp_pass=amqp_pwd, amqp_vhost=amqp_vhost)
+            interval = ctrl.config.getint("robogrator", "scan_interval") if (
+                ctrl.config.has_option("robogrator", "scan_interval")) else 10
+            self.store = ProcessStore(self.process_store, self.log, interval)
+            self.store.start()
+            batch = ctrl.config.getint("robogrator", "launch_batch") if (
+                ctrl.config.has_option("robogrator", "launch_batch")) else 50
+            self.launches = LaunchQueue(self.launcher, self.log, batch)
+            self.launches.start()
+            self._notices = Queue()
+            notifier = threading.Thread(target=self._notifier,
+                                        args=(self._notices,),
+                                        name="notifier")
+            notifier.daemon = True
+            notifier.start()
+        elif ctrl.message == "stop":
+            if self.store:
+                self.store.stop()
+            if self.launches:
+                self.launches.stop()
+            if self._notices is not None:
+                self._notices.put(None)
+                self._notices = None
 
     def handle_wi(self, wi):
         self.log.debug(json.dumps(wi.to_h(), sort_keys=True, indent=4))
@@ -132,68 +526,23 @@ class ParticipantHandler(object):
         but NOT:
         "key": "value" # A comment
 
+        Processes are looked up from the in-memory ProcessStore index, which
+        follows changes in the process store directory.
+
         :param trigger: The triggering event
         :param project: Project directory to use
         :returns: Generator that yields tuples consisting of process and config
         """
 
-        process = None
-        pbase = os.path.join(self.process_store, project.replace(':', '/'),
-                             trigger)
-        # OLD name for backward compat
-        try:
-            with open(pbase, 'r') as pdef_file:
-                process = pdef_file.read()
-            self.log.warning("Found old style pdef %s" % pbase)
-            self.log.warning("*"*80)
-            self.log.warning("DEPRECATED: please rename process at \n%s" % pbase)
-            self.log.warning("*"*80)
-            yield None, process
-        except IOError:
-            # if there is no file found or there are any weird errors due 
-            # to race conditions like the file is removed before or while
-            # reading it, skip the exception
-            pass
-
-        # iglob returns an iterator which will do the right thing when empty
-        for filename in iglob("%s.*.pdef" % pbase):
-            try:
-                with open(filename, 'r') as pdef_file:
-                    process = pdef_file.read()
-                self.log.info("Found pdef %s" % filename)
-            except IOError as exc:
-                # Any weird errors due to race conditions are ignored
-                # for example the file is removed before or while reading it
-                self.log.info("I/O error({0}): {1} {2}".format(exc.errno, exc.strerror,
-                                                       exc.filename))
-                continue
-
-            try:
-                config = None
-                with open("%s.conf" % filename[:-5], 'r') as config_file:
-                    lines = [line.strip() if not line.strip().startswith('#') \
-                             else "" for line in config_file.readlines()]
-                    config = json.loads("\n".join(lines))
-                self.log.info("Found valid conf %s.conf" % filename[:-5])
-            except IOError as exc:
-                # we don't care if there is no .conf file
-                # so we ignore errorcode 2 which is file not found
-                # otherwise self.log.info(the error and don't launch the process)
-                if not exc.errno == 2:
-                    err = "I/O error({0}): {1} {2}".format(exc.errno,
-                                                           exc.strerror,
-                                                           exc.filename)
-                    self.log.error(err)
-                    raise RuntimeError(err)
-            except ValueError, error:
-                # if a .conf was found but is invalid don't launch the process
-                err = "invalid conf file %s.conf\n%s" % (filename, error)
-                self.notify(err)
-                raise RuntimeError(err)
-
-            yield config, process
+        for entry in self.store.get(trigger, project):
+            if entry.error:
+                if entry.notify:
+                    self.notify(entry.error)
+                raise RuntimeError(entry.error)
+            yield entry.config, entry.process
 
     def launch(self, name, **kwargs):
+        """Queue launches of the processes for an event in a project."""
         # Specify a process definition
         if 'project' in kwargs:
             project = kwargs['project']
@@ -203,5 +552,5 @@ class ParticipantHandler(object):
                     for key, value in config.iteritems():
                         kwargs[key] = value
                 self.notify("Launching %s in %s" % (name, project))
-                self.launcher.launch(process, kwargs)
+                self.launches.put(process, dict(kwargs))
 
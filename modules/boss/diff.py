@@ -0,0 +1,300 @@
+"""Line diff algorithms returning only the changed lines.
+
+Backends take two sequences of lines and return matching blocks as
+(a_index, b_index, length) tuples, ending with a (len(a), len(b), 0) sentinel
+like difflib.SequenceMatcher.get_matching_blocks(). Available backends are
+listed in DIFF_BACKENDS:
+
+ * myers: Myers' O(ND) algorithm in linear space, fast when the inputs
+   have few differences
+ * patience: anchors on lines unique to both inputs and diffs the gaps
+   between them with myers, gives readable diffs of reordered code
+ * difflib: difflib.SequenceMatcher, kept for comparison
+
+Example::
+
+    changed_lines(old_lines, new_lines, backend="patience")
+    unified_diff(old_lines, new_lines, "a/file", "b/file")
+
+"""
+
+import difflib
+from bisect import bisect_left
+
+
+def _intern_lines(a, b):
+    """Map lines of both sequences to small integers for fast comparison."""
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in a]
+    b = [ids.setdefault(line, len(ids)) for line in b]
+    return a, b
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi):
+    """Find the middle snake of the shortest edit script of two ranges.
+
+    :returns: (x, y, u, v) where a[x:u] == b[y:v] lies on an optimal path
+    """
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    offset = n + m + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+    for d in xrange((n + m + 1) // 2 + 1):
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and
+                           forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            # reverse diagonal of forward diagonal k is delta - k
+            if odd and -d < delta - k < d and \
+                    x + backward[offset + delta - k] >= n:
+                return alo + start_x, blo + start_y, alo + x, blo + y
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] <
+                           backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and \
+                    a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and \
+                    x + forward[offset + delta - k] >= n:
+                return (alo + n - x, blo + m - y,
+                        alo + n - start_x, blo + m - start_y)
+    raise AssertionError("no middle snake found")
+
+
+def _myers(a, alo, ahi, b, blo, bhi, blocks):
+    """Append matching blocks of a[alo:ahi] and b[blo:bhi] to blocks."""
+    # explicit stack of ranges to diff and blocks to emit, in reverse order
+    stack = [(alo, ahi, blo, bhi, 0)]
+    while stack:
+        alo, ahi, blo, bhi, size = stack.pop()
+        if size:
+            blocks.append((alo, blo, size))
+            continue
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        prefix = alo - start
+        end = ahi
+        while ahi > alo and bhi > blo and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if end > ahi:
+            stack.append((ahi, None, bhi, None, end - ahi))
+        # ranges without common lines are replaced completely
+        if alo < ahi and blo < bhi and \
+                not set(a[alo:ahi]).isdisjoint(b[blo:bhi]):
+            x, y, u, v = _middle_snake(a, alo, ahi, b, blo, bhi)
+            stack.append((u, ahi, v, bhi, 0))
+            if u > x:
+                stack.append((x, None, y, None, u - x))
+            stack.append((alo, x, blo, y, 0))
+        if prefix:
+            stack.append((alo - prefix, None, blo - prefix, None, prefix))
+
+
+def _merge_blocks(blocks, alen, blen):
+    """Join adjacent blocks and add the end sentinel."""
+    result = []
+    for i, j, size in blocks:
+        if result and result[-1][0] + result[-1][2] == i and \
+                result[-1][1] + result[-1][2] == j:
+            result[-1] = (result[-1][0], result[-1][1], result[-1][2] + size)
+        else:
+            result.append((i, j, size))
+    result.append((alen, blen, 0))
+    return result
+
+
+def myers_blocks(a, b):
+    """Matching blocks of two line sequences with Myers' algorithm."""
+    a, b = _intern_lines(a, b)
+    blocks = []
+    _myers(a, 0, len(a), b, 0, len(b), blocks)
+    return _merge_blocks(blocks, len(a), len(b))
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """Longest increasing sequence of lines unique in both ranges.
+
+    :returns: List of (a_index, b_index) pairs in order
+    """
+    counts = {}
+    for i in xrange(alo, ahi):
+        line = a[i]
+        counts[line] = (counts[line][0] + 1, i) if line in counts else (1, i)
+    b_index = {}
+    for j in xrange(blo, bhi):
+        line = b[j]
+        if counts.get(line, (0,))[0] == 1:
+            b_index[line] = None if line in b_index else j
+    pairs = sorted(
+        (counts[line][1], j) for line, j in b_index.iteritems()
+        if j is not None)
+    # patience sorting on b indexes, piles keep index of their top pair
+    tops = []
+    piles = []
+    previous = [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        pile = bisect_left(tops, j)
+        if pile == len(tops):
+            tops.append(j)
+            piles.append(index)
+        else:
+            tops[pile] = j
+            piles[pile] = index
+        previous[index] = piles[pile - 1] if pile else None
+    result = []
+    index = piles[-1] if piles else None
+    while index is not None:
+        result.append(pairs[index])
+        index = previous[index]
+    result.reverse()
+    return result
+
+
+def patience_blocks(a, b):
+    """Matching blocks of two line sequences with patience diff."""
+    a, b = _intern_lines(a, b)
+    blocks = []
+    # explicit stack of ranges to diff and single line anchors to emit
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        if ahi is None:
+            blocks.append((alo, blo, 1))
+            continue
+        if alo >= ahi or blo >= bhi:
+            continue
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if not anchors:
+            _myers(a, alo, ahi, b, blo, bhi, blocks)
+            continue
+        items = []
+        for i, j in anchors:
+            items.append((alo, i, blo, j))
+            items.append((i, None, j, None))
+            alo, blo = i + 1, j + 1
+        items.append((alo, ahi, blo, bhi))
+        stack.extend(reversed(items))
+    return _merge_blocks(blocks, len(a), len(b))
+
+
+def difflib_blocks(a, b):
+    """Matching blocks of two line sequences with difflib."""
+    return difflib.SequenceMatcher(None, a, b, autojunk=False) \
+        .get_matching_blocks()
+
+
+DIFF_BACKENDS = {
+    "myers": myers_blocks,
+    "patience": patience_blocks,
+    "difflib": difflib_blocks,
+}
+
+
+def get_opcodes(a, b, backend="patience"):
+    """Opcodes as difflib.SequenceMatcher.get_opcodes() from a backend.
+
+    :raises: ValueError if backend is not known
+    """
+    try:
+        blocks = DIFF_BACKENDS[backend](a, b)
+    except KeyError:
+        raise ValueError("Unknown diff backend %s" % backend)
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in blocks:
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(("insert", i, ai, j, bj))
+        if size:
+            opcodes.append(("equal", ai, ai + size, bj, bj + size))
+        i, j = ai + size, bj + size
+    return opcodes
+
+
+def changed_lines(a, b, backend="patience"):
+    """Removed and added lines prefixed with "- " and "+ " like difflib.Differ
+
+    Unlike difflib.Differ no intraline "? " hints are produced, and removed
+    lines of each change come before the added ones.
+    """
+    result = []
+    for tag, alo, ahi, blo, bhi in get_opcodes(a, b, backend):
+        if tag == "equal":
+            continue
+        result.extend("- " + line for line in a[alo:ahi])
+        result.extend("+ " + line for line in b[blo:bhi])
+    return result
+
+
+def _hunk_range(start, stop):
+    """Unified diff range of a hunk."""
+    length = stop - start
+    if length == 1:
+        return "%d" % (start + 1)
+    if not length:
+        start -= 1
+    return "%d,%d" % (start + 1, length)
+
+
+def unified_diff(a, b, fromfile="", tofile="", n=3, backend="patience"):
+    """Unified diff lines like difflib.unified_diff() from a backend."""
+    opcodes = get_opcodes(a, b, backend)
+    if all(code[0] == "equal" for code in opcodes):
+        return []
+    # group changes with n lines of context like
+    # difflib.SequenceMatcher.get_grouped_opcodes()
+    if opcodes[0][0] == "equal":
+        tag, alo, ahi, blo, bhi = opcodes[0]
+        opcodes[0] = tag, max(alo, ahi - n), ahi, max(blo, bhi - n), bhi
+    if opcodes[-1][0] == "equal":
+        tag, alo, ahi, blo, bhi = opcodes[-1]
+        opcodes[-1] = tag, alo, min(ahi, alo + n), blo, min(bhi, blo + n)
+    groups = []
+    group = []
+    for tag, alo, ahi, blo, bhi in opcodes:
+        if tag == "equal" and ahi - alo > 2 * n:
+            group.append((tag, alo, min(ahi, alo + n), blo,
+                          min(bhi, blo + n)))
+            groups.append(group)
+            group = []
+            alo, blo = max(alo, ahi - n), max(blo, bhi - n)
+        group.append((tag, alo, ahi, blo, bhi))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        groups.append(group)
+
+    result = ["--- %s\n" % fromfile, "+++ %s\n" % tofile]
+    for group in groups:
+        result.append("@@ -%s +%s @@\n" % (
+            _hunk_range(group[0][1], group[-1][2]),
+            _hunk_range(group[0][3], group[-1][4])))
+        for tag, alo, ahi, blo, bhi in group:
+            if tag == "equal":
+                result.extend(" " + line for line in a[alo:ahi])
+                continue
+            result.extend("-" + line for line in a[alo:ahi])
+            result.extend("+" + line for line in b[blo:bhi])
+    return result
@@ -0,0 +1,253 @@
+"""Persistent connection support for urllib2.
+
+KeepAliveHandler keeps HTTP(S) connections open after a response has been
+read and reuses them for the following requests to the same host, so that
+sequential API calls don't pay for a new TCP connection and TLS handshake
+each time.
+
+Example::
+
+    opener = urllib2.build_opener(KeepAliveHandler(max_connections=4))
+    opener.open("https://api.example.com/about").read()
+    # Reuses the connection opened above
+    opener.open("https://api.example.com/about").read()
+
+"""
+
+import errno
+import httplib
+import socket
+import threading
+import time
+import urllib2
+
+# Largest response rest read on close to keep the connection, bigger rests
+# are cheaper to drop together with the connection
+DRAIN_LIMIT = 64 * 1024
+
+# Socket errors meaning the server dropped an idle connection
+STALE_ERRORS = (errno.ECONNRESET, errno.EPIPE)
+
+
+class _PooledResponse(object):
+    """httplib.HTTPResponse wrapper returning the connection to the pool.
+
+    Connection is released when the response has been read completely or
+    when the response is closed.
+    """
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+
+    def read(self, amt=None):
+        """Read response body."""
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._done(True)
+        return data
+
+    # socket._fileobject reads from recv()
+    recv = read
+
+    def close(self):
+        """Close response, draining it so the connection can be reused.
+
+        If more than DRAIN_LIMIT bytes are left the connection is closed
+        instead.
+        """
+        reusable = not self._response.will_close
+        if reusable and self._release is not None:
+            reusable = self._drain()
+        self._response.close()
+        self._done(reusable)
+
+    def _drain(self):
+        """Read up to DRAIN_LIMIT bytes of the rest of the body.
+
+        :returns: True if the whole body has been read
+        """
+        # length is None for chunked responses
+        remaining = self._response.length
+        if remaining is not None and remaining > DRAIN_LIMIT:
+            return False
+        drained = 0
+        try:
+            while not self._response.isclosed() and drained <= DRAIN_LIMIT:
+                data = self._response.read(8192)
+                if not data:
+                    break
+                drained += len(data)
+        except (socket.error, httplib.HTTPException):
+            return False
+        return self._response.isclosed()
+
+    def _done(self, reusable):
+        """Release the connection once."""
+        release, self._release = self._release, None
+        if release is not None:
+            release(reusable and not self._response.will_close)
+
+    def __del__(self):
+        self._done(False)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class _HostPool(object):
+    """Idle connections and in-flight counter for one host."""
+
+    def __init__(self):
+        self.idle = []
+        self.active = 0
+        self.cond = threading.Condition()
+
+
+class KeepAliveHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
+    """urllib2 handler reusing HTTP and HTTPS connections.
+
+    :param max_connections: Maximum number of concurrent connections per host.
+        Requests over the limit wait up to `wait_timeout` seconds for a free
+        connection and then go ahead with an extra connection.
+    :param context: ssl.SSLContext used for HTTPS connections. Without a
+        context HTTPS requests are left to the next handler.
+    :param wait_timeout: Seconds to wait for a free connection
+    """
+
+    # Run before the default handlers
+    handler_order = 400
+
+    def __init__(self, max_connections=4, context=None, wait_timeout=30):
+        urllib2.HTTPHandler.__init__(self)
+        urllib2.HTTPSHandler.__init__(self)
+        self.max_connections = max_connections
+        self.wait_timeout = wait_timeout
+        self._context = context
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def http_open(self, req):
+        """Open HTTP request."""
+        return self._open(httplib.HTTPConnection, req)
+
+    def https_open(self, req):
+        """Open HTTPS request.
+
+        Requests through a proxy need a CONNECT tunnel and are left to the
+        next handler like requests without an SSL context.
+        """
+        if self._context is None or req.has_proxy():
+            return None
+        return self._open(self._https_connection, req)
+
+    def close_all(self):
+        """Close all idle connections."""
+        with self._lock:
+            pools = self._pools.values()
+        for pool in pools:
+            with pool.cond:
+                idle, pool.idle = pool.idle, []
+            for conn in idle:
+                conn.close()
+
+    def _https_connection(self, host, timeout):
+        """Create HTTPS connection with configured SSL context."""
+        return httplib.HTTPSConnection(host, timeout=timeout,
+                context=self._context)
+
+    def _pool(self, key):
+        """Get pool for connection key."""
+        with self._lock:
+            return self._pools.setdefault(key, _HostPool())
+
+    def _checkout(self, pool):
+        """Wait for a connection slot and return idle connection if any."""
+        with pool.cond:
+            deadline = time.time() + self.wait_timeout
+            while pool.active >= self.max_connections:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                pool.cond.wait(remaining)
+            pool.active += 1
+            if pool.idle:
+                return pool.idle.pop()
+        return None
+
+    def _checkin(self, pool, conn, reusable):
+        """Give connection slot back and keep connection if reusable."""
+        with pool.cond:
+            pool.active -= 1
+            if reusable and len(pool.idle) < self.max_connections:
+                pool.idle.append(conn)
+                conn = None
+            pool.cond.notify()
+        if conn is not None:
+            conn.close()
+
+    def _open(self, conn_class, req):
+        """Send request over pooled connection."""
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError("no host given")
+        timeout = req.timeout
+        pool = self._pool((conn_class, host))
+        conn = self._checkout(pool)
+        try:
+            response = None
+            if conn is not None:
+                try:
+                    response = self._request(conn, req)
+                except (socket.error, httplib.HTTPException), exobj:
+                    if not (self._stale(exobj) and self._replayable(req)):
+                        raise
+                    # Server closed the idle connection, retry on a new one
+                    conn.close()
+            if response is None:
+                conn = conn_class(host, timeout=timeout)
+                response = self._request(conn, req)
+        except (socket.error, httplib.HTTPException), exobj:
+            if conn is not None:
+                conn.close()
+            self._checkin(pool, conn, False)
+            raise urllib2.URLError(exobj)
+        except:
+            self._checkin(pool, conn, False)
+            raise
+
+        pooled = _PooledResponse(response,
+                lambda reusable: self._checkin(pool, conn, reusable))
+        fileobj = socket._fileobject(pooled, close=True)
+        resp = urllib2.addinfourl(fileobj, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+    @staticmethod
+    def _stale(exobj):
+        """Check if error means the reused connection was already closed.
+
+        Only a missing status line or a reset connection qualify, other
+        errors may come after the server has acted on the request.
+        """
+        if isinstance(exobj, httplib.BadStatusLine):
+            return True
+        return isinstance(exobj, socket.error) and \
+                exobj.errno in STALE_ERRORS
+
+    @staticmethod
+    def _replayable(req):
+        """Check if request can be sent again without side effects."""
+        return req.get_method() in ("GET", "HEAD") or not req.has_data()
+
+    @staticmethod
+    def _request(conn, req):
+        """Send request and get response."""
+        headers = dict(req.unredirected_hdrs)
+        headers.update(req.headers)
+        headers["Connection"] = "keep-alive"
+        headers = dict((name.title(), val) for name, val in headers.items())
+        conn.request(req.get_method(), req.get_selector(), req.get_data(),
+                headers)
+        return conn.getresponse(buffering=True)
@@ -1,19 +1,42 @@
 """This module provides utilities to work with temporary files."""
 
-import difflib, os, shutil, tempfile, re
+import errno, fcntl, hashlib, os, shutil, stat, tempfile, re
+
+from boss.diff import DIFF_BACKENDS, changed_lines, unified_diff
+
+# ioctl to share file data copy-on-write (linux/fs.h)
+FICLONE = 0x40049409
+
+# files larger than this are compared by checksum in get_diff()
+DIFF_MAX_SIZE = 8 * 1024 * 1024
+
 
 class Lab(object):
     """Controlled temporary directory with snapshot support.
 
     Can be used with 'with' statement to create disposable file storage.
+
+    Snapshots don't copy file data. Files are reflinked where the filesystem
+    supports it and hard linked otherwise, so a snapshot and the working copy
+    share the same inode until the file is written. Lab.open() and
+    Lab.store() copy shared files up before writing. Code writing files
+    under real_path() should replace them instead of rewriting in place, or
+    call copy_up() first.
     """
 
     __parent = re.compile("(^|\/)\.\.(\/|$)")
 
-    def __init__(self, prefix=""):
+    def __init__(self, prefix="", diff_backend="patience",
+                 max_diff_size=DIFF_MAX_SIZE):
+        if diff_backend not in DIFF_BACKENDS:
+            raise ValueError("Unknown diff backend %s" % diff_backend)
         self._prefix = prefix
+        self.diff_backend = diff_backend
+        self.max_diff_size = max_diff_size
         path = tempfile.mkdtemp(prefix=prefix)
         self._history = [path]
+        # None until known whether the filesystem supports reflinks
+        self._reflink = None
 
     def _snapshot_root(self, sid):
         """Returns snapshot root path."""
@@ -33,15 +56,115 @@ class Lab(object):
         :returns: Snapshot ID
         """
         path = tempfile.mkdtemp(prefix=self._prefix)
-        for name in os.listdir(self.path):
-            src = os.path.join(self.path, name)
-            if os.path.isdir(src):
-                shutil.copytree(src, os.path.join(path, name))
-            else:
-                shutil.copy2(src, path)
+        for root, dirs, files in os.walk(self.path):
+            target = os.path.join(path, os.path.relpath(root, self.path))
+            for name in dirs:
+                src = os.path.join(root, name)
+                if os.path.islink(src):
+                    files.append(name)
+                else:
+                    os.mkdir(os.path.join(target, name))
+            for name in files:
+                self._share(os.path.join(root, name),
+                            os.path.join(target, name))
+        for root, dirs, _ in os.walk(self.path):
+            # directory times change while files are added
+            for name in dirs + [""]:
+                src = os.path.join(root, name)
+                if not os.path.islink(src):
+                    shutil.copystat(src, os.path.join(
+                        path, os.path.relpath(src, self.path)))
         self._history.append(path)
         return len(self._history) - 1
 
+    def _share(self, src, dst):
+        """Make dst a snapshot of file src without copying data."""
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return
+        if self._reflink is not False and self._clone(src, dst):
+            return
+        try:
+            os.link(src, dst)
+        except OSError:
+            # e.g. cross device link or special file
+            shutil.copy2(src, dst)
+
+    def _clone(self, src, dst):
+        """Reflink src to dst, returns False if not supported."""
+        if not stat.S_ISREG(os.lstat(src).st_mode):
+            return False
+        with open(src, "rb") as src_file:
+            with open(dst, "wb") as dst_file:
+                try:
+                    fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+                except (IOError, OSError):
+                    self._reflink = False
+            if self._reflink is False:
+                os.unlink(dst)
+                return False
+        self._reflink = True
+        shutil.copystat(src, dst)
+        return True
+
+    def copy_up(self, name):
+        """Stop sharing a working copy file with snapshots.
+
+        Needs to be called before modifying a file in place without Lab.open()
+        after a snapshot has been taken.
+
+        :param name: File name
+        """
+        self._copy_up(self.real_path(name))
+
+    def _copy_up(self, path):
+        """Replace shared file with a copy of it."""
+        try:
+            if os.lstat(path).st_nlink < 2 or not os.path.isfile(path):
+                return
+        except OSError, exc:
+            if exc.errno == errno.ENOENT:
+                return
+            raise
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                   prefix=".copy_up")
+        os.close(fd)
+        try:
+            shutil.copy2(path, tmp)
+            os.rename(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def changed_files(self, from_sid, to_sid=0):
+        """List files which differ between two snapshots.
+
+        Only file metadata is compared: files sharing the inode are
+        unchanged, files with different size or modification time are
+        changed. Content changes not showing in size or time are missed.
+
+        :param from_sid: Snapshot ID to compare from
+        :param to_sid: Snapshot id to compare to, default current working copy
+        :returns: Sorted list of added, removed and changed file names
+        """
+        from_files = self._file_stats(from_sid)
+        to_files = self._file_stats(to_sid)
+        return sorted(
+            name for name in set(from_files) | set(to_files)
+            if not _same_stat(from_files.get(name), to_files.get(name))
+        )
+
+    def _file_stats(self, sid):
+        """Get {name: lstat result} of non directories in snapshot."""
+        root = self._snapshot_root(sid)
+        result = {}
+        for dirpath, dirs, files in os.walk(root):
+            for name in files + [name for name in dirs if
+                                 os.path.islink(os.path.join(dirpath, name))]:
+                path = os.path.join(dirpath, name)
+                result[os.path.relpath(path, root)] = os.lstat(path)
+        return result
+
     def store(self, name, content):
         """Saves a file in the lab.
 
@@ -51,8 +174,18 @@ class Lab(object):
         path = self.real_path(name)
         if isinstance(content, basestring):
             content = [content]
+        self._unshare(path)
         open(path, "w").writelines(content)
 
+    def _unshare(self, path):
+        """Remove file which is about to be truncated if it is shared."""
+        try:
+            if os.lstat(path).st_nlink > 1 and os.path.isfile(path):
+                os.unlink(path)
+        except OSError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
     def mkdir(self, path, mode=0777):
         """os.mkdir() equivalent except works under lab dir."""
         os.mkdir(self.real_path(path), mode)
@@ -71,26 +204,54 @@ class Lab(object):
         Snapshot files can only be opened for reading
         """
         sid = kwargs.pop("sid", 0)
+        mode = kwargs.get("mode", None) or (args + (None, None))[1]
         if sid:
-            mode = kwargs.get("mode", None) or (args + (None, None))[1]
             if mode and ("w" in mode or "a" in mode):
                 raise ValueError("Snapshots are not supposed to be altered")
         if args:
             name = self.real_path(args[0], sid)
             args = (name,) + args[1:]
         elif kwargs.has_key("name"):
-            kwargs["name"] = self.real_path(kwargs["name"], sid)
+            name = kwargs["name"] = self.real_path(kwargs["name"], sid)
+        if not sid and mode:
+            if "w" in mode:
+                self._unshare(name)
+            elif "a" in mode or "+" in mode:
+                self._copy_up(name)
 
         return open(*args, **kwargs)
 
-    def get_diff(self, name, from_sid, to_sid=0):
+    def get_diff(self, name, from_sid, to_sid=0, unified=False, context=3):
         """Compares the original file content between two snapshots
 
+        Files larger than max_diff_size are not diffed, if their checksums
+        differ a single "! <name> changed ..." line is returned.
+
         :param name: File name
         :param from_sid: Snapshot ID to compare from
         :param to_sid: Snapshot id to compare to, default current working copy
-        :returns: List of changed lines
+        :param unified: Return unified diff instead of changed lines
+        :param context: Number of context lines in unified diff
+        :returns: List of changed lines prefixed with "- " or "+ ", or
+            unified diff lines
         """
+        from_path = self.real_path(name, from_sid)
+        to_path = self.real_path(name, to_sid)
+        try:
+            if os.path.samefile(from_path, to_path):
+                # file is shared with the snapshot, nothing changed
+                return []
+        except OSError:
+            pass
+        if self.max_diff_size is not None and max(
+                _file_size(from_path), _file_size(to_path)) > \
+                self.max_diff_size:
+            from_digest = _digest(from_path)
+            to_digest = _digest(to_path)
+            if from_digest == to_digest:
+                return []
+            return ["! %s changed, sha1 %s -> %s\n" % (
+                name, from_digest or "missing", to_digest or "missing")]
         try:
             from_lines = self.open(name, sid=from_sid).readlines()
         except IOError, exc:
@@ -106,8 +267,12 @@ class Lab(object):
             else:
                 raise
 
-        diff = difflib.Differ().compare(from_lines, to_lines)
-        return [line for line in diff if not line.startswith("  ")]
+        if unified:
+            return unified_diff(from_lines, to_lines,
+                                "%s@%d" % (name, from_sid),
+                                "%s@%d" % (name, to_sid),
+                                context, self.diff_backend)
+        return changed_lines(from_lines, to_lines, self.diff_backend)
 
     def real_path(self, path, sid=0):
         """Get file path.
@@ -138,3 +303,37 @@ class Lab(object):
     def __exit__(self, exc_type, exc_value, traceback):
         """Managed context exit point."""
         self.cleanup()
+
+
+def _file_size(path):
+    """Size of file, 0 if it doesn't exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError, exc:
+        if exc.errno == errno.ENOENT:
+            return 0
+        raise
+
+
+def _digest(path):
+    """SHA1 hex digest of file, None if it doesn't exist."""
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as fobj:
+            for chunk in iter(lambda: fobj.read(65536), ""):
+                digest.update(chunk)
+    except IOError, exc:
+        if exc.errno == errno.ENOENT:
+            return None
+        raise
+    return digest.hexdigest()
+
+
+def _same_stat(one, two):
+    """Decide from lstat results whether two files are the same."""
+    if one is None or two is None:
+        return one is two
+    if (one.st_ino, one.st_dev) == (two.st_ino, two.st_dev):
+        return True
+    return (stat.S_IFMT(one.st_mode) == stat.S_IFMT(two.st_mode) and
+            one.st_size == two.st_size and one.st_mtime == two.st_mtime)
@@ -1,16 +1,845 @@
 """Helper classes for participants which deal with OBS."""
 
+import json
 import os
-from functools import wraps
+import sqlite3
+import ssl
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from copy import deepcopy
+from functools import WRAPPER_ASSIGNMENTS, wraps
+from Queue import Queue
 from urllib2 import HTTPError
 
 from buildservice import BuildService
+from lxml import etree
+from osc import conf as osc_conf
+from osc import core as osc_core
+
+from boss.keepalive import KeepAliveHandler
 
 
 class OBSError(Exception):
     """Exception identifying OBS errors."""
     pass
 
+
+class MetadataCache(object):
+    """Thread safe in-memory cache for OBS metadata.
+
+    Entries expire after `lifetime` seconds and the least recently used entry
+    is evicted once the cache holds `size` entries. Keys are tuples starting
+    with (apiurl, project), which allows dropping everything known about a
+    project at once.
+
+    No process is started for OBS project change events, so the lifetime is
+    the bound on how stale an entry can be.
+
+    Hit, miss, eviction and invalidation counters are available through
+    stats().
+    """
+
+    def __init__(self, lifetime=300, size=256):
+        self.lifetime = lifetime
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+                ["hits", "misses", "evictions", "invalidations"], 0)
+
+    def configure(self, lifetime=None, size=None):
+        """Change cache limits, existing entries are kept.
+
+        :param lifetime: Entry lifetime in seconds, 0 disables caching
+        :param size: Maximum number of entries
+        """
+        with self._lock:
+            if lifetime is not None:
+                self.lifetime = lifetime
+            if size is not None:
+                self.size = size
+            self._shrink()
+
+    def get(self, key):
+        """Get cached value.
+
+        :param key: Cache key tuple
+        :returns: Cached value or None if not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self._counters["misses"] += 1
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = entry
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store value in cache.
+
+        :param key: Cache key tuple
+        :param value: Value to cache
+        """
+        if not self.lifetime or not self.size:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.lifetime, value)
+            self._shrink()
+
+    def invalidate(self, *prefix):
+        """Drop all entries whose key starts with given values.
+
+        Example::
+
+            # Forget everything cached about a project
+            cache.invalidate(apiurl, project)
+
+        :returns: Number of dropped entries
+        """
+        count = len(prefix)
+        with self._lock:
+            keys = [key for key in self._entries if key[:count] == prefix]
+            for key in keys:
+                del self._entries[key]
+            self._counters["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Get cache statistics.
+
+        :returns: Dictionary with hits, misses, evictions, invalidations and
+            current number of entries
+        """
+        with self._lock:
+            result = dict(self._counters)
+            result["entries"] = len(self._entries)
+        return result
+
+    def _shrink(self):
+        """Evict least recently used entries over the size limit.
+
+        Caller must hold the lock.
+        """
+        while len(self._entries) > max(self.size, 0):
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+
+# Participant process wide cache for project repository information, kept
+# short lived as expiry is what picks up most project changes
+PROJECT_CACHE = MetadataCache(lifetime=60)
+
+
+class BinaryInfoCache(object):
+    """Persistent binary info cache shared by processes on the same host.
+
+    getBinaryInfo output of a built binary never changes, so it is stored in
+    a sqlite database (WAL mode) keyed by apiurl, project, target, package
+    and binary file name, which includes the build count in the release.
+    Entries of a package are dropped when OBS reports it was rebuilt and the
+    least recently used entries are evicted when the cache holds more than
+    `size` entries.
+
+    The database is opened on first use. Database errors are not fatal, they
+    just make lookups miss, and a database that can't be opened disables
+    the cache.
+
+    :param path: Database file path
+    :param size: Maximum number of cached binaries
+    """
+
+    # OBS events after which cached binary info can not be trusted
+    EVENTS = frozenset([
+        "BUILD_SUCCESS",
+        "BUILD_FAIL",
+        "SRCSRV_DELETE_PACKAGE",
+        "SRCSRV_DELETE_PROJECT",
+    ])
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bininfo (
+            apiurl TEXT, project TEXT, target TEXT, package TEXT,
+            binary TEXT, info TEXT, atime REAL,
+            PRIMARY KEY (apiurl, project, target, package, binary));
+        CREATE INDEX IF NOT EXISTS bininfo_atime ON bininfo (atime);
+    """
+
+    def __init__(self, path, size=100000):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(["hits", "misses", "errors"], 0)
+        self._db = None
+        self.disabled = False
+
+    def _connect(self):
+        """Open the database unless done already.
+
+        Caller must hold the lock.
+
+        :returns: sqlite3 connection, None if the database is not usable
+        """
+        if self._db is None and not self.disabled:
+            try:
+                db = sqlite3.connect(self.path, timeout=30,
+                                     check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(self._SCHEMA)
+            except (sqlite3.Error, EnvironmentError, TypeError, ValueError):
+                # e.g. unwritable directory or bad path, run without cache
+                self._counters["errors"] += 1
+                self.disabled = True
+            else:
+                self._db = db
+        return self._db
+
+    def get_many(self, apiurl, project, target, package, binaries):
+        """Get cached binary infos.
+
+        :returns: Dictionary {binary: bininfo} of the cached binaries
+        """
+        binaries = list(binaries)
+        if not binaries:
+            return {}
+        result = {}
+        with self._lock:
+            db = self._connect()
+            try:
+                if db is not None:
+                    with db:
+                        for start in range(0, len(binaries), 500):
+                            chunk = binaries[start:start + 500]
+                            result.update(db.execute(
+                                "SELECT binary, info FROM bininfo WHERE "
+                                "apiurl=? AND project=? AND target=? AND "
+                                "package=? AND binary IN (%s)" %
+                                ",".join("?" * len(chunk)),
+                                [apiurl, project, target, package] + chunk))
+                            db.execute(
+                                "UPDATE bininfo SET atime=? WHERE "
+                                "apiurl=? AND project=? AND target=? AND "
+                                "package=? AND binary IN (%s)" %
+                                ",".join("?" * len(chunk)),
+                                [time.time(), apiurl, project, target,
+                                 package] + chunk)
+            except sqlite3.Error:
+                self._counters["errors"] += 1
+                result = {}
+            self._counters["hits"] += len(result)
+            self._counters["misses"] += len(binaries) - len(result)
+        return dict((binary, json.loads(info))
+                    for binary, info in result.iteritems())
+
+    def put_many(self, apiurl, project, target, package, infos):
+        """Store binary infos.
+
+        :param infos: Dictionary {binary: bininfo}
+        """
+        if not infos:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO bininfo VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?)",
+                        [(apiurl, project, target, package, binary,
+                          json.dumps(info), now)
+                         for binary, info in infos.iteritems()])
+                    self._evict(db)
+            except sqlite3.Error:
+                self._counters["errors"] += 1
+
+    def invalidate(self, apiurl, project, target=None, package=None):
+        """Drop entries of a project, optionally limited to target and
+        package.
+        """
+        query = "DELETE FROM bininfo WHERE apiurl=? AND project=?"
+        args = [apiurl, project]
+        if target is not None:
+            query += " AND target=?"
+            args.append(target)
+        if package is not None:
+            query += " AND package=?"
+            args.append(package)
+        with self._lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                with db:
+                    db.execute(query, args)
+            except sqlite3.Error:
+                self._counters["errors"] += 1
+
+    def handle_event(self, apiurl, event):
+        """Invalidate entries based on OBS event.
+
+        :param apiurl: OBS API URL the event came from
+        :param event: OBS event as passed to processes in ev field
+        :returns: True if the event caused invalidation
+        """
+        if not event or event.get("label") not in self.EVENTS:
+            return False
+        project = event.get("project")
+        if not project:
+            return False
+        target = None
+        if event.get("repository") and event.get("arch"):
+            target = "%s/%s" % (event["repository"], event["arch"])
+        self.invalidate(apiurl, project, target, event.get("package"))
+        return True
+
+    def stats(self):
+        """Get cache statistics.
+
+        :returns: Dictionary with hits, misses and errors
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def _evict(self, db):
+        """Remove least recently used entries over the size limit.
+
+        Caller must hold the lock and transaction.
+        """
+        count = db.execute("SELECT COUNT(*) FROM bininfo").fetchone()[0]
+        if count > self.size:
+            db.execute(
+                "DELETE FROM bininfo WHERE rowid IN (SELECT rowid FROM "
+                "bininfo ORDER BY atime LIMIT ?)", (count - self.size,))
+
+
+# Host wide binary info cache, enabled with [obs] bininfo_cache
+BININFO_CACHE = None
+
+
+# Build result codes which do not count as failures. In a link project,
+# unbuilt packages from the link-source are reported as 'excluded' (which is
+# as good as success)
+OK_RESULTS = frozenset(["succeeded", "excluded", "disabled"])
+
+
+class BuildResults(object):
+    """Build results of a project repository.
+
+    :param state: Result state hash reported by OBS, None if not known
+    :param results: Dictionary {arch: {package: code}} as returned by
+        BuildService.getRepoResults()
+    """
+
+    def __init__(self, state, results):
+        self.state = state
+        self.results = results
+
+
+class BuildResultTracker(object):
+    """Keeps the latest build results of project repositories.
+
+    Results are shared by all users in the process, so concurrent trials
+    against the same target fetch the baseline results once. On every get()
+    OBS is first asked only for the result state hash of the repository and
+    the full results are fetched if the state has changed. Unchanged results
+    are returned as the same BuildResults instance, so users can tell
+    nothing changed by identity.
+
+    With `confirm` set, a snapshot checked within that many seconds is
+    returned without asking OBS unless a build or source event of the
+    project arrived. Events only come with workitems of processes started
+    for them, so this can return results older than the events of request
+    processes, like build states of a trial that has finished since.
+
+    :param lifetime: Seconds to keep results of an untouched repository
+    :param size: Maximum number of repositories to keep results for
+    :param confirm: Seconds to trust a checked snapshot without asking OBS,
+        0 checks the state on every get()
+    """
+
+    # OBS events after which results of the project need to be checked
+    EVENTS = frozenset([
+        "BUILD_SUCCESS",
+        "BUILD_FAIL",
+        "BUILD_UNCHANGED",
+        "SRCSRV_COMMIT",
+        "SRCSRV_DELETE_PACKAGE",
+        "SRCSRV_UPDATE_PROJECT",
+        "SRCSRV_DELETE_PROJECT",
+    ])
+
+    def __init__(self, lifetime=3600, size=128, confirm=0):
+        self.confirm = confirm
+        self._snapshots = MetadataCache(lifetime, size)
+        self._lock = threading.Lock()
+        # (apiurl, project, repo) -> time the snapshot state was checked
+        self._checked = {}
+        self._counters = dict.fromkeys(["fetches", "checks", "reuses"], 0)
+
+    def get(self, obs, project, repo):
+        """Get current build results.
+
+        :param obs: BuildService instance
+        :param project: Project name
+        :param repo: Repository name
+        :returns: BuildResults instance, shared so don't modify it
+        """
+        key = (obs.apiurl, project, repo)
+        snapshot = self._snapshots.get(key + ("results",))
+        if snapshot is not None:
+            with self._lock:
+                trusted = self._checked.get(key, 0) + self.confirm > \
+                        time.time()
+                if trusted:
+                    self._counters["reuses"] += 1
+            if trusted:
+                return snapshot
+
+        checked = time.time()
+        state = self._result_state(obs, project, repo)
+        if (snapshot is not None and state is not None and
+                snapshot.state == state):
+            with self._lock:
+                self._counters["checks"] += 1
+                self._checked[key] = checked
+            return snapshot
+
+        snapshot = BuildResults(state, obs.getRepoResults(project, repo))
+        self._snapshots.put(key + ("results",), snapshot)
+        with self._lock:
+            self._counters["fetches"] += 1
+            if state is not None:
+                self._checked[key] = checked
+            else:
+                self._checked.pop(key, None)
+        return snapshot
+
+    @staticmethod
+    def _result_state(obs, project, repo):
+        """Get result state hash with a summary request, None on failure."""
+        # pylint: disable=W0703
+        try:
+            url = osc_core.makeurl(obs.apiurl, ["build", project, "_result"],
+                    query={"repository": repo, "view": "summary"})
+            return etree.parse(osc_core.http_GET(url)).getroot().get("state")
+        except Exception:
+            return None
+
+    def invalidate(self, apiurl, project, repo=None):
+        """Make results of a project be checked from OBS on next get().
+
+        :param apiurl: OBS API URL
+        :param project: Project name
+        :param repo: Repository name, all repositories if None
+        """
+        with self._lock:
+            for key in self._checked.keys():
+                if key[:2] == (apiurl, project) and repo in (None, key[2]):
+                    del self._checked[key]
+
+    def handle_event(self, apiurl, event):
+        """Invalidate project results based on OBS event.
+
+        :param apiurl: OBS API URL the event came from
+        :param event: OBS event as passed to processes in ev field
+        :returns: True if the event caused invalidation
+        """
+        if not event or event.get("label") not in self.EVENTS:
+            return False
+        project = event.get("project")
+        if not project:
+            return False
+        self.invalidate(apiurl, project, event.get("repository"))
+        return True
+
+    def clear(self):
+        """Drop all results."""
+        self._snapshots.clear()
+        with self._lock:
+            self._checked.clear()
+
+    def stats(self):
+        """Get tracker statistics.
+
+        :returns: Dictionary with counts of full fetches, state checks
+            which found the results unchanged and snapshots reused without
+            asking OBS
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+# Process wide build result snapshots
+BUILD_RESULTS = BuildResultTracker()
+
+
+def handle_event(apiurl, event):
+    """Invalidate cached OBS data based on OBS event.
+
+    :param apiurl: OBS API URL the event came from
+    :param event: OBS event as passed to processes in ev field
+    """
+    BUILD_RESULTS.handle_event(apiurl, event)
+    if BININFO_CACHE is not None:
+        BININFO_CACHE.handle_event(apiurl, event)
+
+# Events handled by handle_event()
+CACHE_EVENTS = BinaryInfoCache.EVENTS | BuildResultTracker.EVENTS
+
+
+class CacheStatsReporter(object):
+    """Logs statistics of the process wide caches periodically.
+
+    :param interval: Seconds between reports, 0 disables reporting
+    """
+
+    def __init__(self, interval=3600):
+        self.interval = interval
+        self._reported = time.time()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """Get statistics of PROJECT_CACHE, BUILD_RESULTS and BININFO_CACHE.
+
+        :returns: Dictionary {cache name: statistics}
+        """
+        stats = {"project_cache": PROJECT_CACHE.stats(),
+                 "build_results": BUILD_RESULTS.stats()}
+        if BININFO_CACHE is not None:
+            stats["bininfo_cache"] = BININFO_CACHE.stats()
+        return stats
+
+    def report(self, log):
+        """Log statistics if interval has passed since the last report.
+
+        :param log: Logger of the participant
+        :returns: True if statistics were logged
+        """
+        now = time.time()
+        with self._lock:
+            if not self.interval or now - self._reported < self.interval:
+                return False
+            self._reported = now
+        log.info("OBS cache statistics: %s" % json.dumps(self.stats(),
+                                                         sort_keys=True))
+        return True
+
+
+# Periodic logging of process wide cache statistics
+CACHE_STATS = CacheStatsReporter()
+
+
+class LatencyHistogram(object):
+    """Thread safe per method latency histogram.
+
+    Bucket upper bounds are in seconds, calls slower than the last bound are
+    counted in the "inf" bucket.
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, seconds):
+        """Record one call duration."""
+        with self._lock:
+            entry = self._methods.get(method)
+            if entry is None:
+                entry = self._methods[method] = {
+                        "count": 0, "sum": 0.0,
+                        "buckets": [0] * (len(self.buckets) + 1)}
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["buckets"][bisect_left(self.buckets, seconds)] += 1
+
+    def stats(self):
+        """Get histogram data.
+
+        :returns: Dictionary {method: {"count": n, "sum": seconds,
+            "buckets": {upper bound: count, ..., "inf": count}}}
+        """
+        labels = [str(bound) for bound in self.buckets] + ["inf"]
+        with self._lock:
+            return dict((method, {
+                    "count": entry["count"],
+                    "sum": entry["sum"],
+                    "buckets": dict(zip(labels, entry["buckets"]))})
+                for method, entry in self._methods.iteritems())
+
+    def clear(self):
+        """Reset all data."""
+        with self._lock:
+            self._methods.clear()
+
+
+# Latency of OBS API calls made through BuildServiceParticipant.obs
+API_LATENCY = LatencyHistogram()
+
+
+class TimedBuildService(object):
+    """BuildService proxy recording method call latency in API_LATENCY."""
+
+    def __init__(self, obs):
+        object.__setattr__(self, "_obs", obs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._obs, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        # Mocks and partials lack some of the attributes wraps() copies
+        @wraps(attr, assigned=[key for key in WRAPPER_ASSIGNMENTS
+                               if hasattr(attr, key)])
+        def timed(*args, **kwargs):
+            # pylint: disable=C0111
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                API_LATENCY.observe(name, time.time() - start)
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._obs, name, value)
+
+
+class BuildServicePool(object):
+    """Process wide registry of BuildService instances.
+
+    One BuildService is created per (apiurl, oscrc) and shared by all
+    participants and workitems of the process. The osc HTTP opener of each
+    API gets a KeepAliveHandler, so connections (and their TLS sessions) are
+    reused between calls, limited to `max_connections` per host.
+
+    Concurrent helpers like RepositoryMixin.map_binary_info() limit the
+    number of parallel calls per API to `max_concurrency` using slots().
+    """
+
+    def __init__(self, max_connections=4, max_concurrency=4):
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self._instances = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def get(self, apiurl, oscrc):
+        """Get shared BuildService.
+
+        :param apiurl: OBS API URL or alias
+        :param oscrc: osc configuration file
+        :returns: TimedBuildService wrapping BuildService
+        """
+        key = (apiurl, oscrc)
+        with self._lock:
+            obs = self._instances.get(key)
+            if obs is None:
+                obs = BuildService(oscrc=oscrc, apiurl=apiurl)
+                self._install_keepalive(obs.apiurl)
+                obs = self._instances[key] = TimedBuildService(obs)
+        return obs
+
+    def slots(self, apiurl):
+        """Get semaphore limiting concurrent calls to apiurl."""
+        with self._lock:
+            slots = self._slots.get(apiurl)
+            if slots is None:
+                slots = self._slots[apiurl] = threading.BoundedSemaphore(
+                        max(self.max_concurrency, 1))
+            return slots
+
+    def clear(self):
+        """Forget all instances."""
+        with self._lock:
+            self._instances.clear()
+            self._slots.clear()
+
+    def _install_keepalive(self, apiurl):
+        """Add KeepAliveHandler to the osc opener of apiurl."""
+        try:
+            opener = osc_conf._build_opener(apiurl)
+        except (AttributeError, TypeError):
+            # osc without per API openers, keep plain urllib2 behaviour
+            return
+        if any(isinstance(handler, KeepAliveHandler)
+               for handler in opener.handlers):
+            return
+        opener.add_handler(KeepAliveHandler(
+                max_connections=self.max_connections,
+                context=self._ssl_context(apiurl)))
+
+    @staticmethod
+    def _ssl_context(apiurl):
+        """SSL context checking certificates like osc does for apiurl.
+
+        :returns: ssl.SSLContext or None if it can't be created, in which case
+            HTTPS requests keep going through the osc handler
+        """
+        try:
+            options = osc_conf.config["api_host_options"][apiurl]
+        except (KeyError, TypeError):
+            return None
+        sslcertck = options.get("sslcertck", True)
+        if isinstance(sslcertck, basestring):
+            sslcertck = sslcertck.strip().lower() not in ("0", "false", "no")
+        try:
+            if not sslcertck:
+                return ssl._create_unverified_context()
+            cafile = options.get("cafile") or osc_conf.config.get("cafile")
+            capath = options.get("capath") or osc_conf.config.get("capath")
+            return ssl.create_default_context(cafile=cafile, capath=capath)
+        except (AttributeError, EnvironmentError, ssl.SSLError):
+            # python without SSLContext or unreadable CA certificates
+            return None
+
+
+# Participant process wide BuildService instances
+OBS_POOL = BuildServicePool()
+
+
+def map_concurrent(func, items, workers=4):
+    """Call func for each item using a bounded number of threads.
+
+    :param func: Callable taking one item
+    :param items: Sequence of items
+    :param workers: Maximum number of threads, with 1 or less the calls are
+        made in the calling thread
+    :returns: List of (result, exc_info) tuples in the order of items.
+        exc_info is None if the call succeeded, otherwise the
+        sys.exc_info() of the failure and result is None.
+    """
+    items = list(items)
+    results = [None] * len(items)
+
+    def call(index):
+        # pylint: disable=W0703
+        try:
+            results[index] = (func(items[index]), None)
+        except Exception:
+            results[index] = (None, sys.exc_info())
+
+    workers = min(workers, len(items))
+    if workers <= 1:
+        for index in range(len(items)):
+            call(index)
+        return results
+
+    queue = Queue()
+    for index in range(len(items)):
+        queue.put(index)
+
+    def worker():
+        # pylint: disable=C0111
+        while True:
+            index = queue.get()
+            if index is None:
+                return
+            call(index)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        queue.put(None)
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class ProjectMeta(object):
+    """Parsed OBS project meta.
+
+    Provides the repository, architecture, build path and flag information
+    of a project from a single _meta document.
+
+    :param meta: Project meta XML string or lxml element
+    """
+
+    def __init__(self, meta):
+        if isinstance(meta, basestring):
+            meta = etree.fromstring(meta)
+        self.tree = meta
+        self.name = meta.get("name")
+        self.repositories = OrderedDict()
+        for repoelem in meta.findall("repository"):
+            repo = repoelem.get("name")
+            self.repositories[repo] = {
+                "path": "%s/%s" % (self.name, repo),
+                "targets": ["%s/%s" % (path.get("project"),
+                                       path.get("repository"))
+                            for path in repoelem.findall("path")],
+                "architectures": [arch.text
+                                  for arch in repoelem.findall("arch")],
+            }
+
+    def archs(self, repository):
+        """Get list of architectures for repository."""
+        return self.repositories[repository]["architectures"]
+
+    def targets(self, repository):
+        """Get list of "project/repository" paths repository builds against."""
+        return self.repositories[repository]["targets"]
+
+    def flag(self, name):
+        """Get flag element, e.g. "build" or "publish".
+
+        :returns: lxml element or None if the flag is not defined
+        """
+        return self.tree.find(name)
+
+    def flag_enabled(self, name, repository=None, arch=None, default=True):
+        """Resolve flag state for repository and architecture.
+
+        The most specific enable/disable element matching the given
+        repository and architecture decides the state, like OBS does.
+
+        :param name: Flag name, e.g. "build" or "publish"
+        :param repository: Repository name, None matches only generic rules
+        :param arch: Architecture, None matches only generic rules
+        :param default: State if no rule matches
+        :returns: True if enabled
+        """
+        flag = self.flag(name)
+        if flag is None:
+            return default
+        result, best = default, -1
+        for elem in flag:
+            if elem.tag not in ("enable", "disable"):
+                continue
+            erepo, earch = elem.get("repository"), elem.get("arch")
+            if erepo is not None and erepo != repository:
+                continue
+            if earch is not None and earch != arch:
+                continue
+            score = (erepo is not None) + (earch is not None)
+            if score >= best:
+                result, best = elem.tag == "enable", score
+        return result
+
+    def as_repos(self):
+        """Get repository information in RepositoryMixin.get_project_repos()
+        format, leaving out repositories without architectures.
+        """
+        return dict((repo, deepcopy(info))
+                    for repo, info in self.repositories.iteritems()
+                    if info["architectures"])
+
+
 class BuildServiceParticipant(object):
     """Base class for participants using BuildService.
 
@@ -49,6 +878,14 @@ class BuildServiceParticipant(object):
         """Decorator for getting [obs] oscrc from participant configuration.
 
         Can be used on participant handle_lifecycle_control() method.
+
+        Optional [obs] cache_lifetime and cache_size values configure the
+        process wide PROJECT_CACHE, [obs] stats_interval how often cache
+        statistics are logged and [obs] max_connections and
+        max_concurrency the per host connection and parallel call limits of
+        OBS_POOL. [obs] bininfo_cache and bininfo_cache_size enable the
+        host wide BININFO_CACHE. [obs] results_confirm sets how many seconds
+        BUILD_RESULTS trusts build results without asking OBS.
         """
         @wraps(method)
         def wrapper(self, ctrl):
@@ -63,6 +900,31 @@ class BuildServiceParticipant(object):
                 else:
                     raise RuntimeError("Missing configuration value: "
                             "[obs] oscrc")
+                if ctrl.config.has_option("obs", "cache_lifetime"):
+                    PROJECT_CACHE.configure(lifetime=ctrl.config.getint(
+                        "obs", "cache_lifetime"))
+                if ctrl.config.has_option("obs", "cache_size"):
+                    PROJECT_CACHE.configure(size=ctrl.config.getint(
+                        "obs", "cache_size"))
+                if ctrl.config.has_option("obs", "stats_interval"):
+                    CACHE_STATS.interval = ctrl.config.getint(
+                        "obs", "stats_interval")
+                if ctrl.config.has_option("obs", "max_connections"):
+                    OBS_POOL.max_connections = ctrl.config.getint(
+                        "obs", "max_connections")
+                if ctrl.config.has_option("obs", "max_concurrency"):
+                    OBS_POOL.max_concurrency = ctrl.config.getint(
+                        "obs", "max_concurrency")
+                if ctrl.config.has_option("obs", "results_confirm"):
+                    BUILD_RESULTS.confirm = ctrl.config.getint(
+                        "obs", "results_confirm")
+                if ctrl.config.has_option("obs", "bininfo_cache"):
+                    global BININFO_CACHE # pylint: disable=W0603
+                    size = 100000
+                    if ctrl.config.has_option("obs", "bininfo_cache_size"):
+                        size = ctrl.config.getint("obs", "bininfo_cache_size")
+                    BININFO_CACHE = BinaryInfoCache(
+                        ctrl.config.get("obs", "bininfo_cache"), size)
             return method(self, ctrl)
         return wrapper
 
@@ -71,6 +933,10 @@ class BuildServiceParticipant(object):
         """Decorator to get the namespace from workitem.
 
         Can be used on participant handle_wi() method.
+
+        OBS project and build events in the workitem invalidate the related
+        PROJECT_CACHE, BUILD_RESULTS and BININFO_CACHE entries. Cache
+        statistics are logged every CACHE_STATS.interval seconds.
         """
         @wraps(method)
         def wrapper(self, wid):
@@ -85,18 +951,23 @@ class BuildServiceParticipant(object):
                 self.__obs_alias = wid.fields.ev.namespace
                 if not self.__obs_mocked:
                     self.__obs = None
+            if wid.fields.ev.label in CACHE_EVENTS:
+                handle_event(self.obs.apiurl, wid.fields.ev.as_dict())
+            CACHE_STATS.report(self.log)
             return method(self, wid)
         return wrapper
 
     def __get_obs(self):
-        """Lazy BuildService property."""
+        """Lazy BuildService property.
+
+        Instances are shared through OBS_POOL, so switching between
+        namespaces doesn't recreate them.
+        """
         if self.__obs is None:
             if self.__oscrc is None or self.__obs_alias is None:
                 raise RuntimeError("BuildService conf values not set. "
                         "Use get_oscrc and setup_obs decorators.")
-            self.__obs = BuildService(
-                    oscrc=self.__oscrc,
-                    apiurl=self.__obs_alias)
+            self.__obs = OBS_POOL.get(self.__obs_alias, self.__oscrc)
         return self.__obs
 
     def __set_obs(self, instance):
@@ -142,8 +1013,9 @@ class RepositoryMixin(object):
         :returns: Dictionary containing the repository information
 
         If workitem is not given or it does not contain the repository
-        information for requested project, then the information is fetched from
-        OBS.
+        information for requested project, then the information is looked up
+        from the process wide PROJECT_CACHE and fetched from OBS only if not
+        cached there.
 
         Returned dictionary has the following format::
 
@@ -167,36 +1039,92 @@ class RepositoryMixin(object):
             else:
                 wid.fields.repositories = {}
 
-        # Fetch repositories from OBS
-        result = {}
+        result = self.get_project_meta(project).as_repos()
+
+        if wid is not None:
+            setattr(wid.fields.repositories, project, result)
+        return result
+
+    def get_project_meta(self, project):
+        """Get parsed project meta.
+
+        :param project: Project name
+        :raises OBSError: If fetching or parsing the meta fails
+        :returns: ProjectMeta instance
+
+        The meta is fetched with one request and kept in the process wide
+        PROJECT_CACHE. Returned instance is shared, don't modify it.
+        """
+        meta = PROJECT_CACHE.get((self.obs.apiurl, project, "meta"))
+        if meta is None:
+            meta = self._fetch_project_meta(project)
+        return meta
+
+    def _fetch_project_meta(self, project):
+        """Fetch project meta from OBS and store it in PROJECT_CACHE."""
         try:
-            repositories = self.obs.getProjectRepositories(project)
+            meta = ProjectMeta(self.obs.getProjectMeta(project))
         except HTTPError, exobj:
             if exobj.code == 404:
                 msg = "project not found"
             else:
                 msg = str(exobj)
-            raise OBSError("getProjectRepositories(%s) failed: %s" %
+            raise OBSError("getProjectMeta(%s) failed: %s" %
                     (project, msg))
+        except etree.XMLSyntaxError, exobj:
+            raise OBSError("getProjectMeta(%s) returned invalid XML: %s"
+                    % (project, exobj))
+        PROJECT_CACHE.put((self.obs.apiurl, project, "meta"), meta)
+        return meta
 
-        for repo in repositories:
-            result[repo] = {"path": "%s/%s" % (project, repo)}
-            try:
-                result[repo]["architectures"] = self.obs.getRepositoryArchs(
-                        project, repo)
-            except HTTPError, exobj:
-                raise OBSError("getRepositoryArchs(%s, %s) failed: %s" %
-                    (project, repo, exobj))
-            try:
-                result[repo]["targets"] = self.obs.getRepositoryTargets(
-                        project, repo)
-            except HTTPError, exobj:
-                raise OBSError("getRepositoryTargets(%s, %s) failed: %s" %
-                    (project, repo, exobj))
-            if not len(result[repo]["architectures"]):
-                del(result[repo])
-        if wid is not None:
-            setattr(wid.fields.repositories, project, result)
+    def map_project_meta(self, projects, on_error=None):
+        """Get parsed metas of several projects concurrently.
+
+        :param projects: List of project names
+        :param on_error: Callable taking (project, exc_info) called for each
+            failed project, which is then left out of the result. If None,
+            the first failure (in projects order) is raised.
+        :returns: List of (project, ProjectMeta) tuples in projects order
+
+        Metas are fetched like in get_project_meta(). Number of parallel
+        requests is limited by OBS_POOL.max_concurrency per OBS API.
+        """
+        slots = OBS_POOL.slots(self.obs.apiurl)
+        # metas are looked up and fetched once each, so results don't
+        # depend on the cache keeping them
+        metas = {}
+        missing = []
+        for project in projects:
+            if project in metas or project in missing:
+                continue
+            meta = PROJECT_CACHE.get((self.obs.apiurl, project, "meta"))
+            if meta is None:
+                missing.append(project)
+            else:
+                metas[project] = meta
+
+        def fetch(project):
+            # pylint: disable=C0111
+            with slots:
+                return self._fetch_project_meta(project)
+
+        failed = {}
+        for project, (meta, exc_info) in zip(missing, map_concurrent(
+                fetch, missing, OBS_POOL.max_concurrency)):
+            if exc_info is not None:
+                failed[project] = exc_info
+            else:
+                metas[project] = meta
+
+        result = []
+        for project in projects:
+            if project in failed:
+                exc_info = failed[project]
+                if on_error is None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                on_error(project, exc_info)
+                continue
+            result.append((project, metas[project]))
         return result
 
     def get_target_repos(self, action, wid=None):
@@ -238,6 +1166,86 @@ class RepositoryMixin(object):
                 targets.append("%s/%s" % (repo, arch))
         return targets
 
+    def map_targets(self, projects, on_error=None):
+        """Get build targets of several projects concurrently.
+
+        :param projects: List of project names
+        :param on_error: Callable taking (project, exc_info) called for each
+            failed project, which is then left out of the result. If None,
+            the first failure (in projects order) is raised.
+        :returns: List of (project, targets) tuples in projects order, where
+            targets is a list in format "repository_name/architecture"
+
+        Targets are always fetched from OBS, as they change when projects
+        are modified. Number of parallel requests is limited by
+        OBS_POOL.max_concurrency per OBS API.
+        """
+        slots = OBS_POOL.slots(self.obs.apiurl)
+
+        def fetch(project):
+            # pylint: disable=C0111
+            with slots:
+                return self.obs.getTargets(project)
+
+        result = []
+        for project, (targets, exc_info) in zip(projects, map_concurrent(
+                fetch, projects, OBS_POOL.max_concurrency)):
+            if exc_info is not None:
+                if on_error is None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                on_error(project, exc_info)
+                continue
+            result.append((project, targets))
+        return result
+
+    def copy_packages(self, target_project, packages, **kwargs):
+        """Copy packages into a project concurrently.
+
+        :param target_project: Destination project name
+        :param packages: List of (source project, source package, target
+            package, revision) tuples
+        :param kwargs: Additional keyword arguments for
+            BuildService.copyPackage()
+        :raises: The first failure (in packages order) once all copies have
+            finished
+        :returns: List of (target package, seconds) tuples in packages order
+
+        Copies are made server side on the same OBS. Number of parallel
+        requests is limited by OBS_POOL.max_concurrency per OBS API.
+        """
+        apiurl = self.obs.apiurl
+        slots = OBS_POOL.slots(apiurl)
+
+        def copy(package):
+            # pylint: disable=C0111
+            src_project, src_package, dst_package, revision = package
+            with slots:
+                start = time.time()
+                self.obs.copyPackage(apiurl, src_project, src_package,
+                        apiurl, target_project, dst_package,
+                        revision=revision, **kwargs)
+                return time.time() - start
+
+        timings = []
+        for package, (elapsed, exc_info) in zip(packages, map_concurrent(
+                copy, packages, OBS_POOL.max_concurrency)):
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            timings.append((package[2], elapsed))
+        return timings
+
+    def get_repo_results(self, project, repo):
+        """Get build results of a project repository.
+
+        :param project: Project name
+        :param repo: Repository name
+        :returns: BuildResults instance, shared so don't modify it
+
+        Results are kept in the process wide BUILD_RESULTS tracker and
+        fetched again only when OBS reports they have changed.
+        """
+        return BUILD_RESULTS.get(self.obs, project, repo)
+
     def get_binary_list(self, project, package, target):
         """Get binary list from OBS repository.
 
@@ -255,6 +1263,73 @@ class RepositoryMixin(object):
                     (project, target, package, exobj))
         return bin_list
 
+    def map_binary_info(self, project, target, package, binaries,
+            on_error=None):
+        """Get binary info for several binaries concurrently.
+
+        :param project: Project name
+        :param target: Build target e.g. "repository/arch"
+        :param package: Package name
+        :param binaries: List of binary file names
+        :param on_error: Callable taking (binary, exc_info) called for each
+            failed binary, which is then left out of the result. If None,
+            the first failure (in binaries order) is raised.
+        :returns: List of (binary, bininfo) tuples in binaries order
+
+        Binaries found in BININFO_CACHE are not fetched. Number of parallel
+        requests is limited by OBS_POOL.max_concurrency per OBS API.
+        """
+        apiurl = self.obs.apiurl
+        slots = OBS_POOL.slots(apiurl)
+        cached = {}
+        if BININFO_CACHE is not None:
+            cached = BININFO_CACHE.get_many(apiurl, project, target, package,
+                                            binaries)
+        missing = [binary for binary in binaries if binary not in cached]
+
+        def fetch(binary):
+            # pylint: disable=C0111
+            with slots:
+                return self.obs.getBinaryInfo(project, target, package,
+                                              binary)
+
+        fetched = {}
+        failed = {}
+        for binary, (bininfo, exc_info) in zip(missing, map_concurrent(
+                fetch, missing, OBS_POOL.max_concurrency)):
+            if exc_info is None:
+                fetched[binary] = bininfo
+            else:
+                failed[binary] = exc_info
+        if BININFO_CACHE is not None:
+            BININFO_CACHE.put_many(apiurl, project, target, package, fetched)
+
+        result = []
+        for binary in binaries:
+            if binary in failed:
+                exc_info = failed[binary]
+                if on_error is None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                on_error(binary, exc_info)
+                continue
+            if binary in cached:
+                result.append((binary, cached[binary]))
+            else:
+                result.append((binary, fetched[binary]))
+        return result
+
+    def get_binary_info(self, project, target, package, binary):
+        """Get binary info, using BININFO_CACHE if enabled.
+
+        :param project: Project name
+        :param target: Build target e.g. "repository/arch"
+        :param package: Package name
+        :param binary: Binary file name
+        :returns: Binary info dictionary as returned by
+            BuildService.getBinaryInfo()
+        """
+        return self.map_binary_info(project, target, package, [binary])[0][1]
+
     def download_binary(self, project, package, target, binary, path):
         """Download binary from OBS.
 
@@ -292,3 +1367,38 @@ class RepositoryMixin(object):
             raise OBSError("Failed to download binary '%s' from %s %s %s: %s" %
                     (binary, project, package, target, exobj))
         return path
+
+    def get_binary_rpm_info(self, project, package, target, binary):
+        """Get RPM package metadata without downloading the whole binary.
+
+        Only the package lead, signature and header are fetched from OBS with
+        HTTP range requests.
+
+        Library only for now: the bundled participants all need the payload
+        of the binaries they download, so none of them calls this.
+
+        :param project: Project name
+        :param package: Package name
+        :param target: Build target e.g. "repository/arch"
+        :param binary: Binary RPM file name
+        :raises OBSError: If fetching fails or binary is not an RPM
+        :returns: boss.rpm.RpmInfo instance
+        """
+        # boss.rpm needs rpm-python which not all participants have
+        from boss.rpm import fetch_rpm_info
+        url = osc_core.makeurl(self.obs.apiurl,
+                ["build", project] + target.split("/") + [package, binary])
+        try:
+            return fetch_rpm_info(url, urlopen=lambda url, headers:
+                    osc_core.http_GET(url, headers=headers))
+        except HTTPError, exobj:
+            if exobj.code == 404:
+                msg = "Binary '%s' not found for %s %s %s" % \
+                        (binary, project, package, target)
+            else:
+                msg = "Failed to get header of binary '%s' from %s %s %s: " \
+                        "%s" % (binary, project, package, target, exobj)
+            raise OBSError(msg)
+        except Exception, exobj:
+            raise OBSError("Failed to get header of binary '%s' from %s %s "
+                    "%s: %s" % (binary, project, package, target, exobj))
@@ -1,10 +1,85 @@
 """RPM package handling helpers."""
 
 from __future__ import absolute_import
+import bz2
+import errno
+import os
+import stat
+import struct
+import urllib2
+import zlib
+from fnmatch import fnmatchcase
+from shutil import rmtree
 from subprocess import Popen, PIPE, CalledProcessError
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
 import rpm
 
+try:
+    from lzma import LZMADecompressor
+except ImportError:
+    try:
+        from backports.lzma import LZMADecompressor
+    except ImportError:
+        LZMADecompressor = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+RPM_LEAD_SIZE = 96
+RPM_LEAD_MAGIC = "\xed\xab\xee\xdb"
+RPM_HEADER_MAGIC = "\x8e\xad\xe8\x01"
+
+RPMSIGTAG_SIZE = 1000
+RPMSIGTAG_LONGSIZE = 270
+
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_ARCH = 1022
+RPMTAG_OLDFILENAMES = 1027
+RPMTAG_FILESIZES = 1028
+RPMTAG_FILEMODES = 1030
+RPMTAG_SOURCERPM = 1044
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_REQUIREFLAGS = 1048
+RPMTAG_REQUIRENAME = 1049
+RPMTAG_REQUIREVERSION = 1050
+RPMTAG_PROVIDEFLAGS = 1112
+RPMTAG_PROVIDEVERSION = 1113
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPMTAG_LONGFILESIZES = 5008
+
+# dependency sense flags
+RPMSENSE_LESS = 2
+RPMSENSE_GREATER = 4
+RPMSENSE_EQUAL = 8
+
+# header data type -> struct format of one item
+_HEADER_TYPES = {1: "c", 2: "B", 3: "H", 4: "I", 5: "Q"}
+_STRING_TYPES = frozenset([6, 8, 9])
+_BIN_TYPE = 7
+
+# payload compressor -> decompressor factory, None if not available
+PAYLOAD_DECOMPRESSORS = {
+    "gzip": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    "bzip2": bz2.BZ2Decompressor,
+    "xz": LZMADecompressor,
+    "lzma": LZMADecompressor,
+    "zstd": zstandard and (
+        lambda: zstandard.ZstdDecompressor().decompressobj()),
+}
+
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = "TRAILER!!!"
+
 
 def parse_spec(spec_file, keep_config=False, macros=None):
     """Simple wrapper around rpm.spec that catches errors printed to stdout
@@ -35,17 +110,602 @@ def parse_spec(spec_file, keep_config=False, macros=None):
         return spec
 
 
+def _read_exactly(fileobj, size):
+    """Read size bytes, raising ValueError if the file ends before."""
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise ValueError("Unexpected end of RPM file")
+    return data
+
+
+def _read_header_section(fileobj):
+    """Read header structure from current position of an RPM file.
+
+    :returns: Dictionary of tag => value
+    """
+    intro = _read_exactly(fileobj, 16)
+    if intro[:4] != RPM_HEADER_MAGIC:
+        raise ValueError("Bad RPM header magic")
+    count, size = struct.unpack(">II", intro[8:])
+    index = _read_exactly(fileobj, count * 16)
+    store = _read_exactly(fileobj, size)
+    header = {}
+    for pos in range(0, count * 16, 16):
+        tag, htype, offset, items = struct.unpack(">iiii", index[pos:pos + 16])
+        if htype in _STRING_TYPES:
+            end = offset
+            values = []
+            for _ in range(items):
+                start, end = end, store.index("\0", end)
+                values.append(store[start:end])
+                end += 1
+            header[tag] = values[0] if htype == 6 else values
+        elif htype == _BIN_TYPE:
+            header[tag] = store[offset:offset + items]
+        elif htype in _HEADER_TYPES:
+            fmt = ">%d%s" % (items, _HEADER_TYPES[htype])
+            header[tag] = list(struct.unpack_from(fmt, store, offset))
+    return header, 16 + count * 16 + size
+
+
+def read_headers(fileobj):
+    """Read the signature and main header of an RPM package.
+
+    Leaves the file positioned at the start of the payload.
+
+    :param fileobj: RPM file object positioned at the start of the file
+    :returns: Tuple of signature and main header dictionaries of
+        tag => value. String values are str, string arrays and numbers lists
+        and binary values str.
+    :raises: ValueError if the file is not an RPM package
+    """
+    signature, header, _, _ = _read_headers(fileobj)
+    return signature, header
+
+
+def _read_headers(fileobj):
+    """Read signature and main header and their offsets in the file.
+
+    :returns: Tuple of signature, header, header offset and payload offset
+    """
+    lead = _read_exactly(fileobj, RPM_LEAD_SIZE)
+    if lead[:4] != RPM_LEAD_MAGIC:
+        raise ValueError("Not an RPM file")
+    signature, size = _read_header_section(fileobj)
+    # signature is padded to 8 byte boundary
+    _read_exactly(fileobj, -size % 8)
+    header_offset = RPM_LEAD_SIZE + size + -size % 8
+    header, size = _read_header_section(fileobj)
+    return signature, header, header_offset, header_offset + size
+
+
+class RpmInfo(object):
+    """Package metadata read from the signature and main header of an RPM.
+
+    :param signature: Signature dictionary of tag => value
+    :param header: Main header dictionary of tag => value
+    :param header_offset: Offset of the main header in the package file
+    :param payload_offset: Offset of the payload in the package file
+    """
+
+    def __init__(self, signature, header, header_offset, payload_offset):
+        self.signature = signature
+        self.header = header
+        self.header_offset = header_offset
+        self.payload_offset = payload_offset
+
+    @property
+    def name(self):
+        """Package name"""
+        return self.header.get(RPMTAG_NAME)
+
+    @property
+    def version(self):
+        """Package version"""
+        return self.header.get(RPMTAG_VERSION)
+
+    @property
+    def release(self):
+        """Package release"""
+        return self.header.get(RPMTAG_RELEASE)
+
+    @property
+    def epoch(self):
+        """Package epoch, None if not set"""
+        epoch = self.header.get(RPMTAG_EPOCH)
+        return epoch[0] if epoch else None
+
+    @property
+    def arch(self):
+        """Package architecture, "src" for source packages"""
+        if RPMTAG_SOURCERPM not in self.header:
+            return "src"
+        return self.header.get(RPMTAG_ARCH)
+
+    @property
+    def size(self):
+        """Size of the package file, None if not known"""
+        size = self.signature.get(RPMSIGTAG_LONGSIZE) or \
+            self.signature.get(RPMSIGTAG_SIZE)
+        if not size:
+            return None
+        # signature size covers main header and payload
+        return self.header_offset + size[0]
+
+    @property
+    def payload_size(self):
+        """Size of the compressed payload, None if not known"""
+        size = self.size
+        return None if size is None else size - self.payload_offset
+
+    @property
+    def files(self):
+        """List of file paths in the package"""
+        if RPMTAG_OLDFILENAMES in self.header:
+            return list(self.header[RPMTAG_OLDFILENAMES])
+        dirnames = self.header.get(RPMTAG_DIRNAMES, [])
+        return [dirnames[index] + basename for index, basename in zip(
+            self.header.get(RPMTAG_DIRINDEXES, []),
+            self.header.get(RPMTAG_BASENAMES, []))]
+
+    @property
+    def file_sizes(self):
+        """Dictionary of file path => size"""
+        sizes = self.header.get(RPMTAG_LONGFILESIZES) or \
+            self.header.get(RPMTAG_FILESIZES, [])
+        return dict(zip(self.files, sizes))
+
+    @property
+    def regular_files(self):
+        """List of regular file paths in the package"""
+        return [path for path, mode in zip(
+            self.files, self.header.get(RPMTAG_FILEMODES, []))
+            if stat.S_ISREG(mode)]
+
+    def files_matching(self, patterns=None):
+        """List package files matching patterns as given to extract_rpm()"""
+        patterns = _patterns(patterns)
+        return [path for path in self.files
+                if _matches("." + path if path.startswith("/") else path,
+                            patterns)]
+
+    @property
+    def provides(self):
+        """List of (name, operator, version) tuples the package provides"""
+        return _dependencies(self.header, RPMTAG_PROVIDENAME,
+                             RPMTAG_PROVIDEFLAGS, RPMTAG_PROVIDEVERSION)
+
+    @property
+    def requires(self):
+        """List of (name, operator, version) tuples the package requires"""
+        return _dependencies(self.header, RPMTAG_REQUIRENAME,
+                             RPMTAG_REQUIREFLAGS, RPMTAG_REQUIREVERSION)
+
+
+def _dependencies(header, name_tag, flags_tag, version_tag):
+    """Get dependency tuples from header tags."""
+    names = header.get(name_tag, [])
+    flags = header.get(flags_tag) or [0] * len(names)
+    versions = header.get(version_tag) or [""] * len(names)
+    result = []
+    for name, flag, version in zip(names, flags, versions):
+        operator = ""
+        if flag & RPMSENSE_LESS:
+            operator += "<"
+        if flag & RPMSENSE_GREATER:
+            operator += ">"
+        if flag & RPMSENSE_EQUAL:
+            operator += "="
+        result.append((name, operator, version))
+    return result
+
+
+def read_rpm_info(fileobj):
+    """Read package metadata from an RPM file object.
+
+    Only the lead, signature and main header are read, leaving the file
+    positioned at the start of the payload.
+
+    :param fileobj: RPM file object positioned at the start of the file
+    :returns: RpmInfo instance
+    :raises: ValueError if the file is not an RPM package
+    """
+    return RpmInfo(*_read_headers(fileobj))
+
+
+def _urlopen(url, headers):
+    """Open url with urllib2 sending extra headers."""
+    return urllib2.urlopen(urllib2.Request(url, headers=headers))
+
+
+class RangeReader(object):
+    """Sequential file object reading a remote file with HTTP range requests.
+
+    Data is fetched in chunks of at least chunk_size bytes as it is read. If
+    the server doesn't support range requests the whole response is streamed
+    and only read as far as needed.
+
+    :param url: File URL
+    :param urlopen: Callable taking url and dictionary of request headers
+        and returning urllib2 like response, default uses urllib2.urlopen
+    :param chunk_size: Minimum number of bytes to request at a time
+    """
+
+    def __init__(self, url, urlopen=None, chunk_size=65536):
+        self.url = url
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self._urlopen = urlopen or _urlopen
+        self._buffer = ""
+        # file offset of the end of buffer
+        self._offset = 0
+        self._stream = None
+        self._eof = False
+
+    def read(self, size):
+        """Read up to size bytes."""
+        if size > len(self._buffer) and not self._eof:
+            self._buffer += self._fetch(max(size - len(self._buffer),
+                                            self.chunk_size))
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _fetch(self, size):
+        """Fetch size bytes following the buffer."""
+        start = self._offset
+        if self._stream is None:
+            self.requests += 1
+            try:
+                response = self._urlopen(self.url, {
+                    "Range": "bytes=%d-%d" % (start, start + size - 1)})
+            except urllib2.HTTPError, exobj:
+                if exobj.code != 416:
+                    raise
+                # range starts after end of file
+                self._eof = True
+                return ""
+            if response.getcode() != 206:
+                if start:
+                    response.close()
+                    raise ValueError("Range requests not supported by %s" %
+                                     self.url)
+                # whole file is coming, keep reading it
+                self._stream = response
+            else:
+                content_range = response.info().get("Content-Range", "")
+                if not content_range.startswith("bytes %d-" % start):
+                    response.close()
+                    raise ValueError("Unexpected Content-Range %r from %s" %
+                                     (content_range, self.url))
+                try:
+                    data = response.read(size)
+                finally:
+                    response.close()
+                self._offset += len(data)
+                self._eof = len(data) < size
+                return data
+        data = self._stream.read(size)
+        self._offset += len(data)
+        if len(data) < size:
+            self.close()
+            self._eof = True
+        return data
+
+    def close(self):
+        """Close streamed response if any."""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+def fetch_rpm_info(url, urlopen=None, chunk_size=65536):
+    """Read package metadata of a remote RPM without downloading the payload.
+
+    The lead, signature and main header are fetched with HTTP range
+    requests, typically taking one or two requests.
+
+    :param url: RPM package URL, like the OBS build binary URL
+    :param urlopen: Callable taking url and dictionary of request headers,
+        see RangeReader
+    :param chunk_size: Bytes to request at a time
+    :returns: RpmInfo instance
+    :raises: ValueError if the file is not an RPM package,
+        urllib2.URLError if fetching fails
+    """
+    reader = RangeReader(url, urlopen, chunk_size)
+    try:
+        return read_rpm_info(reader)
+    finally:
+        reader.close()
+
+
+class _PayloadStream(object):
+    """Reads decompressed RPM payload in exact sized pieces."""
+
+    def __init__(self, fileobj, decompressor, chunk_size=65536):
+        self._fileobj = fileobj
+        self._decompressor = decompressor
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._offset = 0
+
+    def read(self, size):
+        """Read size bytes of payload."""
+        while len(self._buffer) - self._offset < size:
+            chunk = self._fileobj.read(self._chunk_size)
+            if not chunk:
+                raise ValueError("Unexpected end of RPM payload")
+            self._buffer = self._buffer[self._offset:] + \
+                    self._decompressor.decompress(chunk)
+            self._offset = 0
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += size
+        return data
+
+    def skip(self, size):
+        """Skip size bytes of payload."""
+        while size > 0:
+            size -= len(self.read(min(size, self._chunk_size)))
+
+
+class CpioEntry(object):
+    """Member of an RPM payload archive.
+
+    Contents can be read while the payload iteration is at this member.
+    """
+
+    def __init__(self, stream, name, mode, ino, nlink, size):
+        self._stream = stream
+        self.name = name
+        self.mode = mode
+        self.ino = ino
+        self.nlink = nlink
+        self.size = size
+        self.remaining = size
+
+    def read(self, size=-1):
+        """Read contents of a member."""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        self.remaining -= size
+        return self._stream.read(size)
+
+
+def iter_payload(fileobj, header):
+    """Iterate over the payload archive members of an RPM package.
+
+    :param fileobj: RPM file object positioned at the start of the payload
+    :param header: Main header of the package from read_headers()
+    :returns: Iterator of CpioEntry objects, which have to be read before
+        advancing the iterator
+    :raises: ValueError if payload format or compression is not supported
+    """
+    stream = _PayloadStream(fileobj, payload_decompressor(header))
+    while True:
+        fields = stream.read(CPIO_HEADER_SIZE)
+        if fields[:6] not in ("070701", "070702"):
+            raise ValueError("Unsupported cpio format in RPM payload")
+        (ino, mode, _, _, nlink, _, size, _, _, _, _, namesize, _) = [
+            int(fields[pos:pos + 8], 16) for pos in range(6, 110, 8)]
+        name = stream.read(namesize)[:-1]
+        stream.skip(-(CPIO_HEADER_SIZE + namesize) % 4)
+        if name == CPIO_TRAILER:
+            return
+        entry = CpioEntry(stream, name, mode, ino, nlink, size)
+        yield entry
+        stream.skip(entry.remaining + -size % 4)
+
+
+def payload_decompressor(header):
+    """Get decompressor for the payload of an RPM package.
+
+    :param header: Main header of the package from read_headers()
+    :returns: Object with decompress() method
+    :raises: ValueError if payload can't be read without rpm2cpio
+    """
+    if header.get(RPMTAG_PAYLOADFORMAT, "cpio") != "cpio":
+        raise ValueError("Unsupported RPM payload format")
+    if RPMTAG_LONGFILESIZES in header:
+        # large file payloads use stripped cpio headers
+        raise ValueError("Unsupported RPM payload with large files")
+    compressor = header.get(RPMTAG_PAYLOADCOMPRESSOR, "gzip")
+    factory = PAYLOAD_DECOMPRESSORS.get(compressor)
+    if factory is None:
+        raise ValueError("No decompressor for %s payload" % compressor)
+    return factory()
+
+
+def _patterns(patterns):
+    """Normalize patterns argument, None means all members."""
+    if isinstance(patterns, basestring):
+        return [patterns]
+    return patterns or None
+
+
+def _matches(name, patterns):
+    """Check whether an archive member name matches any of the patterns."""
+    if patterns is None:
+        return True
+    return any(fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def _target_path(work_dir, name):
+    """Get extraction path of member name, None if it is outside work_dir."""
+    root = os.path.realpath(work_dir)
+    path = os.path.normpath(os.path.join(root, name.lstrip("/")))
+    if not path.startswith(root + os.sep):
+        return None
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    parent = os.path.realpath(parent)
+    if parent != root and not parent.startswith(root + os.sep):
+        # leading directory is a symlink pointing out of work_dir
+        return None
+    return path
+
+
+def _remove(path):
+    """Remove file or empty directory about to be replaced."""
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            os.rmdir(path)
+        else:
+            os.unlink(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+
+
+def _extract_member(entry, path, links):
+    """Write archive member to path.
+
+    :param links: Dictionary of inode => path of the hard linked file with
+        contents, or list of paths waiting for it
+    :returns: True if the member was written
+    """
+    mode = stat.S_IFMT(entry.mode)
+    if mode == stat.S_IFDIR:
+        if not os.path.isdir(path):
+            _remove(path)
+            os.mkdir(path)
+        # keep it writable for the members inside
+        os.chmod(path, entry.mode & 0o7777 | 0o700)
+    elif mode == stat.S_IFLNK:
+        _remove(path)
+        os.symlink(entry.read(), path)
+    elif mode == stat.S_IFREG:
+        _remove(path)
+        linked = links.get(entry.ino) if entry.nlink > 1 else None
+        if isinstance(linked, str):
+            os.link(linked, path)
+            return True
+        with open(path, "wb") as out:
+            while entry.remaining:
+                out.write(entry.read(65536))
+        os.chmod(path, entry.mode & 0o7777)
+        if entry.nlink > 1 and entry.size:
+            # contents come with one of the links, usually the last
+            for link in linked or ():
+                if link != path:
+                    _remove(link)
+                    os.link(path, link)
+            links[entry.ino] = path
+        elif entry.nlink > 1:
+            links.setdefault(entry.ino, []).append(path)
+    else:
+        # devices and fifos can't be created unprivileged
+        return False
+    return True
+
+
 def extract_rpm(rpm_file, work_dir, patterns=None):
     """Extract rpm package contents.
 
+    The payload is decompressed and unpacked while it is read, and only
+    members matching the patterns are written. Payloads which can't be read
+    in process, because of a missing decompressor module for example, are
+    extracted with rpm2cpio and cpio.
+
     :param rpm_file: RPM file name
     :param work_dir: The RPM is extracted under this direcory.
             Also rpm filename can be given relative to this dir
-    :param patterns: List of filename patterns to extract. Extract all if None
+    :param patterns: List of filename patterns to extract, matched against
+            the member names like "./usr/share/file" as cpio does. A single
+            pattern can be given as a string. Extract all if empty
     :returns: List of extracted filenames (relative to work_dir)
-    :raises: subprocess.CalledProcessError if extraction failed
+    :raises: ValueError if the package is broken,
+            subprocess.CalledProcessError if extraction with cpio failed
     """
+    patterns = _patterns(patterns)
+    extracted = []
+    links = {}
+    with open(os.path.join(work_dir, rpm_file), "rb") as fileobj:
+        _, header = read_headers(fileobj)
+        try:
+            payload_decompressor(header)
+        except ValueError:
+            return _extract_rpm_cpio(rpm_file, work_dir, patterns)
+        for entry in iter_payload(fileobj, header):
+            if _matches(entry.name, patterns):
+                path = _target_path(work_dir, entry.name)
+                if path is not None and _extract_member(entry, path, links):
+                    extracted.append(entry.name)
+            elif entry.size and isinstance(links.get(entry.ino), list):
+                # contents of extracted hard links come with this member
+                _extract_member(entry, links[entry.ino][0], links)
+    return extracted
+
+
+def read_rpm_files(source, patterns=None):
+    """Read regular files of an RPM package without writing them to disk.
+
+    :param source: RPM file name, or file object like an HTTP response
+            positioned at the start of the package
+    :param patterns: List of filename patterns as for extract_rpm()
+    :returns: Iterator of (member name, contents) tuples in payload order,
+            hard links are returned when their contents are read
+    :raises: ValueError if the package is broken, or if the payload of a
+            streamed package can't be read in process
+    """
+    patterns = _patterns(patterns)
+    if isinstance(source, basestring):
+        with open(source, "rb") as fileobj:
+            _, header = read_headers(fileobj)
+            try:
+                payload_decompressor(header)
+            except ValueError:
+                files = _read_rpm_files_cpio(source, patterns)
+            else:
+                files = _read_payload_files(fileobj, header, patterns)
+            for item in files:
+                yield item
+    else:
+        _, header = read_headers(source)
+        for item in _read_payload_files(source, header, patterns):
+            yield item
+
+
+def _read_payload_files(fileobj, header, patterns):
+    """Read matching regular files from payload."""
+    links = {}
+    for entry in iter_payload(fileobj, header):
+        if not stat.S_ISREG(entry.mode):
+            continue
+        matched = _matches(entry.name, patterns) and not \
+            os.path.normpath(entry.name.lstrip("/")).startswith(os.pardir)
+        if entry.nlink > 1 and not entry.size:
+            if matched:
+                links.setdefault(entry.ino, []).append(entry.name)
+            continue
+        if matched or entry.ino in links:
+            contents = entry.read()
+            for name in links.pop(entry.ino, ()):
+                yield name, contents
+            if matched:
+                yield entry.name, contents
 
+
+def _read_rpm_files_cpio(rpm_file, patterns):
+    """Read matching regular files extracted with rpm2cpio and cpio."""
+    work_dir = mkdtemp(prefix="read_rpm_files")
+    try:
+        for name in _extract_rpm_cpio(os.path.abspath(rpm_file), work_dir,
+                                      patterns):
+            path = os.path.join(work_dir, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                with open(path, "rb") as member:
+                    yield name, member.read()
+    finally:
+        rmtree(work_dir, ignore_errors=True)
+
+
+def _extract_rpm_cpio(rpm_file, work_dir, patterns=None):
+    """Extract rpm package contents with rpm2cpio and cpio.
+
+    :returns: List of extracted filenames (relative to work_dir)
+    :raises: subprocess.CalledProcessError if extraction failed
+    """
     tmp_patterns = None
     rpm2cpio_args = ["rpm2cpio", rpm_file]
     cpio_args = ["cpio", '-idv']
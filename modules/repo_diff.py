@@ -14,14 +14,315 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 # (c) 2007 Red Hat. Written by skvidal@fedoraproject.org
 
+import bz2
+import hashlib
+import json
 import os
-import yum
-import rpmUtils
+import re
+import shutil
+import tempfile
 import datetime
+import urllib2
 import urlparse
-from yum.misc import to_unicode
-
-class DiffYum(yum.YumBase):
+import zlib
+from lxml import etree
+
+try:
+    import yum
+    from yum.misc import to_unicode
+    _YumBase = yum.YumBase
+except ImportError:
+    # short diffs don't need yum
+    yum = None
+    _YumBase = object
+
+REPO_NS = "{http://linux.duke.edu/metadata/repo}"
+COMMON_NS = "{http://linux.duke.edu/metadata/common}"
+
+class _Decompressed(object):
+    """File like object decompressing a stream as it is read"""
+
+    def __init__(self, fileobj, decompressor, chunk_size=65536):
+        self._fileobj = fileobj
+        self._decompressor = decompressor
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._fileobj.read(self._chunk_size)
+            if chunk:
+                self._buffer += self._decompressor.decompress(chunk)
+            else:
+                self._eof = True
+                if hasattr(self._decompressor, "flush"):
+                    self._buffer += self._decompressor.flush()
+        if size < 0 or size >= len(self._buffer):
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self._fileobj.close()
+
+def _repo_url(baseurl, path):
+    """Returns url of path in repository at baseurl, which may be local"""
+    if not urlparse.urlsplit(baseurl)[0]:
+        baseurl = "file://" + os.path.abspath(baseurl)
+    return urlparse.urljoin(baseurl.rstrip("/") + "/", path)
+
+def _open_metadata(baseurl, path):
+    """Opens repository metadata file for streaming, uncompressing it"""
+    stream = urllib2.urlopen(_repo_url(baseurl, path))
+    if path.endswith(".gz"):
+        return _Decompressed(stream, zlib.decompressobj(16 + zlib.MAX_WBITS))
+    if path.endswith(".bz2"):
+        return _Decompressed(stream, bz2.BZ2Decompressor())
+    return stream
+
+REPOMD = "repodata/repomd.xml"
+
+class MetadataCache(object):
+    """Local cache of repository metadata shared between processes
+
+    repomd.xml of each repository is kept with its HTTP validators, so an
+    unchanged repository costs one conditional request. Package versions
+    read from primary metadata are kept by the checksum of the primary file
+    and arch list, so they are parsed again only when the repository
+    changes. Least recently used repositories are removed when the cache
+    takes more than size bytes.
+    """
+
+    def __init__(self, path, size=64 * 1024 * 1024):
+        self.path = path
+        self.size = size
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _entry(self, baseurl):
+        return os.path.join(self.path, hashlib.sha1(baseurl).hexdigest())
+
+    def _read(self, entry, name):
+        try:
+            with open(os.path.join(entry, name)) as cached:
+                return cached.read()
+        except IOError:
+            return None
+
+    def _write(self, entry, name, data):
+        if not os.path.isdir(entry):
+            os.makedirs(entry)
+        # rename so other processes never see partial files
+        fd, tmp = tempfile.mkstemp(dir=entry)
+        with os.fdopen(fd, "w") as out:
+            out.write(data)
+        os.rename(tmp, os.path.join(entry, name))
+
+    def repomd(self, baseurl):
+        """Returns repomd.xml of repository, downloaded only if changed"""
+        entry = self._entry(baseurl)
+        cached = self._read(entry, "repomd.xml")
+        validators = json.loads(self._read(entry, "validators.json") or "{}")
+        request = urllib2.Request(_repo_url(baseurl, REPOMD))
+        if cached is not None:
+            if validators.get("etag"):
+                request.add_header("If-None-Match", validators["etag"])
+            if validators.get("modified"):
+                request.add_header("If-Modified-Since", validators["modified"])
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError, e:
+            if e.code != 304 or cached is None:
+                raise
+            data = cached
+        else:
+            try:
+                data = response.read()
+                headers = response.info()
+            finally:
+                response.close()
+            if data != cached:
+                self._write(entry, "repomd.xml", data)
+            validators = {"etag": headers.get("ETag"),
+                          "modified": headers.get("Last-Modified")}
+            self._write(entry, "validators.json", json.dumps(validators))
+            self._evict()
+        # mark used for eviction
+        os.utime(entry, None)
+        return data
+
+    def _packages_name(self, checksum, archlist):
+        return "packages-%s.json" % hashlib.sha1(
+            "%s %s" % (checksum, " ".join(sorted(archlist)))).hexdigest()
+
+    def packages(self, baseurl, checksum, archlist):
+        """Returns cached {name: (epoch, version, release)} or None"""
+        data = self._read(self._entry(baseurl),
+                          self._packages_name(checksum, archlist))
+        if data is None:
+            return None
+        return dict((str(name), tuple(evr))
+                    for name, evr in json.loads(data).iteritems())
+
+    def store_packages(self, baseurl, checksum, archlist, packages):
+        """Stores package versions of the primary metadata with checksum"""
+        entry = self._entry(baseurl)
+        name = self._packages_name(checksum, archlist)
+        self._write(entry, name, json.dumps(packages))
+        # versions of the previous primary metadata are not needed anymore
+        for old in os.listdir(entry):
+            if old.startswith("packages-") and old != name:
+                try:
+                    os.unlink(os.path.join(entry, old))
+                except OSError:
+                    pass
+        self._evict()
+
+    def _evict(self):
+        """Removes least recently used repositories over the size limit"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f))
+                           for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                # removed by another process
+                continue
+            total += size
+        entries.sort()
+        while total > self.size and len(entries) > 1:
+            _, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+# Cache used by repo_metadata() and repo_packages(), None to disable
+METADATA_CACHE = None
+
+def repo_metadata(baseurl):
+    """Returns {type: (location, timestamp, checksum)} of repomd.xml data"""
+    if METADATA_CACHE is not None:
+        root = etree.fromstring(METADATA_CACHE.repomd(baseurl))
+    else:
+        stream = _open_metadata(baseurl, REPOMD)
+        try:
+            root = etree.parse(stream).getroot()
+        finally:
+            stream.close()
+    metadata = {}
+    for data in root.iterfind(REPO_NS + "data"):
+        location = data.find(REPO_NS + "location").get("href")
+        timestamp = data.findtext(REPO_NS + "timestamp")
+        checksum = data.findtext(REPO_NS + "checksum")
+        metadata[data.get("type")] = (
+            location, timestamp and int(float(timestamp)), checksum)
+    return metadata
+
+_VERSION_SEGMENT = re.compile(r"~|\^|[0-9]+|[a-zA-Z]+")
+
+def _vercmp(one, two):
+    """rpmvercmp() of version or release strings"""
+    if one == two:
+        return 0
+    one = _VERSION_SEGMENT.findall(one)
+    two = _VERSION_SEGMENT.findall(two)
+    while one or two:
+        # tilde sorts before anything else
+        if (one and one[0] == "~") or (two and two[0] == "~"):
+            if not one or one[0] != "~":
+                return 1
+            if not two or two[0] != "~":
+                return -1
+            one, two = one[1:], two[1:]
+            continue
+        # caret sorts after the end of the version but before anything else
+        if (one and one[0] == "^") or (two and two[0] == "^"):
+            if not one:
+                return -1
+            if not two:
+                return 1
+            if one[0] != "^":
+                return 1
+            if two[0] != "^":
+                return -1
+            one, two = one[1:], two[1:]
+            continue
+        if not one or not two:
+            break
+        seg1, seg2 = one.pop(0), two.pop(0)
+        if seg1.isdigit() != seg2.isdigit():
+            # numeric segments are newer than alphabetic ones
+            return 1 if seg1.isdigit() else -1
+        if seg1.isdigit():
+            seg1, seg2 = int(seg1), int(seg2)
+        if seg1 != seg2:
+            return cmp(seg1, seg2)
+    return cmp(len(one), len(two))
+
+def compare_evr(evr1, evr2):
+    """Compares (epoch, version, release) tuples like rpm does"""
+    epoch1, epoch2 = int(evr1[0] or 0), int(evr2[0] or 0)
+    if epoch1 != epoch2:
+        return cmp(epoch1, epoch2)
+    return _vercmp(evr1[1], evr2[1]) or _vercmp(evr1[2] or "", evr2[2] or "")
+
+def _parse_primary(stream, archs):
+    """Returns newest {name: (epoch, version, release)} in primary.xml"""
+    packages = {}
+    for _, elem in etree.iterparse(stream, events=("end",),
+                                   tag=COMMON_NS + "package"):
+        if elem.findtext(COMMON_NS + "arch") in archs:
+            name = intern(elem.findtext(COMMON_NS + "name"))
+            version = elem.find(COMMON_NS + "version")
+            evr = (version.get("epoch"), version.get("ver"),
+                   version.get("rel"))
+            if name not in packages or compare_evr(evr, packages[name]) > 0:
+                packages[name] = evr
+        # drop parsed packages to keep memory use flat
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+    return packages
+
+def repo_packages(baseurl, archlist=("src",), packages=None):
+    """Returns newest {name: (epoch, version, release)} of repository packages
+
+    primary.xml of the repository at baseurl is parsed while it is
+    downloaded, keeping only names and versions of packages with an arch in
+    archlist. Newer versions in packages dict, if given, are kept and it is
+    updated instead of a new one. With METADATA_CACHE set, primary.xml is
+    only downloaded when the repository has changed.
+    """
+    if packages is None:
+        packages = {}
+    archs = frozenset(archlist)
+    try:
+        location, _, checksum = repo_metadata(baseurl)["primary"]
+        found = None
+        if METADATA_CACHE is not None:
+            found = METADATA_CACHE.packages(baseurl, checksum or location,
+                                            archs)
+        if found is None:
+            stream = _open_metadata(baseurl, location)
+            try:
+                found = _parse_primary(stream, archs)
+            finally:
+                stream.close()
+            if METADATA_CACHE is not None:
+                METADATA_CACHE.store_packages(baseurl, checksum or location,
+                                              archs, found)
+    except (IOError, KeyError, zlib.error, etree.XMLSyntaxError), e:
+        raise RuntimeError("Could not setup repo at url %s: %s" % (baseurl, e))
+    for name, evr in found.iteritems():
+        if name not in packages or compare_evr(evr, packages[name]) > 0:
+            packages[name] = evr
+    return packages
+
+class DiffYum(_YumBase):
     def __init__(self):
         yum.YumBase.__init__(self)
         self.dy_repos = {'old':[], 'new':[]}
@@ -101,76 +402,69 @@ class DiffYum(yum.YumBase):
         return ygh
 
 def short_diff(new, old):
+    """Returns {"added"|"removed"|"modified": [names]} of source packages
 
-    my = DiffYum()
-    my.dy_shutdown_all_other_repos()
-
+    Only names and versions are compared, so the repository primary metadata
+    is enough and yum is not needed.
+    """
+    old_pkgs = {}
     for r in old:
-        try:
-            my.dy_setup_repo('old', str(r))
-        except yum.Errors.RepoError, e:
-            raise RuntimeError("Could not setup repo at url  %s: %s" % (r, e))
-    
+        repo_packages(str(r), packages=old_pkgs)
+    new_pkgs = {}
     for r in new:
-        try:
-            my.dy_setup_repo('new', str(r))
-        except yum.Errors.RepoError, e:
-            raise RuntimeError("Could not setup repo at url %s: %s" % (r, e))
-
-    ygh = my.dy_diff()
+        repo_packages(str(r), packages=new_pkgs)
 
-    added = removed = modified = []
     diff = {}
-
-    if ygh.add:
-        added = [ pkg.name for pkg in ygh.add ]
-        if added:
-            diff["added"] = added
-    if ygh.remove:
-        removed = [ pkg.name for pkg in ygh.remove ]
-        if removed:
-            diff["removed"] = removed
-    if ygh.modified:
-        for pkg, oldpkg in ygh.modified:
-            if not pkg.ver == oldpkg.ver:
-                modified.append(pkg.name)
-        if modified:
-            diff["modified"] = modified
+    added = sorted(set(new_pkgs).difference(old_pkgs))
+    if added:
+        diff["added"] = added
+    removed = sorted(set(old_pkgs).difference(new_pkgs))
+    if removed:
+        diff["removed"] = removed
+    modified = sorted(name for name, evr in new_pkgs.iteritems()
+                      if name in old_pkgs and evr[1] != old_pkgs[name][1])
+    if modified:
+        diff["modified"] = modified
 
     return diff
 
-def generate_short_diff(new, old):
+def format_short_diff(diff):
 
     report = []
 
-    for k, v in short_diff(new, old).items():
+    for k, v in diff.items():
         report.append("%s: %s" % (k, ", ".join(v)))
 
     return "\n".join(report)
 
-def generate_report(new, old, quiet=True, archlist=['src'], size=False, rebuilds=False, commits=False):
- 
+def generate_short_diff(new, old):
+
+    return format_short_diff(short_diff(new, old))
+
+def iter_report(new, old, quiet=True, archlist=['src'], size=False, rebuilds=False, commits=False):
+    """Yields report entries, separated by newlines, as they are generated"""
+
+    if yum is None:
+        raise RuntimeError("yum is needed for full repository reports")
     my = DiffYum()
     my.dy_shutdown_all_other_repos()
     my.dy_archlist = archlist
-    report = []
-
-    if not quiet: report.append('setting up repos')
+    if not quiet: yield 'setting up repos'
     for r in old:
-        if not quiet: report.append("setting up old repo %s" % r)
+        if not quiet: yield "setting up old repo %s" % r
         try:
             my.dy_setup_repo('old', str(r))
         except yum.Errors.RepoError, e:
             raise RuntimeError("Could not setup repo at url  %s: %s" % (r, e))
     
     for r in new:
-        if not quiet: report.append("setting up new repo %s" % r)
+        if not quiet: yield "setting up new repo %s" % r
         try:
             my.dy_setup_repo('new', str(r))
         except yum.Errors.RepoError, e:
             raise RuntimeError("Could not setup repo at url %s: %s" % (r, e))
 
-    if not quiet: report.append('performing the diff')
+    if not quiet: yield 'performing the diff'
     ygh = my.dy_diff()
     
 
@@ -180,7 +474,7 @@ def generate_report(new, old, quiet=True, archlist=['src'], size=False, rebuilds
     old_ts = datetime.datetime.fromtimestamp(old_repo.repoXML.timestamp)
     new_name = urlparse.urlsplit(new_repo.urls[0])[2].replace("/", " ")
     old_name = urlparse.urlsplit(old_repo.urls[0])[2].replace("/"," ")
-    report.append('Changes introduced to repository%screated at %s compared to repository%screated at %s\n\n' % (new_name, new_ts, old_name, old_ts))
+    yield 'Changes introduced to repository%screated at %s compared to repository%screated at %s\n\n' % (new_name, new_ts, old_name, old_ts)
 
     total_sizechange = 0
     add_sizechange = 0
@@ -189,20 +483,20 @@ def generate_report(new, old, quiet=True, archlist=['src'], size=False, rebuilds
     commits = 0
     if ygh.add:
         for pkg in ygh.add:
-            report.append('New package %s' % pkg.name)
-            report.append('        %s' % pkg.summary)
+            yield 'New package %s' % pkg.name
+            yield '        %s' % pkg.summary
             add_sizechange += int(pkg.size)
             commits += 1
                 
     if ygh.remove:
         for pkg in ygh.remove:
-            report.append('Removed package %s' % pkg.name)
+            yield 'Removed package %s' % pkg.name
             if ygh.obsoleted.has_key(pkg):
-                report.append('Obsoleted by %s' % ygh.obsoleted[pkg])
+                yield 'Obsoleted by %s' % ygh.obsoleted[pkg]
             remove_sizechange += (int(pkg.size))
                 
     if ygh.modified:
-        report.append('Updated Packages:\n')
+        yield 'Updated Packages:\n'
         for (pkg, oldpkg) in ygh.modified:
             msg = "%s-%s-%s" % (pkg.name, pkg.ver, pkg.rel)
             dashes = "-" * len(msg) 
@@ -240,24 +534,50 @@ def generate_report(new, old, quiet=True, archlist=['src'], size=False, rebuilds
                 rebuilt = rebuilt + 1
                 if  rebuilds:
                     msg += "\n* Package rebuilt due to dependencies\n"
-                    report.append(msg)
+                    yield msg
             else:
-                report.append(msg)
+                yield msg
 
 
     mod = len(ygh.modified) - rebuilt
-    report.append('Summary:')
-    report.append('Added Packages: %s' % len(ygh.add))
-    report.append('Removed Packages: %s' % len(ygh.remove))
-    report.append('Modified Packages: %d' % mod)
+    yield 'Summary:'
+    yield 'Added Packages: %s' % len(ygh.add)
+    yield 'Removed Packages: %s' % len(ygh.remove)
+    yield 'Modified Packages: %d' % mod
     if rebuilds:
-        report.append('Rebuilt Packages: %s' % rebuilt)
+        yield 'Rebuilt Packages: %s' % rebuilt
     if size:
-        report.append('Size of added packages: %s' % add_sizechange)
-        report.append('Size change of modified packages: %s' % total_sizechange)
-        report.append('Size of removed packages: %s' % remove_sizechange)
+        yield 'Size of added packages: %s' % add_sizechange
+        yield 'Size change of modified packages: %s' % total_sizechange
+        yield 'Size of removed packages: %s' % remove_sizechange
     if commits:
-        report.append('Count of OBS commits: %d' % commits)
-
-    return "\n".join(report)
+        yield 'Count of OBS commits: %d' % commits
+
+def write_report(out, new, old, max_lines=None, **kwargs):
+    """Writes report of iter_report() to file like out while generating it
+
+    Returns lines to summarize the report: the max_lines first lines, or all
+    if max_lines is None, followed by the closing summary of the report.
+    """
+    lines = []
+    truncated = False
+    in_summary = False
+    for count, entry in enumerate(iter_report(new, old, **kwargs)):
+        if count:
+            out.write("\n")
+        out.write(entry)
+        in_summary = in_summary or entry == "Summary:"
+        if in_summary or max_lines is None:
+            lines.extend(entry.split("\n"))
+        elif not truncated:
+            entry_lines = entry.split("\n")
+            if len(lines) + len(entry_lines) > max_lines:
+                truncated = True
+                entry_lines = entry_lines[:max_lines - len(lines)] + ["..."]
+            lines.extend(entry_lines)
+    return lines
+
+def generate_report(new, old, **kwargs):
+
+    return "\n".join(iter_report(new, old, **kwargs))
 
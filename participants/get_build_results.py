@@ -34,10 +34,10 @@
       A list of package names that have failed to build
 """
 
-from boss.obs import BuildServiceParticipant
+from boss.obs import BuildServiceParticipant, RepositoryMixin, OK_RESULTS
 
 
-class ParticipantHandler(BuildServiceParticipant):
+class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
     """Participant class as defined by the SkyNET API."""
 
     def handle_wi_control(self, ctrl):
@@ -81,14 +81,22 @@ class ParticipantHandler(BuildServiceParticipant):
             exclude_archs = wid.fields.exclude_archs or []
 
         failures = set()
-        for repo in self.obs.getProjectRepositories(prj):
+        meta = self.get_project_meta(prj)
+        for repo in meta.repositories:
             if repo in exclude_repos:
                 continue
-            archs = self.obs.getRepositoryArchs(prj, repo)
-            archs = [arch for arch in archs if arch not in exclude_archs]
-            # Get results
-            results = self.obs.getRepoResults(prj, repo)
-            failures.update(self.get_failures(results, archs))
+            archs = [arch for arch in meta.archs(repo)
+                     if arch not in exclude_archs]
+            # Get results, shared with other participants in the process
+            results = self.get_repo_results(prj, repo)
+            for arch in archs:
+                # In a link project, unbuilt packages from the link-source
+                # are reported as 'excluded' (which is as good as success)
+                # another OK state is 'disabled'
+                failures.update(
+                    pkg for pkg, code in results.results[arch].iteritems()
+                    if code not in OK_RESULTS
+                )
 
         # filter results
         if pkgs:
@@ -101,28 +109,3 @@ class ParticipantHandler(BuildServiceParticipant):
             wid.fields.failures = list(failures)
         else:
             wid.result = True
-
-    def get_failures(self, results, archs):
-        """Compare two sets of results.
-
-        :param results: The new results as returned by
-          BuildService.getRepoResults()
-        :param archs: list of architectures
-
-        :returns: A list of failures
-        """
-        failures = {}
-        for arch in archs:
-            self.log.debug("Looking at %s", arch)
-            for pkg in results[arch].keys():
-                self.log.debug("now %s %s", pkg, results[arch][pkg])
-                # If we succeed then continue to the next package.
-                # In a link project, unbuilt packages from the link-source
-                # are reported as 'excluded' (which is as good as success)
-                # another OK state is 'disabled'
-                if results[arch][pkg] in ["succeeded", "excluded", "disabled"]:
-                    continue
-                else:
-                    # a broken new package is also a new failure
-                    failures[pkg] = True
-        return failures.keys()
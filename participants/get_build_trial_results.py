@@ -31,12 +31,19 @@ destination project.
 import itertools
 from collections import defaultdict
 
-from boss.obs import BuildServiceParticipant
+from boss.obs import BuildServiceParticipant, RepositoryMixin, MetadataCache, \
+        OK_RESULTS
 
 
-class ParticipantHandler(BuildServiceParticipant):
+class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
     """Participant class as defined by the SkyNET API."""
 
+    def __init__(self):
+        BuildServiceParticipant.__init__(self)
+        # Verdicts of earlier comparisons, reused while the results of both
+        # projects stay the same
+        self._comparisons = MetadataCache(lifetime=3600, size=64)
+
     def handle_wi_control(self, ctrl):
         """Job control thread."""
         pass
@@ -57,48 +64,65 @@ class ParticipantHandler(BuildServiceParticipant):
 
         :returns: A list of new failures
         """
-        new_failures = {}
-        old_failures = {}
-        reqs = defaultdict(set)
-        for act in acts:
-            reqs[act["type"]].add(act["targetpackage"])
+        new_failures, old_failures = self._classify(
+            trial_results, orig_results, archs
+        )
+        return (list(self._drop_deleted(new_failures, acts)),
+                list(old_failures))
 
+    @staticmethod
+    def _classify(trial_results, orig_results, archs):
+        """Split trial failures into new and old ones.
+
+        :returns: Tuple of new and old failure sets
+        """
+        new_failures = set()
+        old_failures = set()
         for arch in archs:
-            self.log.debug("Looking at %s", arch)
             if arch not in trial_results:
                 continue
-            for pkg in trial_results[arch].keys():
-                self.log.debug("now %s %s", pkg, trial_results[arch][pkg])
-                # If we succeed then continue to the next package.
-                # In a link project, unbuilt packages from the link-source
-                # are reported as 'excluded' (which is as good as success)
-                if trial_results[arch][pkg] in [
-                        "succeeded", "excluded", "disabled"
-                ]:
+            orig_arch = orig_results.get(arch, {})
+            for pkg, code in trial_results[arch].iteritems():
+                if code in OK_RESULTS:
                     continue
-                # if a pkg has failed in trial build and is in the
-                # original results...
-                if pkg in orig_results[arch]:
-                    self.log.debug("orig %s %s", pkg, orig_results[arch][pkg])
-                    # ... and had built successfuly there...
-                    if not orig_results[arch][pkg] == trial_results[arch][pkg]:
-                        # ...then this is a new failure
-                        new_failures[pkg] = True
-                    else:
-                        old_failures[pkg] = True
+                # a broken new package is also a new failure, and so is a
+                # package whose result changed
+                if orig_arch.get(pkg) != code:
+                    new_failures.add(pkg)
                 else:
-                    # a broken new package is also a new failure
-                    new_failures[pkg] = True
-
-        for fail in new_failures.keys():
-            if "delete" in reqs and fail in reqs["delete"]:
-                if "submit" in reqs:
-                    if fail not in reqs["submit"]:
-                        del(new_failures[fail])
-                else:
-                    del(new_failures[fail])
+                    old_failures.add(pkg)
+        return new_failures, old_failures
+
+    @staticmethod
+    def _drop_deleted(new_failures, acts):
+        """Leave out failures of packages deleted but not submitted."""
+        reqs = defaultdict(set)
+        for act in acts:
+            reqs[act["type"]].add(act["targetpackage"])
+        return new_failures - (reqs["delete"] - reqs["submit"])
+
+    def compare_results(self, prj, target_prj, repo, archs):
+        """Compare build results of a trial and its target repository.
 
-        return (new_failures.keys(), old_failures.keys())
+        The verdicts are kept and reused until either project has new
+        results.
+
+        :returns: Tuple of new and old failure sets
+        """
+        trial = self.get_repo_results(prj, repo)
+        orig = self.get_repo_results(target_prj, repo)
+        key = (self.obs.apiurl, prj, target_prj, repo)
+        previous = self._comparisons.get(key)
+        if (previous is None or previous["archs"] != archs or
+                previous["trial"] is not trial or
+                previous["orig"] is not orig):
+            self.log.debug("classifying results of %s in %s", prj, repo)
+            previous = {"archs": archs, "trial": trial, "orig": orig,
+                        "verdicts": self._classify(
+                            trial.results, orig.results, archs)}
+            self._comparisons.put(key, previous)
+        new_failures, old_failures = previous["verdicts"]
+        return set(new_failures), set(old_failures)
 
     def check_trial(self, prj, targets, acts, exc):
 
@@ -107,24 +131,21 @@ class ParticipantHandler(BuildServiceParticipant):
         new_failures = set()
         old_failures = set()
         for target_prj in targets:
-            for target_repo in self.obs.getProjectRepositories(target_prj):
+            meta = self.get_project_meta(target_prj)
+            for target_repo in meta.repositories:
                 if target_repo in exclude_repos:
                     continue
-                archs = self.obs.getRepositoryArchs(target_prj, target_repo)
-                archs = [arch for arch in archs if arch not in exclude_archs]
+                archs = [arch for arch in meta.archs(target_repo)
+                         if arch not in exclude_archs]
                 self.log.debug('archs: %s', archs)
-                # Get trial build results
-                trial_results = self.obs.getRepoResults(prj, target_repo)
-                # Get destination results
-                orig_results = self.obs.getRepoResults(target_prj, target_repo)
-                # compare them and return new failures
-                comparison = self.get_new_failures(
-                    trial_results, orig_results, archs, acts
+                # compare trial and destination results
+                comparison = self.compare_results(
+                    prj, target_prj, target_repo, archs
                 )
                 new_failures.update(comparison[0])
                 old_failures.update(comparison[1])
 
-        return new_failures - old_failures
+        return self._drop_deleted(new_failures, acts) - old_failures
 
     @BuildServiceParticipant.setup_obs
     def handle_wi(self, wid):
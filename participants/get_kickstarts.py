@@ -45,7 +45,7 @@ import os, re
 
 from boss.obs import BuildServiceParticipant, RepositoryMixin
 from boss.lab import Lab
-from boss.rpm import extract_rpm
+from boss.rpm import read_rpm_files
 
 
 class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
@@ -106,9 +106,9 @@ class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
                                 target, binary, lab.path))
 
             for rpm in rpms:
-                # Extract kickstart files
+                # Read kickstart files
                 found = False
-                for fname in extract_rpm(rpm, lab.path, patterns=["*.ks"]):
+                for fname, contents in read_rpm_files(rpm, patterns=["*.ks"]):
                     # Read ks contents in images array
                     basedir, basename = os.path.split(fname)
                     if [True for pattern in ignore if pattern.match(basename)]:
@@ -116,7 +116,7 @@ class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
                     kickstarts.append({
                         "basedir": basedir,
                         "basename": basename,
-                        "contents": lab.open(fname).read()})
+                        "contents": contents})
                     found = True
                 if not found:
                     errors.append("%s did not contain .ks files" %
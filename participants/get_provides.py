@@ -56,9 +56,9 @@ is not set and worktiem result will be False.
 """
 from collections import defaultdict
 from urllib2 import HTTPError
-from boss.obs import BuildServiceParticipant
+from boss.obs import BuildServiceParticipant, RepositoryMixin
 
-class ParticipantHandler(BuildServiceParticipant):
+class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
     """Participant class as defined by the SkyNET API"""
 
     def handle_wi_control(self, ctrl):
@@ -116,19 +116,12 @@ class ParticipantHandler(BuildServiceParticipant):
             result[package] = defaultdict(list)
             for target in targets:
                 binaries = self.obs.getBinaryList(project, target, package)
-                for binary in binaries:
+                for binary, bininfo in self.map_binary_info(
+                        project, target, package, binaries,
+                        on_error=self.__bininfo_failed):
                     self.log.info(
                         "Checking %s from %s in %s" % (binary, package, target)
                     )
-                    try:
-                        bininfo = self.obs.getBinaryInfo(project, target,
-                                                         package, binary)
-                    except Exception:
-                        self.log.exception(
-                            "Failed to get bininfo for %s" % binary
-                        )
-                        continue
-
                     if bininfo.get("arch", "src") == "src":
                         continue
                     for name in bininfo.get("provides", []):
@@ -140,3 +133,8 @@ class ParticipantHandler(BuildServiceParticipant):
         if found:
             return result
         return None
+
+    def __bininfo_failed(self, binary, exc_info):
+        """Log binary info fetch failure."""
+        self.log.error("Failed to get bininfo for %s" % binary,
+                       exc_info=exc_info)
@@ -32,8 +32,8 @@ class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
                 n, v, r, e, a = splitFilename(binary)
                 if n != d.get("binary", pkg):
                     continue
-                bininfo = self.obs.getBinaryInfo(d["project"],
-                                                 target, pkg, binary)
+                bininfo = self.get_binary_info(d["project"],
+                                               target, pkg, binary)
                 versions[pkg].update({"version": v,
                                       "release": r.split("."),
                                       "epoch": e,
@@ -13,6 +13,9 @@ returns success if the repository has been published.
    arch(string):
       Optionally, the arch in above repository. if not provided the state of
       all archs in the repository are checked
+   action(string):
+      Optionally, "update" to feed the OBS event in ev field to the cached
+      project states instead of checking anything
 
 :term:`Workitem` fields OUT:
 
@@ -20,26 +23,74 @@ returns success if the repository has been published.
    result(Boolean):
       True if repository(ies are) is published, False otherwise.
 
+Project states are cached in the participant process and refetched from OBS
+when older than the configured lifetime. BUILD_SUCCESS, BUILD_FAIL and
+SRCSRV_COMMIT events sent with action "update" (see the
+\*.update_repo_state.pdef processes) mark the affected state as not ready
+and REPO_PUBLISHED makes the next check refetch the publish state. Events
+only ever delay a positive result, as they reach a single participant
+instance in no particular order::
+
+   [is_repo_published]
+   # seconds
+   lifetime = 15
+
 """
 import datetime
-from copy import copy
+
+from lxml import etree
+from osc import core
 
 from boss.obs import BuildServiceParticipant
 
 
+# OBS events which update cached project state
+STATE_EVENTS = frozenset([
+    "REPO_PUBLISHED", "BUILD_SUCCESS", "BUILD_FAIL", "SRCSRV_COMMIT"
+])
+
+
 class State(object):
     """Represents a project source and publish state cached for a set time"""
 
-    def __init__(self, obs, project, log):
+    def __init__(self, obs, project, log, lifetime=15):
         self.checked = None
-        # FIXME: make it configurable
-        self.lifetime = datetime.timedelta(seconds=15)
+        self.lifetime = datetime.timedelta(seconds=lifetime)
         self._obs = obs
         self.project = project
-        self._source_state = None
+        self._source_state = {}
+        # {package: srcmd5} from last refresh
+        self._revisions = None
         self._publish_states = None
+        # packages changed since their source state was checked
+        self._dirty_packages = set()
         self.log = log
 
+    def apply_event(self, event):
+        """Update cached state from an OBS event of this project"""
+
+        label = event.get("label")
+        if label == "REPO_PUBLISHED":
+            # events arrive unordered, so a late one could mark a repository
+            # published after newer build results, ask OBS instead
+            self._publish_states = None
+        elif label in ("BUILD_SUCCESS", "BUILD_FAIL"):
+            # new build results have to be published again
+            repo_arch = (event.get("repository"), event.get("arch"))
+            if (self._publish_states is not None and
+                    repo_arch in self._publish_states):
+                self._publish_states[repo_arch] = False
+        elif label == "SRCSRV_COMMIT":
+            package = event.get("package")
+            if package:
+                self._dirty_packages.add(package)
+                if self._revisions is not None:
+                    # new revision is not known until next refresh
+                    self._revisions[package] = None
+        else:
+            return
+        self.log.debug("applied %s to state of %s", label, self.project)
+
     @property
     def expired(self):
         """indicates whether this state is expired and should be refreshed"""
@@ -68,40 +119,85 @@ class State(object):
 
         return self._publish_states
 
-    @property
-    def source_state(self):
-        """caching property representing the source state of a project"""
-
-        if self._source_state is None or self.expired:
-            self.log.debug("refreshing source state of %s", self.project)
-            states = {}
-            for package in self._obs.getPackageList(self.project):
-                if package == '_pattern':
-                    continue
-
-                states[package] = False
-                try:
-                    filelist = self._obs.getPackageFileList(
-                        self.project, package
-                    )
-                    self.log.debug("file list: %s", filelist)
-                    if "_service" in filelist:
-                        x = self._obs.getServiceState(self.project, package)
-                        self.log.debug("_service state: %s", x)
-                        if x == "succeeded":
-                            states[package] = True
-                    else:
-                        states[package] = True
-                except Exception, exc:
-                    self.log.exception(
-                        'Failed to get source state of %s', package
-                    )
-                    if "failed" in str(exc):
-                        states[package] = True
-
-            self._source_state = states
-
-        return self._source_state
+    def _source_revisions(self):
+        """Get {package: srcmd5} of the project with a single API call
+
+        Falls back to the plain package list, with unknown revisions, if the
+        source info listing is not available.
+        """
+        url = core.makeurl(
+            self._obs.apiurl, ["source", self.project],
+            query={"view": "info", "nofilename": "1"}
+        )
+        try:
+            tree = etree.parse(core.http_GET(url))
+        except Exception:
+            self.log.exception("Failed to get source info of %s", self.project)
+            return dict.fromkeys(self._obs.getPackageList(self.project))
+        return dict(
+            (info.get("package"), info.get("srcmd5"))
+            for info in tree.iterfind("sourceinfo")
+        )
+
+    def source_states(self, packages=None):
+        """caching method representing the source state of project packages
+
+        Packages are checked again only if their sources changed, they were
+        not ready on last check or the state expired and revisions are not
+        known.
+
+        :param packages: Packages to evaluate, all if empty
+        :returns: {package: ready} of existing wanted packages
+        """
+
+        if self._revisions is None or self.expired:
+            self.log.debug("refreshing source revisions of %s", self.project)
+            revisions = self._source_revisions()
+            revisions.pop("_pattern", None)
+            recheck = set(
+                package for package, rev in revisions.iteritems()
+                if rev is None or
+                rev != self._revisions.get(package) or
+                not self._source_state.get(package, False)
+            ) if self._revisions is not None else set(revisions)
+            for package in set(self._source_state) - set(revisions):
+                del self._source_state[package]
+            self._revisions = revisions
+            self._dirty_packages.update(recheck)
+
+        wanted = set(packages or self._revisions)
+        wanted.intersection_update(self._revisions)
+        changed = (
+            wanted & self._dirty_packages |
+            wanted - set(self._source_state)
+        )
+        if changed:
+            self.log.debug(
+                "refreshing source state of %s in %s",
+                ", ".join(sorted(changed)), self.project
+            )
+        for package in changed:
+            self._source_state[package] = self._package_source_state(package)
+        self._dirty_packages.difference_update(changed)
+
+        return dict(
+            (package, self._source_state[package]) for package in wanted
+        )
+
+    def _package_source_state(self, package):
+        """Check whether package sources are ready"""
+
+        try:
+            filelist = self._obs.getPackageFileList(self.project, package)
+            self.log.debug("file list: %s", filelist)
+            if "_service" in filelist:
+                x = self._obs.getServiceState(self.project, package)
+                self.log.debug("_service state: %s", x)
+                return x == "succeeded"
+            return True
+        except Exception, exc:
+            self.log.exception('Failed to get source state of %s', package)
+            return "failed" in str(exc)
 
     def ready(self, repository=None, architecture=None, exclude_repos=None,
               exclude_archs=None, packages=None):
@@ -126,13 +222,8 @@ class State(object):
         self.log.debug("publish state was %s", ready)
 
         if ready and packages is not None:
-            # get reference to source_state dict
-            source_state = copy(self.source_state)
-            if source_state is None:
-                _ = len(self.source_state and self.source_state.keys())
-                source_state = copy(self.source_state)
-
             # if not packages were specified care about all of them
+            source_state = self.source_states(packages)
             if not packages:
                 packages = source_state.keys()
 
@@ -157,9 +248,10 @@ class State(object):
 class StateRegistry(object):
     """An in-memory registry of project states"""
 
-    def __init__(self, log):
+    def __init__(self, log, lifetime=15):
         self._states = {}
         self.log = log
+        self.lifetime = lifetime
 
     def register(self, obs, project):
         """Register an obs project"""
@@ -167,9 +259,23 @@ class StateRegistry(object):
 
         if key not in self._states:
             self.log.debug("registering %s", key)
-            self._states[key] = State(obs, project, self.log)
+            self._states[key] = State(obs, project, self.log, self.lifetime)
         return self._states[key]
 
+    def handle_event(self, obs, event):
+        """Update registered project state from an OBS event
+
+        :returns: True if a registered state was updated
+        """
+        if not event or event.get("label") not in STATE_EVENTS:
+            return False
+        state = self._states.get((obs.apiurl, event.get("project")))
+        if state is None:
+            # nobody is waiting for this project
+            return False
+        state.apply_event(event)
+        return True
+
 
 class ParticipantHandler(BuildServiceParticipant):
     """Participant class as defined by the SkyNET API."""
@@ -179,13 +285,14 @@ class ParticipantHandler(BuildServiceParticipant):
         BuildServiceParticipant.__init__(self)
         # start with empty project state registry
         self._registry = None
+        self.lifetime = 15
 
     @property
     def registry(self):
         # Lazy StateRegistry property as self.log is not available at
         # ParticipantHandler init time
         if self._registry is None:
-            self._registry = StateRegistry(self.log)
+            self._registry = StateRegistry(self.log, self.lifetime)
         return self._registry
 
     def handle_wi_control(self, ctrl):
@@ -195,7 +302,11 @@ class ParticipantHandler(BuildServiceParticipant):
     @BuildServiceParticipant.get_oscrc
     def handle_lifecycle_control(self, ctrl):
         """Participant control thread."""
-        pass
+        if ctrl.message == "start":
+            if ctrl.config.has_option("is_repo_published", "lifetime"):
+                self.lifetime = ctrl.config.getint(
+                    "is_repo_published", "lifetime"
+                )
 
     @BuildServiceParticipant.setup_obs
     def handle_wi(self, wid):
@@ -203,6 +314,17 @@ class ParticipantHandler(BuildServiceParticipant):
 
         wid.result = False
 
+        if wid.params.action == "update":
+            updated = self.registry.handle_event(
+                self.obs, wid.fields.ev.as_dict()
+            )
+            self.log.info(
+                "%s event for %s %s", wid.fields.ev.label,
+                wid.fields.ev.project, "applied" if updated else "ignored"
+            )
+            wid.result = True
+            return
+
         # Decide which packages to care about when checking source state
         # empty list will mean checking all packages
         # this is useful for checking trial build project
@@ -26,17 +26,24 @@
                                      target project
     msg(list):
        List of string messages, describing the diff, can be used
-       for logging
+       for logging. Long reports are cut to max_report_lines lines
+       followed by the report summary
+    repodiff_report(string):
+       Path of the complete long report, if report_dir is configured
 
 :Returns:
     result(Boolean):
        True if diff was found, false otherwise
 
 """
-from boss.obs import BuildServiceParticipant
+import codecs
+import os
+import time
+
+from boss.obs import BuildServiceParticipant, RepositoryMixin
 import repo_diff
 
-class ParticipantHandler(BuildServiceParticipant):
+class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
 
     def handle_wi_control(self, ctrl):
         pass
@@ -45,6 +52,20 @@ class ParticipantHandler(BuildServiceParticipant):
     def handle_lifecycle_control(self, ctrl):
         if ctrl.message == "start":
             self.reposerver = ctrl.config.get("obs_repodiff", "reposerver")
+            self.report_dir = None
+            if ctrl.config.has_option("obs_repodiff", "report_dir"):
+                self.report_dir = ctrl.config.get("obs_repodiff", "report_dir")
+            self.max_report_lines = 200
+            if ctrl.config.has_option("obs_repodiff", "max_report_lines"):
+                self.max_report_lines = ctrl.config.getint(
+                    "obs_repodiff", "max_report_lines")
+            if ctrl.config.has_option("obs_repodiff", "cache_dir"):
+                size = 64
+                if ctrl.config.has_option("obs_repodiff", "cache_size"):
+                    size = ctrl.config.getint("obs_repodiff", "cache_size")
+                repo_diff.METADATA_CACHE = repo_diff.MetadataCache(
+                    ctrl.config.get("obs_repodiff", "cache_dir"),
+                    size * 1024 * 1024)
 
     @BuildServiceParticipant.setup_obs
     def handle_wi(self, wi):
@@ -53,13 +74,13 @@ class ParticipantHandler(BuildServiceParticipant):
         if not wi.fields.msg:
             wi.fields.msg = []
 
-        for repo in self.obs.getProjectRepositories(wi.params.source):
+        for repo in self.get_project_meta(wi.params.source).repositories:
             if repo in wi.fields.exclude_repos:
                 continue
             else:
                 src_url = "%s/%s/%s" % ( self.reposerver, wi.params.source.replace(":",":/"), repo)
                 break
-        for repo in self.obs.getProjectRepositories(wi.params.target):
+        for repo in self.get_project_meta(wi.params.target).repositories:
             if repo in wi.fields.exclude_repos:
                 continue
             else:
@@ -68,23 +89,45 @@ class ParticipantHandler(BuildServiceParticipant):
 
         self.log.info("urls: %s and %s" % (src_url, trg_url))
 
+        # only needs primary metadata of the repositories
+        short_diff = repo_diff.short_diff([src_url], [trg_url])
+
         if wi.params.mode == "short":
-            report = repo_diff.generate_short_diff([src_url], [trg_url])
+            report = repo_diff.format_short_diff(short_diff)
+            report = report.split("\n") if report else []
         elif wi.params.mode == "long":
-            report = repo_diff.generate_report([src_url], [trg_url])
+            report = self.write_report(wi, [src_url], [trg_url])
         else:
             raise RuntimeError("unknown report mode %s" % wi.params.mode)
 
         wi.result = True
         if report:
-            self.log.info(report)
+            self.log.info("\n".join(report))
             wi.result = False
             wi.fields.msg.append("Changes in project %s compared to %s, please check." % (wi.params.source, wi.params.target))
-            wi.fields.msg.extend(report.split("\n"))
+            wi.fields.msg.extend(report)
 
-        short_diff = repo_diff.short_diff([src_url], [trg_url])
         if short_diff:
             wi.fields.repodiff = {'src_project':wi.params.source,
                                   'tgt_project':wi.params.target,
                                   'diff':short_diff}
 
+    def write_report(self, wi, new, old):
+        """Streams long report to report_dir, returns the summary lines"""
+        path = None
+        if self.report_dir:
+            name = "%s_%s_%s.txt" % (wi.params.source, wi.params.target,
+                                     time.strftime("%Y%m%d%H%M%S"))
+            path = os.path.join(self.report_dir, name.replace("/", "_"))
+            out = codecs.open(path, "w", "utf-8")
+        else:
+            out = codecs.open(os.devnull, "w", "utf-8")
+        try:
+            lines = repo_diff.write_report(out, new, old,
+                                           max_lines=self.max_report_lines)
+        finally:
+            out.close()
+        if path:
+            self.log.info("report written to %s", path)
+            wi.fields.repodiff_report = path
+        return lines
@@ -40,9 +40,28 @@ This allows for example preventing multiple processes on one request::
     end
   end
 
+Action 'list' returns the held locks in the locks field, each with the
+number of waiting processes and how long the lock has been held and the
+longest waiter has waited (seconds)::
+
+  obsticket :action => 'list'
+
+The queues are kept in a sqlite database, <prjdir>/obsticket.db unless
+configured otherwise::
+
+  [obsticket]
+  prjdir = /var/lib/obsticket
+  db = /var/lib/obsticket/obsticket.db
+
+Queues left in prjdir by older versions are moved into the database when
+the participant starts.
+
 """
 
-import os, json
+import os, errno, json
+import sqlite3
+import threading
+import time
 from RuoteAMQP import Workitem
 
 class QueueEmpty(Exception):
@@ -54,109 +73,278 @@ class QueueNoNext(Exception):
 class QueueNotBusy(Exception):
     pass
 
-class WorkQueue(object):
-
-    def __init__(self, queuename):
+class TicketStore(object):
+    """
+    Work queues of all locks in a single sqlite database.
+
+    Every operation is a transaction, so concurrent participants sharing
+    the database always see consistent queues. The head of a queue is its
+    lowest ticket id, found through the (queue, id) index.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            queue TEXT NOT NULL,
+            data TEXT NOT NULL,
+            queued REAL NOT NULL,
+            acquired REAL
+        );
+        CREATE INDEX IF NOT EXISTS tickets_queue ON tickets (queue, id);
+        CREATE TABLE IF NOT EXISTS migrated (
+            queue TEXT PRIMARY KEY,
+            migrated REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path, timeout=60):
         """
-        queuename is the base filename which all the .xxx & .curr &
-        .tail files will be built on.
+        path is the database file, created if it doesn't exist.
+        timeout is how many seconds to wait for other writers.
         """
-        self.base = queuename
-        tail_pointer = self.base + ".tail"
-        if not os.path.exists(tail_pointer):
-            self._settail(0)
-            self._setcurr(0)
-        self.curr = self._getcurr()
-        self.tail = self._gettail()
-
-
-    def head(self):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(self.SCHEMA)
+
+    def close(self):
+        "Close the database"
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, func, *args):
+        "Private. Run func(cursor, *args) in a write transaction"
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(cursor, *args)
+            except:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+            return result
+
+    @staticmethod
+    def _head(cursor, queue):
+        "Private. Returns (id, data) of the queue head or None"
+        cursor.execute("SELECT id, data FROM tickets WHERE queue = ? "
+                       "ORDER BY id LIMIT 1", (queue,))
+        return cursor.fetchone()
+
+    def head(self, queue):
         """
         Returns the head of the Q or throws a QueueEmpty
         """
-        if self.isquiet():
+        with self._lock:
+            row = self._head(self._conn.cursor(), queue)
+        if row is None:
             raise QueueEmpty()
+        return row[1]
 
-        qcurr = self.base + "." + str(self.curr)
-        assert os.path.exists(qcurr)
-        qt = open(qcurr, "r")
-        data = qt.read()
-        qt.close()
-        return data
-
-
-    def isquiet(self):
+    def isquiet(self, queue):
         "If the Q is quiet"
-        return (True if (self.tail == self.curr) else False)
+        with self._lock:
+            return self._head(self._conn.cursor(), queue) is None
 
-    def add(self, data):
+    def add(self, queue, data):
         """
         Stores data onto the Q.  If the Q is quiet, returns true
         indicating that work can commence.
         """
-        wasquiet = True if (self.tail == self.curr) else False
-
-        # Assert the queue is clean
-        qtail = self.base + "." + str(self.tail)
-        print "creating %s" % qtail
-        assert not os.path.exists(qtail)
-        qt = open(qtail, "w")
-        qt.write(data)
-        qt.close()
-
-        # Where does the next item go
-        self.tail += 1
-        self._settail(self.tail)
+        return self._transaction(self._add, queue, data)
 
+    def add_if_quiet(self, queue, data):
+        """
+        Stores data onto the Q only if the Q is quiet, in the same
+        transaction as the check. Returns true if data was stored and
+        work can commence.
+        """
+        return self._transaction(self._add_if_quiet, queue, data)
+
+    def _add_if_quiet(self, cursor, queue, data):
+        "Private. add_if_quiet() transaction"
+        if self._head(cursor, queue) is not None:
+            return False
+        return self._add(cursor, queue, data)
+
+    def _add(self, cursor, queue, data):
+        "Private. add() transaction"
+        wasquiet = self._head(cursor, queue) is None
+        now = time.time()
+        cursor.execute("INSERT INTO tickets (queue, data, queued, acquired) "
+                       "VALUES (?, ?, ?, ?)",
+                       (queue, data, now, now if wasquiet else None))
         return wasquiet
 
-    def next(self):
+    def next(self, queue):
         """
         If there is a next workitem, promotes it to the head of the Q
         and returns it.
         Throws QueueNoNext if the Q is empty before the promotion.
         Throws QueueEmpty if the Q is empty after the promotion.
         """
-        if self.isquiet():
+        data = self._transaction(self._next, queue)
+        if data is None:
+            raise QueueEmpty()
+        return data
+
+    def _next(self, cursor, queue):
+        "Private. next() transaction"
+        row = self._head(cursor, queue)
+        if row is None:
             raise QueueNoNext()
+        cursor.execute("DELETE FROM tickets WHERE id = ?", (row[0],))
+        row = self._head(cursor, queue)
+        if row is None:
+            return None
+        cursor.execute("UPDATE tickets SET acquired = ? WHERE id = ?",
+                       (time.time(), row[0]))
+        return row[1]
+
+    def locks(self):
+        """
+        Returns list of held locks as dicts with keys:
+          lock: lock name
+          held: seconds the lock has been held
+          waiting: number of queued workitems waiting for the lock
+          wait: seconds the longest waiting workitem has waited
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("SELECT queue, MIN(acquired), COUNT(*) - 1, "
+                           "MIN(CASE WHEN acquired IS NULL THEN queued END) "
+                           "FROM tickets GROUP BY queue ORDER BY queue")
+            rows = cursor.fetchall()
+        return [{"lock": queue,
+                 "held": now - acquired if acquired else 0.0,
+                 "waiting": waiting,
+                 "wait": now - queued if queued else 0.0}
+                for queue, acquired, waiting, queued in rows]
+
+    def migrate(self, prjdir, log=None):
+        """
+        Imports work queues stored as <lock>.curr, <lock>.tail and
+        <lock>.<n> files under prjdir by older versions and removes the
+        files. Returns the names of the migrated locks.
 
-        # Delete old item
-        qcurr = self.base + "." + str(self.curr)
-        os.unlink(qcurr)
+        Imported locks are recorded in the database, so files left behind
+        by an interrupted migration are only removed on the next run.
+        Missing item files are skipped and reported to log if given.
+        """
+        migrated = []
+        for dirpath, _, filenames in os.walk(prjdir):
+            for name in filenames:
+                if not name.endswith(".tail"):
+                    continue
+                base = os.path.join(dirpath, name[:-len(".tail")])
+                queue = os.path.relpath(base, prjdir)
+                curr = self._read_pointer(base + ".curr")
+                tail = self._read_pointer(base + ".tail")
+                if self._transaction(self._import, queue, base, curr, tail,
+                                     log):
+                    migrated.append(queue)
+                for ticket in range(curr, tail):
+                    self._unlink("%s.%s" % (base, ticket))
+                self._unlink(base + ".curr")
+                self._unlink(base + ".tail")
+        return migrated
+
+    @staticmethod
+    def _read_pointer(path):
+        "Private. Read a .curr or .tail file of an old queue, 0 if missing"
+        try:
+            with open(path) as pointer_file:
+                return int(pointer_file.read() or 0)
+        except IOError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return 0
+
+    @staticmethod
+    def _unlink(path):
+        "Private. Remove a file which may be gone already"
+        try:
+            os.unlink(path)
+        except OSError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
 
-        # Next item
-        self.curr += 1
-        self._setcurr(self.curr)
+    def _import(self, cursor, queue, base, curr, tail, log):
+        """
+        Private. migrate() transaction for one queue. Returns false if the
+        queue was imported already.
+        """
+        cursor.execute("SELECT 1 FROM migrated WHERE queue = ?", (queue,))
+        if cursor.fetchone() is not None:
+            return False
+        for ticket in range(curr, tail):
+            path = "%s.%s" % (base, ticket)
+            try:
+                with open(path) as item_file:
+                    data = item_file.read()
+            except IOError, exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+                if log:
+                    log.warning("Work queue item %s is missing" % path)
+                continue
+            self._add(cursor, queue, data)
+        cursor.execute("INSERT INTO migrated (queue, migrated) VALUES (?, ?)",
+                       (queue, time.time()))
+        return True
+
+class WorkQueue(object):
+    "A single work queue in a TicketStore"
 
-        return self.head()
+    def __init__(self, store, queuename):
+        self.store = store
+        self.name = queuename
+
+    def head(self):
+        """
+        Returns the head of the Q or throws a QueueEmpty
+        """
+        return self.store.head(self.name)
 
-    def _setcurr(self, ticket):
-        "Private. Set the current ticket"
-        f = open(self.base + ".curr", "w")
-        f.write(str(ticket))
-        f.close()
+    def isquiet(self):
+        "If the Q is quiet"
+        return self.store.isquiet(self.name)
 
-    def _getcurr(self):
-        "Private. Get the current ticket"
-        f = open(self.base + ".curr", "r")
-        return int(f.read())
+    def add(self, data):
+        """
+        Stores data onto the Q.  If the Q is quiet, returns true
+        indicating that work can commence.
+        """
+        return self.store.add(self.name, data)
 
-    def _settail(self, ticket):
-        "Private. Set the tail ticket"
-        f = open(self.base + ".tail", "w")
-        f.write(str(ticket))
-        f.close()
+    def add_if_quiet(self, data):
+        """
+        Stores data onto the Q only if the Q is quiet. Returns true if
+        data was stored and work can commence.
+        """
+        return self.store.add_if_quiet(self.name, data)
 
-    def _gettail(self):
-        "Private. Get the tail ticket"
-        f = open(self.base + ".tail", "r")
-        return int(f.read())
+    def next(self):
+        """
+        If there is a next workitem, promotes it to the head of the Q
+        and returns it.
+        Throws QueueNoNext if the Q is empty before the promotion.
+        Throws QueueEmpty if the Q is empty after the promotion.
+        """
+        return self.store.next(self.name)
 
 class ParticipantHandler(object):
     "The Exo class wraps around this handler."
 
     def __init__(self):
         self.prjdir = None
+        self.store = None
 
     def send_to_engine(self, wi):
         """ Will get replaced by the EXO using a closure """
@@ -173,13 +361,15 @@ class ParticipantHandler(object):
 
         """
 
-        path = os.path.join(self.prjdir, project)
-        q = WorkQueue(path)
-        if nowait and not q.isquiet():
+        q = WorkQueue(self.store, project)
+        data = json.dumps(wid.to_h(), sort_keys=True, indent=4)
+        if nowait:
             # If we don't want to wait and there is Q, we'll just leave
+            if q.add_if_quiet(data):
+                wid.result = True
             return
 
-        if not q.add(json.dumps(wid.to_h(), sort_keys=True, indent=4)):
+        if not q.add(data):
             # Marking the wid to be forgotten ensures it's not sent
             # back to BOSS, and the process blocks
             wid.forget = True
@@ -201,8 +391,7 @@ class ParticipantHandler(object):
         allow that process to continue (unblocking it)
         """
 
-        path = os.path.join(self.prjdir, project)
-        q = WorkQueue(path)
+        q = WorkQueue(self.store, project)
 
         head_wi = Workitem(q.head())
         if head_wi.wfid != wid.wfid:
@@ -227,7 +416,17 @@ class ParticipantHandler(object):
         """ participant control thread """
         if ctrl.message == "start":
             self.prjdir = ctrl.config.get("obsticket", "prjdir")
-#FIXME: Check it is writable and let errors get raised sooner than later
+            if ctrl.config.has_option("obsticket", "db"):
+                path = ctrl.config.get("obsticket", "db")
+            else:
+                path = os.path.join(self.prjdir, "obsticket.db")
+            self.store = TicketStore(path)
+            for lock in self.store.migrate(self.prjdir, self.log):
+                self.log.info("Migrated work queue of %s" % lock)
+        elif ctrl.message == "stop":
+            if self.store:
+                self.store.close()
+                self.store = None
 
     def handle_wi(self, wid):
         "The bulk of the participant logic is handled here"
@@ -237,6 +436,11 @@ class ParticipantHandler(object):
         if wid.fields.msg is None:
             wid.fields.msg = []
 
+        if wid.params.action == 'list':
+            wid.fields.locks = self.store.locks()
+            wid.result = True
+            return
+
         missing = [name for name in ["action", "lock_project"]
                 if not getattr(wid.params, name, None)]
         if missing:
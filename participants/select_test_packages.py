@@ -54,10 +54,10 @@ binary packages produced by them that provide qa-tests are also selected.
 """
 
 from urllib2 import HTTPError
-from boss.obs import BuildServiceParticipant
+from boss.obs import BuildServiceParticipant, RepositoryMixin
 from copy import copy
 
-class ParticipantHandler(BuildServiceParticipant):
+class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
 
     """ Participant class as defined by the SkyNET API """
 
@@ -74,11 +74,9 @@ class ParticipantHandler(BuildServiceParticipant):
         binaries = self.obs.getBinaryList(project, target, package)
 
         selected = {}
-        for binary in binaries:
-            binary_name = "-".join(binary.split("-")[:-2])
-            if using == "provides":
-                bininfo = self.obs.getBinaryInfo(project, target, package,
-                                                 binary)
+        if using == "provides":
+            for binary, bininfo in self.map_binary_info(project, target,
+                                                        package, binaries):
                 if bininfo.get("arch", "src") == "src":
                     continue
 
@@ -87,9 +85,12 @@ class ParticipantHandler(BuildServiceParticipant):
                     provs.append(name.split("=")[0].strip())
 
                 if "qa-tests" in provs:
+                    binary_name = "-".join(binary.split("-")[:-2])
                     selected[binary_name] = provs
 
-            elif using == "name":
+        elif using == "name":
+            for binary in binaries:
+                binary_name = "-".join(binary.split("-")[:-2])
                 if binary_name.endswith("-tests"):
                     selected[binary_name] = []
 
@@ -187,8 +188,8 @@ class ParticipantHandler(BuildServiceParticipant):
                     for binary in binaries:
                         binary_name = "-".join(binary.split("-")[:-2])
                         if binary_name == wid.params.pattern:
-                            bininfo = self.obs.getBinaryInfo(project, target, wid.params.package,
-                                                             binary)
+                            bininfo = self.get_binary_info(project, target, wid.params.package,
+                                                           binary)
                             provides = bininfo.get("provides", [])
                             for required in bininfo.get("requires", []):
                                 selected[required] = provides
@@ -43,10 +43,10 @@ http://en.opensuse.org/openSUSE:Build_Service_Concept_project_linking
 
 """
 
-from boss.obs import BuildServiceParticipant
+from boss.obs import BuildServiceParticipant, RepositoryMixin
 import collections
 from lxml import etree
-from copy import copy
+from copy import copy, deepcopy
 import itertools
 
 
@@ -86,12 +86,22 @@ def _merge_paths(extra_paths, next_paths):
         if next_repo not in extra_paths:
             extra_paths[next_repo] = next_paths
         else:
+            paths = extra_paths[next_repo]
+            known = set(paths)
             for path in next_paths:
-                if path not in extra_paths[next_repo]:
-                    extra_paths[next_repo].append(path)
+                if path not in known:
+                    paths.append(path)
+                    known.add(path)
     return extra_paths
 
 
+def _copy_paths(extra_paths):
+    """ copy of extra paths with private lists """
+    return OrderedDefaultdict(
+        list, ((repo, list(paths)) for repo, paths in extra_paths.items())
+    )
+
+
 def get_extra_paths(repolinks, prjmeta):
     """generates build paths to a project
     categorized by repos they will be added to
@@ -115,7 +125,146 @@ def get_extra_paths(repolinks, prjmeta):
     return extra_paths
 
 
-class ParticipantHandler(BuildServiceParticipant):
+class PathResolver(object):
+    """Resolves the build paths reachable from a project.
+
+    The paths of a project are found by following the path elements of its
+    repositories to other projects. Paths of every (project, repository)
+    are followed only once and the results are memoized, so resolving
+    projects with long shared repository chains stays linear.
+
+    Before walking, the projects reachable from the resolved project are
+    discovered level by level and each level is passed to prefetch, so
+    their metas can be fetched concurrently.
+
+    :param get_prjmeta: Function returning project meta element by name
+    :param prefetch: Optional function taking a list of project names whose
+        metas will be needed next
+    """
+
+    def __init__(self, get_prjmeta, prefetch=None):
+        self.get_prjmeta = get_prjmeta
+        self.prefetch = prefetch
+        # (repolinks, project) -> paths to the project
+        self._extra = {}
+        # (repolinks, project, repo) -> paths to the path projects
+        self._next = {}
+        # (repolinks, project) -> all reachable paths
+        self._closures = {}
+
+    @staticmethod
+    def _key(repolinks):
+        """ hashable form of repolinks keeping the repository order """
+        return tuple(
+            (repo, frozenset(archs)) for repo, archs in repolinks.iteritems()
+        )
+
+    def extra_paths(self, repolinks, project, key=None):
+        """ memoized get_extra_paths() of a project, not to be modified """
+        key = (key or self._key(repolinks), project)
+        if key not in self._extra:
+            self._extra[key] = get_extra_paths(
+                repolinks, self.get_prjmeta(project)
+            )
+        return self._extra[key]
+
+    def next_paths(self, repolinks, project, repo, key=None):
+        """ memoized extra paths of the path projects of a repository,
+        not to be modified """
+        key = key or self._key(repolinks)
+        if (key, project, repo) not in self._next:
+            next_paths = OrderedDefaultdict(list)
+            prjmeta = self.get_prjmeta(project)
+            for repoelem in prjmeta.findall(
+                    ".//repository[@name='%s']" % repo):
+                for path in repoelem.findall("path"):
+                    next_paths = _merge_paths(
+                        _copy_paths(self.extra_paths(
+                            repolinks, path.get("project"), key
+                        )),
+                        next_paths
+                    )
+            self._next[(key, project, repo)] = next_paths
+        return self._next[(key, project, repo)]
+
+    def resolve(self, repolinks, project):
+        """ all build paths reachable from project, categorized by repos
+        they will be added to """
+        key = self._key(repolinks)
+        if (key, project) not in self._closures:
+            if self.prefetch is not None:
+                self._prefetch(repolinks, project)
+            self._closures[(key, project)] = self._resolve(
+                repolinks, project, key
+            )
+        return _copy_paths(self._closures[(key, project)])
+
+    def _prefetch(self, repolinks, project):
+        """ prefetch metas of projects reachable from project, one level
+        of the path graph at a time """
+        archs = set(itertools.chain.from_iterable(repolinks.itervalues()))
+        seen = set([project])
+        level = [project]
+        while level:
+            self.prefetch(level)
+            next_level = []
+            for prj in level:
+                try:
+                    prjmeta = self.get_prjmeta(prj)
+                except Exception:
+                    # reported when the walk needs the meta
+                    continue
+                for repoelem in prjmeta.findall('repository'):
+                    # only repositories with linked archs are followed
+                    if not any(archelem.text in archs
+                               for archelem in repoelem.findall('arch')):
+                        continue
+                    for path in repoelem.findall('path'):
+                        next_project = path.get('project')
+                        if next_project not in seen:
+                            seen.add(next_project)
+                            next_level.append(next_project)
+            level = next_level
+
+    def _resolve(self, repolinks, project, key):
+        """ breadth first walk of the path graph """
+        extra_paths = _copy_paths(self.extra_paths(repolinks, project, key))
+        known = dict(
+            (repo, set(paths)) for repo, paths in extra_paths.items()
+        )
+        # next paths depend only on project and repo, not on arch
+        done = set()
+        # position up to which paths of each repo have been followed
+        position = {}
+        finished = False
+        while not finished:
+            finished = True
+            for link_repo in extra_paths.keys():
+                paths = extra_paths[link_repo]
+                index = position.get(link_repo, 0)
+                # paths appended while walking are followed on the same pass
+                while index < len(paths):
+                    prj, repo, _ = paths[index]
+                    index += 1
+                    if (prj, repo) in done:
+                        continue
+                    done.add((prj, repo))
+                    finished = False
+                    next_paths = self.next_paths(repolinks, prj, repo, key)
+                    for next_repo, new_paths in next_paths.items():
+                        if next_repo not in extra_paths:
+                            extra_paths[next_repo] = list(new_paths)
+                            known[next_repo] = set(new_paths)
+                            continue
+                        for path in new_paths:
+                            if path not in known[next_repo]:
+                                extra_paths[next_repo].append(path)
+                                known[next_repo].add(path)
+                position[link_repo] = index
+        return extra_paths
+
+
+class ParticipantHandler(BuildServiceParticipant, RepositoryMixin):
     """Participant class as defined by the SkyNET API."""
 
     def handle_wi_control(self, ctrl):
@@ -130,41 +279,28 @@ class ParticipantHandler(BuildServiceParticipant):
     def get_prjmeta(self, project):
         """ Fetch a project meta from cache or server """
         prjmeta = self.cache.get(project)
-        if not prjmeta:
-            prjmeta = etree.fromstring(self.obs.getProjectMeta(project))
+        if prjmeta is None:
+            # the trial calculation modifies the flag elements so work on a
+            # private copy of the shared tree
+            prjmeta = deepcopy(self.get_project_meta(project).tree)
             self.cache[project] = prjmeta
         return prjmeta
 
-    def get_next_paths(self, repolinks, prjmeta, repo):
-        next_paths = {}
-        for repoelem in prjmeta.findall(".//repository[@name='%s']" % repo):
-            for path in repoelem.findall("path"):
-                next_project = path.get("project")
-                prjmeta = self.get_prjmeta(next_project)
-                next_paths = _merge_paths(
-                    get_extra_paths(repolinks, prjmeta), next_paths
-                )
-        return next_paths
+    def prefetch_prjmetas(self, projects):
+        """ Fetch metas of projects not yet in cache concurrently """
+        missing = [project for project in projects
+                   if project not in self.cache]
+        if len(missing) > 1:
+            for project, meta in self.map_project_meta(
+                    missing, on_error=self.__prefetch_failed):
+                self.cache[project] = deepcopy(meta.tree)
+
+    def __prefetch_failed(self, project, exc_info):
+        """ Failed prefetch is reported when the meta is really needed """
+        self.log.debug("Prefetching %s meta failed: %s", project, exc_info[1])
 
     def get_extra_paths_recursively(self, repolinks, project):
-        done = set()
-        prjmeta = self.get_prjmeta(project)
-        finished = False
-        extra_paths = get_extra_paths(repolinks, prjmeta)
-        while not finished:
-            finished = True
-            for _, paths in extra_paths.items():
-                for project, repo, arch in paths:
-                    target = "%s/%s/%s" % (project, repo, arch)
-                    if target not in done:
-                        finished = False
-                        prjmeta = self.get_prjmeta(project)
-                        next_paths = self.get_next_paths(
-                            repolinks, prjmeta, repo
-                        )
-                        extra_paths = _merge_paths(extra_paths, next_paths)
-                        done.add(target)
-        return extra_paths
+        return self.resolver.resolve(repolinks, project)
 
     def get_repolinks(
         self, project, prjmeta, exclude_repos=[], exclude_archs=[]
@@ -222,6 +358,7 @@ class ParticipantHandler(BuildServiceParticipant):
         extra_paths = OrderedDefaultdict(list)
         flag_types = ["build", "publish"]
         flags = {}
+        self.prefetch_prjmetas(list(links))
         for link in links:
             prjmeta = self.get_prjmeta(link)
             for rl, archs in self.get_repolinks(
@@ -295,32 +432,39 @@ class ParticipantHandler(BuildServiceParticipant):
         Just a temporary solution untill someone has time to go through the
         logic and figure out where the non existing repos come from.
         """
+        # targets of all referenced projects are fetched in one batch
+        projects = set()
+        for repo, paths in extra_paths.iteritems():
+            projects.update(
+                project for project, prepo, _ in paths
+                if not (project == trial_project and repo == prepo)
+            )
+        if extra_paths:
+            projects.update(targets)
         project_repos = {}
+        project_repo_names = {}
+        for project, project_targets in self.map_targets(sorted(projects)):
+            project_repos[project] = set(
+                tuple(t.split('/')) for t in project_targets
+            )
+            project_repo_names[project] = set(
+                prepo for prepo, _ in project_repos[project]
+            )
+
         for repo in extra_paths.keys():
-            old_paths = extra_paths[repo]
-            valid_paths = []
-            for project, prepo, arch in old_paths:
-                if project == trial_project and repo == prepo:
-                    continue
-                if project not in project_repos:
-                    project_repos[project] = [
-                        tuple(t.split('/'))
-                        for t in self.obs.getTargets(project)
-                    ]
-                if (prepo, arch) in project_repos[project]:
-                    valid_paths.append((project, prepo, arch))
+            valid_paths = [
+                (project, prepo, arch)
+                for project, prepo, arch in extra_paths[repo]
+                if not (project == trial_project and repo == prepo) and
+                (prepo, arch) in project_repos[project]
+            ]
             if valid_paths:
                 extra_paths[repo] = valid_paths
             else:
                 del extra_paths[repo]
 
             for project in list(targets):
-                if project not in project_repos:
-                    project_repos[project] = [
-                        tuple(t.split('/'))
-                        for t in self.obs.getTargets(project)
-                    ]
-                if repo not in [p[0] for p in project_repos[project]]:
+                if repo not in project_repo_names[project]:
                     targets.remove(project)
 
     def construct_trial(
@@ -390,7 +534,6 @@ class ParticipantHandler(BuildServiceParticipant):
             act['targetpackage'] for act in actions
             if act['type'] == 'submit'
         ]
-        # Copy packages into trial area
         for act in actions:
             # handle delete requests using build disable flags
             if act['type'] == 'delete' and act['targetpackage'] not in submits:
@@ -402,21 +545,26 @@ class ParticipantHandler(BuildServiceParticipant):
                     )
                 )
 
-            if act['type'] == 'submit':
-                self.obs.copyPackage(
-                    self.obs.apiurl,
-                    act['sourceproject'],
-                    act['sourcepackage'],
-                    self.obs.apiurl,
-                    trial_project,
-                    act['targetpackage'],
-                    client_side_copy=False,
-                    keep_maintainers=False,
-                    keep_develproject=False,
-                    expand=True,
-                    revision=act['sourcerevision'],
-                    comment="Trial build",
-                )
+        # Copy submitted packages concurrently, build stays disabled until
+        # all of them are in place
+        timings = self.copy_packages(
+            trial_project,
+            [(act['sourceproject'], act['sourcepackage'],
+              act['targetpackage'], act['sourcerevision'])
+             for act in actions if act['type'] == 'submit'],
+            client_side_copy=False,
+            keep_maintainers=False,
+            keep_develproject=False,
+            expand=True,
+            comment="Trial build",
+        )
+        for package, elapsed in timings:
+            self.log.debug("Copied %s in %.2f s", package, elapsed)
+        if timings:
+            self.log.info(
+                "Copied %s packages to %s, slowest %.2f s", len(timings),
+                trial_project, max(elapsed for _, elapsed in timings)
+            )
 
         self.log.info("Starting trial build %s" % trial_project)
         # enable build
@@ -461,6 +609,7 @@ class ParticipantHandler(BuildServiceParticipant):
         exclude_archs = wid.fields.exclude_archs or []
         wid.result = False
         self.cache = {}
+        self.resolver = PathResolver(self.get_prjmeta, self.prefetch_prjmetas)
         # first construct main trial project
         main_actions = [
             act for act in actions
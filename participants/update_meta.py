@@ -39,7 +39,7 @@ import os
 
 from boss.lab import Lab
 from boss.obs import BuildServiceParticipant
-from boss.rpm import extract_rpm
+from boss.rpm import read_rpm_files
 from osc import core
 
 
@@ -113,9 +113,9 @@ class ParticipantHandler(BuildServiceParticipant):
                             )
                         if errors:
                             return uploaded, errors
-                        # Extract pattern (xml) files from the rpm
-                        for xml in extract_rpm(lab.real_path(binary), lab.path,
-                                               ["*.xml"]):
+                        # Read meta (xml) files from the rpm
+                        for xml, contents in read_rpm_files(
+                                lab.real_path(binary), ["*.xml"]):
                             meta = os.path.basename(xml)
                             submetatype = os.path.basename(
                                 os.path.dirname(xml)
@@ -124,11 +124,10 @@ class ParticipantHandler(BuildServiceParticipant):
                                 "%s %s %s", meta, metatype, submetatype
                             )
                             try:
-                                with open(lab.real_path(xml), 'r') as fd:
-                                    metadata = [
-                                        line.replace("@PROJECT@", project)
-                                        for line in fd.readlines()
-                                    ]
+                                metadata = [
+                                    line.replace("@PROJECT@", project)
+                                    for line in contents.splitlines(True)
+                                ]
                                 # Update meta
                                 if submetatype == "aggregates":
                                     pkgname = os.path.splitext(meta)[0]
@@ -435,6 +435,7 @@ fi
 %config(noreplace) %{svdir}/get_build_results.conf
 %config(noreplace) %{svdir}/get_versions.conf
 %config(noreplace) %{svdir}/trigger_broken.conf
+%config(noreplace) %{_sysconfdir}/skynet/is_repo_published.conf
 %config(noreplace) %{svdir}/is_repo_published.conf
 %config(noreplace) %{svdir}/setup_build_trial.conf
 %config(noreplace) %{svdir}/remove_build_trial.conf
@@ -551,6 +552,7 @@ Vendor: Pami Ketolainen <ext-pami.o.ketolainen@nokia.com>
 Requires: python >= 2.5
 Requires: python-ruote-amqp
 Requires: python-buildservice >= 0.5
+Requires: python-lxml
 Requires: rpm-python >= 4.10.0
 Requires: cpio
 
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+"""Benchmark build path resolving of setup_build_trial.
+
+Resolves the build paths of synthetic project chains, where every project
+has a few repositories building against the next project, and prints the
+time taken. Run from the source tree::
+
+  PYTHONPATH=participants:modules python tests/bench_setup_build_trial.py \
+      [length ...]
+"""
+
+import sys
+import time
+
+from setup_build_trial import PathResolver
+from test_setup_build_trial import make_chain
+
+
+def bench(length, rounds=5):
+    """Returns best time in seconds to resolve a chain of length projects"""
+    repos = ("standard", "devel", "testing")
+    archs = ("i586", "armv7el", "aarch64")
+    metas = make_chain(length, repos, archs)
+    repolinks = dict((repo, set(archs)) for repo in repos)
+    best = None
+    for _ in range(rounds):
+        resolver = PathResolver(metas.__getitem__)
+        start = time.time()
+        resolver.resolve(repolinks, "Chain:0")
+        # the second link of a trial resolves the same chain from the cache
+        resolver.resolve(repolinks, "Chain:1")
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv):
+    lengths = [int(arg) for arg in argv[1:]] or [100, 200, 400]
+    for length in lengths:
+        print "%5d projects: %8.4f s" % (length, bench(length))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,6 +1,7 @@
 """Fixture common for all test suites in the package."""
 
 import os, unittest
+from ConfigParser import ConfigParser
 from urllib2 import HTTPError
 from StringIO import StringIO
 from mock import Mock
@@ -9,6 +10,7 @@ import launchers
 
 from RuoteAMQP import Workitem
 from buildservice import BuildService
+import boss.obs
 
 # JSON template for initializing Workitem
 WI_TEMPLATE = """
@@ -21,15 +23,35 @@ DATADIR = os.environ.get("TESTDATA", None) or \
         os.path.join(os.path.dirname(__file__), "test_data")
 FAKE_CONTENT = u"f\xe1ke file content".encode('utf-8')
 
+# [obs] participant configuration as in bsw-common.conf
+OBS_CONFIG = [
+    ("oscrc", "oscrc_file"),
+    ("cache_lifetime", "60"),
+    ("cache_size", "256"),
+    ("stats_interval", "3600"),
+    ("max_connections", "4"),
+    ("max_concurrency", "4"),
+    ("results_confirm", "0"),
+    ("bininfo_cache", ":memory:"),
+    ("bininfo_cache_size", "100000"),
+]
+
 class BaseTestParticipantHandler(unittest.TestCase):
 
     def setUp(self):
         self.mut = __import__(self.__class__.module_under_test)
+        # Don't leak cached OBS metadata between test cases
+        boss.obs.PROJECT_CACHE = boss.obs.MetadataCache()
+        boss.obs.OBS_POOL = boss.obs.BuildServicePool()
+        boss.obs.BUILD_RESULTS = boss.obs.BuildResultTracker()
+        boss.obs.BININFO_CACHE = None
+        boss.obs.CACHE_STATS = boss.obs.CacheStatsReporter()
         self.mut.BuildService = Mock()
         obs = Mock(spec_set=BuildService)
         obs.getFile.return_value = FAKE_CONTENT
         obs.getUserEmail.return_value = ""
         obs.getProjectRepositories.return_value = []
+        obs.getProjectMeta.return_value = '<project name="fake"/>'
         obs.isMaintainer.return_value = False
         obs.getCommitLog.return_value = ""
 
@@ -87,6 +109,14 @@ class BaseTestParticipantHandler(unittest.TestCase):
         }
 
 
+    def fake_config(self):
+        """Participant configuration with the common [obs] section."""
+        config = ConfigParser()
+        config.add_section("obs")
+        for option, value in OBS_CONFIG:
+            config.set("obs", option, value)
+        return config
+
     def assertRaises(self, exc_cls, callobj, *args, **kwargs):
         try:
             callobj(*args, **kwargs)
@@ -157,7 +187,7 @@ class BuildServiceFakeRepos(object):
 
     def __init__(self, mockobj):
         for name in ["getProjectRepositories", "getRepositoryArchs",
-                "getRepositoryTargets", "getTargets"]:
+                "getRepositoryTargets", "getTargets", "getProjectMeta"]:
             getattr(mockobj, name).side_effect = getattr(self, name)
 
     def __fetch(self, source, key):
@@ -184,6 +214,21 @@ class BuildServiceFakeRepos(object):
         print "getRepositoryTargets(%s, %s)" % (project, repository)
         return self.__fetch("path", "%s/%s" % (project, repository))
 
+    def getProjectMeta(self, project):
+        print "getProjectMeta(%s)" % project
+        meta = ['<project name="%s">' % project]
+        for repo in self.__fetch("repo", project):
+            key = "%s/%s" % (project, repo)
+            meta.append('<repository name="%s">' % repo)
+            for path in self.path.get(key, []):
+                meta.append('<path project="%s" repository="%s"/>' %
+                        tuple(path.split("/")))
+            for arch in self.arch.get(key, []):
+                meta.append('<arch>%s</arch>' % arch)
+            meta.append('</repository>')
+        meta.append('</project>')
+        return "".join(meta)
+
     def getTargets(self, project):
         print "getTargets(%s)" % project
         result = self.__fetch("target", project)
@@ -34,7 +34,7 @@ class TestParticipantHandler(BaseTestParticipantHandler):
     def test_handle_lifecycle_control(self):
         ctrl = Mock
         ctrl.message = "start"
-        ctrl.config = Mock()
+        ctrl.config = self.fake_config()
         self.participant.handle_lifecycle_control(ctrl)
 
     def test_success(self):
@@ -0,0 +1,74 @@
+import unittest
+from StringIO import StringIO
+
+from mock import Mock
+
+import boss.obs
+from common_test_lib import BaseTestParticipantHandler
+
+
+class TestParticipantHandler(BaseTestParticipantHandler):
+
+    module_under_test = "get_build_trial_results"
+
+    def setUp(self):
+        super(TestParticipantHandler, self).setUp()
+        self.orig_core = boss.obs.osc_core
+        boss.obs.osc_core = Mock()
+        # result state hash of each project
+        self.states = {"trial": "t1", "target": "o1"}
+        boss.obs.osc_core.makeurl.side_effect = \
+                lambda apiurl, path, query: path[1]
+        boss.obs.osc_core.http_GET.side_effect = lambda project: StringIO(
+                '<resultlist state="%s"/>' % self.states[project])
+        self.results = {
+            "trial": {"i586": {"a": "succeeded", "b": "failed",
+                               "c": "failed"}},
+            "target": {"i586": {"a": "succeeded", "b": "succeeded",
+                                "c": "failed"}},
+        }
+        self.participant.obs.getRepoResults.side_effect = \
+                lambda project, repo: self.results[project]
+
+    def tearDown(self):
+        boss.obs.osc_core = self.orig_core
+
+    def test_handle_wi_control(self):
+        self.participant.handle_wi_control(None)
+
+    def test_get_new_failures(self):
+        acts = [{"type": "delete", "targetpackage": "c"}]
+        new, old = self.participant.get_new_failures(
+                self.results["trial"], self.results["target"], ["i586"], acts)
+        self.assertEqual(new, ["b"])
+        self.assertEqual(old, ["c"])
+
+    def test_compare_results_incremental(self):
+        compare = self.participant.compare_results
+        self.assertEqual(compare("trial", "target", "repo", ["i586"]),
+                         (set(["b"]), set(["c"])))
+        self.assertEqual(compare("trial", "target", "repo", ["i586"]),
+                         (set(["b"]), set(["c"])))
+        # unchanged results are not fetched again
+        self.assertEqual(self.participant.obs.getRepoResults.call_count, 2)
+
+        self.states["trial"] = "t2"
+        self.results["trial"] = {"i586": {"a": "failed", "b": "succeeded",
+                                          "c": "failed"}}
+        self.assertEqual(compare("trial", "target", "repo", ["i586"]),
+                         (set(["a"]), set(["c"])))
+        self.assertEqual(self.participant.obs.getRepoResults.call_count, 3)
+
+    def test_check_trial(self):
+        self.participant.obs.getProjectMeta.return_value = \
+                '<project name="target"><repository name="repo">' \
+                '<arch>i586</arch><arch>armv7el</arch></repository></project>'
+        acts = [{"type": "submit", "targetpackage": "b"}]
+        self.assertEqual(
+                self.participant.check_trial("trial", ["target"], acts,
+                                             ([], ["armv7el"])),
+                set(["b"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
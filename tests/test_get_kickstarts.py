@@ -85,9 +85,9 @@ class TestParticipantHandler(BaseTestParticipantHandler):
         self.assertTrue("doesnotexist.rpm" in str(exc))
 
     def test_no_ks_in_package(self):
-        real_er = self.mut.extract_rpm
-        self.mut.extract_rpm = Mock()
-        self.mut.extract_rpm.return_value = []
+        real_er = self.mut.read_rpm_files
+        self.mut.read_rpm_files = Mock()
+        self.mut.read_rpm_files.return_value = []
         wid = self.fake_workitem
         try:
             self.participant.handle_wi(wid)
@@ -95,7 +95,7 @@ class TestParticipantHandler(BaseTestParticipantHandler):
             self.assertEqual(len(wid.fields.msg), 1)
             self.assertTrue("did not contain .ks" in wid.fields.msg[0])
         finally:
-            self.mut.extract_rpm = real_er
+            self.mut.read_rpm_files = real_er
 
     def test_ignore_ks(self):
         wid = self.fake_workitem
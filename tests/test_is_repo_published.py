@@ -1,4 +1,5 @@
 import unittest
+from StringIO import StringIO
 
 from mock import Mock
 
@@ -12,6 +13,15 @@ class TestParticipantHandler(BaseTestParticipantHandler):
     def setUp(self):
         super(TestParticipantHandler, self).setUp()
         self.fake_workitem.fields.ev.namespace = "test"
+        # {package: srcmd5} returned by source info listing
+        self.sourceinfo = {}
+        self.mut.core = Mock()
+        self.mut.core.http_GET.side_effect = self.mock_sourceinfo
+
+    def mock_sourceinfo(self, url):
+        return StringIO("<sourceinfolist>%s</sourceinfolist>" % "".join(
+            '<sourceinfo package="%s" srcmd5="%s"/>' % item
+            for item in self.sourceinfo.items()))
 
     def test_handle_wi_control(self):
         self.participant.handle_wi_control(None)
@@ -19,7 +29,7 @@ class TestParticipantHandler(BaseTestParticipantHandler):
     def test_handle_lifecycle_control(self):
         ctrl = Mock
         ctrl.message = "start"
-        ctrl.config = Mock()
+        ctrl.config = self.fake_config()
         self.participant.handle_lifecycle_control(ctrl)
 
     def test_repos_not_published(self):
@@ -52,6 +62,122 @@ class TestParticipantHandler(BaseTestParticipantHandler):
         self.participant.handle_wi(self.fake_workitem)
         self.assertTrue(self.fake_workitem.result)
 
+    def _update(self, **event):
+        wid = self.fake_workitem
+        wid.params.action = "update"
+        wid.fields.ev.project = "fake_project"
+        for key, value in event.items():
+            setattr(wid.fields.ev, key, value)
+        self.participant.handle_wi(wid)
+        self.assertTrue(wid.result)
+        wid.params.action = None
+
+    def test_events_update_publish_state(self):
+        obs = self.participant.obs
+        self.fake_workitem.params.project = "fake_project"
+        obs.getRepoState.return_value = {
+                "fake_repo_1/i586": "published",
+                "fake_repo_3/armv8el": "published"}
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertTrue(self.fake_workitem.result)
+
+        self._update(label="BUILD_SUCCESS", repository="fake_repo_1",
+                     arch="i586")
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertFalse(self.fake_workitem.result)
+
+        self.assertEqual(obs.getRepoState.call_count, 1)
+
+        self._update(label="REPO_PUBLISHED", repo="fake_repo_1")
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertTrue(self.fake_workitem.result)
+        # publish event is only a hint to ask OBS again
+        self.assertEqual(obs.getRepoState.call_count, 2)
+
+    def test_late_publish_event(self):
+        obs = self.participant.obs
+        self.fake_workitem.params.project = "fake_project"
+        obs.getRepoState.return_value = {
+                "fake_repo_1/i586": "published"}
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertTrue(self.fake_workitem.result)
+
+        self._update(label="BUILD_SUCCESS", repository="fake_repo_1",
+                     arch="i586")
+        obs.getRepoState.return_value = {
+                "fake_repo_1/i586": "finished"}
+        # publish event of the previous build arriving after the new one
+        self._update(label="REPO_PUBLISHED", repo="fake_repo_1")
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertFalse(self.fake_workitem.result)
+
+    def test_commit_event_rechecks_package(self):
+        obs = self.participant.obs
+        self.fake_workitem.params.project = "fake_project"
+        obs.getRepoState.return_value = {
+                "fake_repo_1/i586": "published",
+                "fake_repo_3/armv8el": "published"}
+        self.sourceinfo.update(pkg1="a", pkg2="b")
+        obs.getPackageFileList.return_value = ["pkg.spec"]
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertTrue(self.fake_workitem.result)
+        self.assertEqual(obs.getPackageFileList.call_count, 2)
+
+        obs.getPackageFileList.return_value = ["_service"]
+        obs.getServiceState.return_value = "running"
+        self._update(label="SRCSRV_COMMIT", package="pkg2")
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertFalse(self.fake_workitem.result)
+        self.assertEqual(obs.getPackageFileList.call_count, 3)
+        obs.getPackageFileList.assert_called_with("fake_project", "pkg2")
+
+    def test_refresh_rechecks_changed_packages(self):
+        obs = self.participant.obs
+        self.participant.lifetime = 0
+        self.fake_workitem.params.project = "fake_project"
+        obs.getRepoState.return_value = {}
+        self.sourceinfo.update(pkg1="a", pkg2="b", _pattern="c")
+        obs.getPackageFileList.return_value = ["pkg.spec"]
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertTrue(self.fake_workitem.result)
+        self.assertEqual(obs.getPackageFileList.call_count, 2)
+
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertEqual(obs.getPackageFileList.call_count, 2)
+
+        self.sourceinfo["pkg2"] = "d"
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertEqual(obs.getPackageFileList.call_count, 3)
+        obs.getPackageFileList.assert_called_with("fake_project", "pkg2")
+
+    def test_only_wanted_packages_checked(self):
+        obs = self.participant.obs
+        wid = self.fake_workitem
+        wid.params.project = "fake_project"
+        wid.fields.ev.actions = [{
+            "type": "submit", "sourceproject": "fake_project",
+            "sourcepackage": "pkg1", "targetproject": "target"}]
+        obs.getRepoState.return_value = {}
+        self.sourceinfo.update(pkg1="a", pkg2="b", pkg3="c")
+        obs.getPackageFileList.return_value = ["pkg.spec"]
+        self.participant.handle_wi(wid)
+        self.assertTrue(wid.result)
+        obs.getPackageFileList.assert_called_once_with("fake_project", "pkg1")
+
+    def test_source_info_not_available(self):
+        obs = self.participant.obs
+        self.mut.core.http_GET.side_effect = Exception("not supported")
+        obs.getRepoState.return_value = {}
+        obs.getPackageList.return_value = ["pkg1"]
+        obs.getPackageFileList.return_value = ["_service"]
+        obs.getServiceState.return_value = "running"
+        self.participant.handle_wi(self.fake_workitem)
+        self.assertFalse(self.fake_workitem.result)
+
+    def test_event_for_unknown_project(self):
+        self._update(label="REPO_PUBLISHED", repo="fake_repo_1")
+        self.assertFalse(self.participant.obs.getRepoState.called)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,65 @@
+import difflib, random, unittest
+
+from boss.diff import DIFF_BACKENDS, changed_lines, get_opcodes, \
+        unified_diff
+
+
+class TestDiff(unittest.TestCase):
+
+    OLD = ["#include <a>\n", "\n", "int a;\n", "\n", "void f()\n", "{\n",
+           "}\n", "\n", "void g()\n", "{\n", "}\n"]
+    NEW = ["#include <a>\n", "\n", "void g()\n", "{\n", "}\n", "\n",
+           "int a;\n", "\n", "void f()\n", "{\n", "  a++;\n", "}\n"]
+
+    def check_opcodes(self, old, new, backend):
+        result = []
+        for tag, alo, ahi, blo, bhi in get_opcodes(old, new, backend):
+            if tag == "equal":
+                self.assertEqual(old[alo:ahi], new[blo:bhi])
+                result.extend(old[alo:ahi])
+            else:
+                result.extend(new[blo:bhi])
+        self.assertEqual(result, new)
+
+    def test_backends(self):
+        rand = random.Random(1)
+        for _ in range(200):
+            old = [rand.choice("abcd") + "\n"
+                   for _ in range(rand.randint(0, 20))]
+            new = list(old)
+            for _ in range(rand.randint(0, 5)):
+                new.insert(rand.randint(0, len(new)), rand.choice("cdef"))
+                if new:
+                    del new[rand.randrange(len(new))]
+            matched = sum(size for _, _, size in
+                          difflib.SequenceMatcher(None, old, new, False)
+                          .get_matching_blocks())
+            for backend in DIFF_BACKENDS:
+                self.check_opcodes(old, new, backend)
+            # myers gives a shortest edit script
+            self.assertTrue(sum(
+                ahi - alo for tag, alo, ahi, _, _ in
+                get_opcodes(old, new, "myers") if tag == "equal") >= matched)
+
+    def test_changed_lines(self):
+        self.assertEqual(changed_lines(self.OLD, self.NEW, "patience"),
+                         ["+ void g()\n", "+ {\n", "+ }\n", "+ \n",
+                          "- }\n", "- \n", "- void g()\n", "- {\n",
+                          "+   a++;\n"])
+        self.assertEqual(changed_lines(self.OLD, self.OLD), [])
+        self.assertEqual(changed_lines([], ["a\n"], "myers"), ["+ a\n"])
+        self.assertRaises(ValueError, changed_lines, [], [], "foo")
+
+    def test_unified_diff(self):
+        self.assertEqual(
+            unified_diff(self.OLD, self.NEW, "old", "new", 2, "difflib"),
+            list(difflib.unified_diff(self.OLD, self.NEW, "old", "new", n=2)))
+        self.assertEqual(unified_diff(self.OLD, self.NEW, n=0)[2:],
+                         ["@@ -2,0 +3,4 @@\n", "+void g()\n", "+{\n", "+}\n",
+                          "+\n", "@@ -7,4 +11 @@\n", "-}\n", "-\n",
+                          "-void g()\n", "-{\n", "+  a++;\n"])
+        self.assertEqual(unified_diff(self.OLD, self.OLD), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import threading, unittest, urllib2
+import BaseHTTPServer, SocketServer
+
+from boss.keepalive import DRAIN_LIMIT, KeepAliveHandler
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    posts = 0
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        Handler.connections += 1
+
+    def do_GET(self):
+        body = "content of %s" % self.path
+        if "big" in self.path:
+            body *= DRAIN_LIMIT
+        self.send_response(404 if "missing" in self.path else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if "drop" in self.path:
+            # Keep-alive response, but the connection is closed anyway
+            self.close_connection = 1
+
+    def do_POST(self):
+        Handler.posts += 1
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestKeepAliveHandler(unittest.TestCase):
+
+    def setUp(self):
+        Handler.connections = 0
+        Handler.posts = 0
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.handler = KeepAliveHandler(max_connections=2)
+        self.opener = urllib2.build_opener(self.handler)
+
+    def tearDown(self):
+        self.handler.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        for i in range(5):
+            self.assertEqual(self.opener.open("%s/%d" % (self.url, i)).read(),
+                    "content of /%d" % i)
+        self.assertEqual(Handler.connections, 1)
+
+    def test_http_error(self):
+        try:
+            self.opener.open(self.url + "/missing")
+        except urllib2.HTTPError, exc:
+            self.assertEqual(exc.code, 404)
+        else:
+            self.fail("HTTPError not raised")
+        self.assertEqual(self.opener.open(self.url + "/ok").read(),
+                "content of /ok")
+
+    def test_partial_read(self):
+        resp = self.opener.open(self.url + "/partial")
+        resp.read(2)
+        resp.close()
+        self.assertEqual(self.opener.open(self.url + "/next").read(),
+                "content of /next")
+        self.assertEqual(Handler.connections, 1)
+
+    def test_close_big_response(self):
+        resp = self.opener.open(self.url + "/big")
+        resp.read(2)
+        resp.close()
+        self.assertEqual(self.opener.open(self.url + "/next").read(),
+                "content of /next")
+        self.assertEqual(Handler.connections, 2)
+
+    def test_retry_dropped_connection(self):
+        self.opener.open(self.url + "/drop").read()
+        self.assertEqual(self.opener.open(self.url + "/next").read(),
+                "content of /next")
+        self.assertEqual(Handler.connections, 2)
+
+    def test_no_retry_post(self):
+        self.opener.open(self.url + "/drop").read()
+        self.assertRaises(urllib2.URLError, self.opener.open,
+                self.url + "/post", "data")
+        self.assertEqual(Handler.posts, 0)
+        self.assertEqual(self.opener.open(self.url + "/post", "data").read(),
+                "content of /post")
+        self.assertEqual(Handler.posts, 1)
+
+    def test_https_without_context(self):
+        req = urllib2.Request("https://127.0.0.1/")
+        self.assertEqual(self.handler.https_open(req), None)
+
+    def test_https_proxy(self):
+        handler = KeepAliveHandler(context=object())
+        req = urllib2.Request("https://127.0.0.1/")
+        req.set_proxy("proxy:3128", "http")
+        self.assertEqual(handler.https_open(req), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,52 @@ class TestLab(unittest.TestCase):
         self.lab.real_path("test", snap)
         self.assertRaises(ValueError, self.lab.real_path, "test", 5)
 
+    def test_snapshot_tree(self):
+        self.lab.makedirs("foo/bar")
+        self.lab.store("foo/bar/test", "testing")
+        os.symlink("bar", self.lab.real_path("foo/link"))
+        snap = self.lab.take_snapshot()
+        self.assertEqual(self.lab.open("foo/bar/test", sid=snap).read(),
+                         "testing")
+        self.assertEqual(os.readlink(self.lab.real_path("foo/link", snap)),
+                         "bar")
+
+    def test_copy_up(self):
+        # force hard link snapshots
+        self.lab._reflink = False
+        for name in ("store", "write", "append", "copy_up"):
+            self.lab.store(name, "testing")
+        snap = self.lab.take_snapshot()
+        self.assertTrue(os.path.samefile(self.lab.real_path("store"),
+                                         self.lab.real_path("store", snap)))
+        self.lab.store("store", "stored")
+        self.lab.open("write", "w").write("written")
+        self.lab.open("append", "a").write(" appended")
+        self.lab.copy_up("copy_up")
+        with open(self.lab.real_path("copy_up"), "r+") as fobj:
+            fobj.write("copied")
+        for name in ("store", "write", "append", "copy_up"):
+            self.assertEqual(self.lab.open(name, sid=snap).read(), "testing")
+        self.assertEqual(self.lab.open("append").read(), "testing appended")
+        self.assertEqual(self.lab.open("copy_up").read(), "copiedg")
+        self.lab.copy_up("missing")
+
+    def test_changed_files(self):
+        self.lab.makedirs("foo")
+        for name in ("same", "changed", "removed", "foo/changed"):
+            self.lab.store(name, "testing")
+        snap = self.lab.take_snapshot()
+        self.assertEqual(self.lab.changed_files(snap), [])
+        self.lab.store("changed", "changed!")
+        self.lab.open("foo/changed", "a").write("more")
+        os.remove(self.lab.real_path("removed"))
+        self.lab.store("added", "testing")
+        self.assertEqual(self.lab.changed_files(snap),
+                         ["added", "changed", "foo/changed", "removed"])
+        self.assertEqual(self.lab.changed_files(0, snap),
+                         self.lab.changed_files(snap))
+        self.assertRaises(ValueError, self.lab.changed_files, 5)
+
     def test_store(self):
         self.lab.store("test", "testing")
         self.assertTrue(os.path.exists(self.lab.real_path("test")))
@@ -39,6 +85,32 @@ class TestLab(unittest.TestCase):
         os.remove(self.lab.real_path("test"))
         self.assertEquals(len(self.lab.get_diff("test", snap)), 1)
 
+    def test_get_diff_unified(self):
+        self.lab.store("test", ["a\n", "b\n", "c\n"])
+        snap = self.lab.take_snapshot()
+        self.lab.store("test", ["a\n", "B\n", "c\n", "d\n"])
+        self.assertEqual(self.lab.get_diff("test", snap),
+                         ["- b\n", "+ B\n", "+ d\n"])
+        self.assertEqual(self.lab.get_diff("test", snap, unified=True),
+                         ["--- test@1\n", "+++ test@0\n", "@@ -1,3 +1,4 @@\n",
+                          " a\n", "-b\n", "+B\n", " c\n", "+d\n"])
+
+    def test_get_diff_large(self):
+        self.lab.max_diff_size = 4
+        self.lab.store("test", "testing")
+        snap = self.lab.take_snapshot()
+        self.assertEqual(self.lab.get_diff("test", snap), [])
+        self.lab.store("test", "changed")
+        self.assertEqual(self.lab.get_diff("test", snap), [
+            "! test changed, sha1 dc724af18fbdd4e59189f5fe768a5f8311527050 "
+            "-> 37c6c57bedf4305ef41249c1794760b5cb8fad17\n"])
+        os.remove(self.lab.real_path("test"))
+        self.assertTrue(self.lab.get_diff("test", snap)[0].endswith(
+            "-> missing\n"))
+
+    def test_diff_backend(self):
+        self.assertRaises(ValueError, Lab, diff_backend="foo")
+
     def test_dir_creation(self):
         self.assertFalse(os.path.isdir(self.lab.real_path("test")))
         self.lab.mkdir("test")
@@ -0,0 +1,343 @@
+import os, shutil, ssl, tempfile, unittest
+from StringIO import StringIO
+from urllib2 import HTTPError
+
+from mock import Mock, patch
+
+from common_test_lib import BuildServiceFakeRepos
+import boss.obs
+from boss.obs import MetadataCache, ProjectMeta, RepositoryMixin, \
+        LatencyHistogram, TimedBuildService, map_concurrent, BinaryInfoCache, \
+        BuildResultTracker, BuildServicePool, CacheStatsReporter
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MetadataCache(lifetime=60, size=2)
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get(("api", "prj")), None)
+        self.cache.put(("api", "prj"), {"repo": {}})
+        self.assertEqual(self.cache.get(("api", "prj")), {"repo": {}})
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["entries"], 1)
+
+    def test_expiry(self):
+        self.cache.put(("api", "prj"), "value")
+        self.cache.configure(lifetime=-1)
+        self.cache.put(("api", "other"), "value")
+        self.assertEqual(self.cache.get(("api", "other")), None)
+
+    def test_disabled(self):
+        self.cache.configure(lifetime=0)
+        self.cache.put(("api", "prj"), "value")
+        self.assertEqual(self.cache.get(("api", "prj")), None)
+
+    def test_lru_eviction(self):
+        self.cache.put(("api", "a"), 1)
+        self.cache.put(("api", "b"), 2)
+        self.cache.get(("api", "a"))
+        self.cache.put(("api", "c"), 3)
+        self.assertEqual(self.cache.get(("api", "b")), None)
+        self.assertEqual(self.cache.get(("api", "a")), 1)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_invalidate(self):
+        self.cache.put(("api", "prj", "repositories"), 1)
+        self.cache.put(("api", "other", "repositories"), 2)
+        self.assertEqual(self.cache.invalidate("api", "prj"), 1)
+        self.assertEqual(self.cache.get(("api", "prj", "repositories")), None)
+        self.assertEqual(self.cache.get(("api", "other", "repositories")), 2)
+
+
+class TestCacheStatsReporter(unittest.TestCase):
+
+    def test_report(self):
+        log = Mock()
+        reporter = CacheStatsReporter(interval=3600)
+        self.assertFalse(reporter.report(log))
+        reporter.interval = -1
+        self.assertTrue(reporter.report(log))
+        self.assertTrue("project_cache" in log.info.call_args[0][0])
+        reporter.interval = 0
+        self.assertFalse(reporter.report(log))
+        self.assertEqual(log.info.call_count, 1)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = LatencyHistogram(buckets=(0.1, 1.0))
+        histogram.observe("getTargets", 0.05)
+        histogram.observe("getTargets", 0.5)
+        histogram.observe("getTargets", 5)
+        stats = histogram.stats()["getTargets"]
+        self.assertEqual(stats["count"], 3)
+        self.assertEqual(stats["buckets"], {"0.1": 1, "1.0": 1, "inf": 1})
+
+    def test_timed_build_service(self):
+        boss.obs.API_LATENCY.clear()
+        obs = Mock()
+        obs.getTargets.return_value = ["repo/i586"]
+        timed = TimedBuildService(obs)
+        self.assertEqual(timed.getTargets("project"), ["repo/i586"])
+        self.assertEqual(
+                boss.obs.API_LATENCY.stats()["getTargets"]["count"], 1)
+
+
+class TestMapConcurrent(unittest.TestCase):
+
+    @staticmethod
+    def double(value):
+        if value == 3:
+            raise ValueError("three")
+        return value * 2
+
+    def test_order_and_errors(self):
+        for workers in (1, 4):
+            results = map_concurrent(self.double, range(6), workers)
+            self.assertEqual([result for result, _ in results],
+                    [0, 2, 4, None, 8, 10])
+            self.assertEqual(results[3][1][0], ValueError)
+
+
+class TestBuildServicePool(unittest.TestCase):
+
+    def test_ssl_context(self):
+        options = {"https://api": {"sslcertck": "0"}}
+        with patch.dict(boss.obs.osc_conf.config,
+                        {"api_host_options": options}):
+            context = BuildServicePool._ssl_context("https://api")
+            self.assertEqual(context.verify_mode, ssl.CERT_NONE)
+            options["https://api"]["sslcertck"] = "1"
+            context = BuildServicePool._ssl_context("https://api")
+            self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+            options["https://api"]["cafile"] = "/nonexistent/ca.pem"
+            self.assertEqual(BuildServicePool._ssl_context("https://api"),
+                    None)
+            self.assertEqual(BuildServicePool._ssl_context("https://other"),
+                    None)
+
+
+class TestBinaryInfoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = BinaryInfoCache(os.path.join(self.tmpdir, "bininfo.db"),
+                size=3)
+        self.key = ("api", "project", "repo/i586", "package")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get_many(*self.key + (["a.rpm"],)), {})
+        self.cache.put_many(*self.key + ({"a.rpm": {"name": "a"}},))
+        self.assertEqual(self.cache.get_many(*self.key + (["a.rpm", "b.rpm"],)),
+                {"a.rpm": {"name": "a"}})
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_eviction(self):
+        for name in ["a", "b", "c", "d"]:
+            self.cache.put_many(*self.key + ({name: {}},))
+        self.assertEqual(sorted(self.cache.get_many(
+                *self.key + (["a", "b", "c", "d"],)).keys()), ["b", "c", "d"])
+
+    def test_rebuild_event(self):
+        self.cache.put_many(*self.key + ({"a.rpm": {}},))
+        self.assertTrue(self.cache.handle_event("api", {
+                "label": "BUILD_SUCCESS", "project": "project",
+                "repository": "repo", "arch": "i586", "package": "package"}))
+        self.assertEqual(self.cache.get_many(*self.key + (["a.rpm"],)), {})
+
+    def test_unusable_database(self):
+        cache = BinaryInfoCache(os.path.join(self.tmpdir, "missing", "db"))
+        self.assertFalse(cache.disabled)
+        cache.put_many(*self.key + ({"a.rpm": {}},))
+        self.assertEqual(cache.get_many(*self.key + (["a.rpm"],)), {})
+        cache.invalidate("api", "project")
+        self.assertTrue(cache.disabled)
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 1, "errors": 1})
+
+
+class TestBuildResultTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_core = boss.obs.osc_core
+        boss.obs.osc_core = Mock()
+        self.state = "s1"
+        boss.obs.osc_core.http_GET.side_effect = lambda url: StringIO(
+                '<resultlist state="%s"/>' % self.state)
+        self.obs = Mock()
+        self.obs.getRepoResults.return_value = {
+                "i586": {"a": "succeeded", "b": "failed"}}
+        self.tracker = BuildResultTracker(confirm=0)
+
+    def tearDown(self):
+        boss.obs.osc_core = self.orig_core
+
+    def test_fetch_on_state_change(self):
+        first = self.tracker.get(self.obs, "prj", "repo")
+        self.assertEqual(first.results["i586"]["b"], "failed")
+        self.assertTrue(self.tracker.get(self.obs, "prj", "repo") is first)
+        self.assertEqual(self.obs.getRepoResults.call_count, 1)
+
+        self.state = "s2"
+        self.obs.getRepoResults.return_value = {
+                "i586": {"a": "succeeded", "b": "succeeded", "c": "failed"}}
+        second = self.tracker.get(self.obs, "prj", "repo")
+        self.assertFalse(second is first)
+        self.assertEqual(second.results["i586"]["c"], "failed")
+        self.assertEqual(self.tracker.stats(),
+                {"fetches": 2, "checks": 1, "reuses": 0})
+
+    def test_trusted_until_event(self):
+        self.tracker.confirm = 60
+        first = self.tracker.get(self.obs, "prj", "repo")
+        self.state = "s2"
+        self.assertTrue(self.tracker.get(self.obs, "prj", "repo") is first)
+        self.assertEqual(boss.obs.osc_core.http_GET.call_count, 1)
+
+        self.tracker.handle_event(self.obs.apiurl,
+                {"label": "BUILD_SUCCESS", "project": "other"})
+        self.assertFalse(self.tracker.handle_event(self.obs.apiurl,
+                {"label": "REPO_PUBLISHED", "project": "prj"}))
+        self.assertTrue(self.tracker.get(self.obs, "prj", "repo") is first)
+        self.assertTrue(self.tracker.handle_event(self.obs.apiurl,
+                {"label": "BUILD_SUCCESS", "project": "prj",
+                 "repository": "repo", "arch": "i586"}))
+        self.assertFalse(self.tracker.get(self.obs, "prj", "repo") is first)
+        self.assertEqual(self.obs.getRepoResults.call_count, 2)
+
+    def test_state_not_available(self):
+        boss.obs.osc_core.http_GET.side_effect = HTTPError("url", 500, "",
+                {}, None)
+        self.tracker.get(self.obs, "prj", "repo")
+        self.tracker.get(self.obs, "prj", "repo")
+        self.assertEqual(self.obs.getRepoResults.call_count, 2)
+
+
+class TestProjectMeta(unittest.TestCase):
+
+    META = """<project name="prj">
+      <build>
+        <disable/>
+        <enable repository="standard"/>
+        <disable repository="standard" arch="armv7l"/>
+      </build>
+      <repository name="standard">
+        <path project="base" repository="standard"/>
+        <path project="core" repository="latest"/>
+        <arch>i586</arch>
+        <arch>armv7l</arch>
+      </repository>
+      <repository name="empty"/>
+    </project>"""
+
+    def test_repositories(self):
+        meta = ProjectMeta(self.META)
+        self.assertEqual(meta.name, "prj")
+        self.assertEqual(meta.repositories.keys(), ["standard", "empty"])
+        self.assertEqual(meta.archs("standard"), ["i586", "armv7l"])
+        self.assertEqual(meta.targets("standard"),
+                ["base/standard", "core/latest"])
+        self.assertEqual(meta.as_repos().keys(), ["standard"])
+        self.assertEqual(meta.as_repos()["standard"]["path"], "prj/standard")
+
+    def test_flags(self):
+        meta = ProjectMeta(self.META)
+        self.assertFalse(meta.flag_enabled("build"))
+        self.assertTrue(meta.flag_enabled("build", "standard", "i586"))
+        self.assertFalse(meta.flag_enabled("build", "standard", "armv7l"))
+        self.assertTrue(meta.flag_enabled("publish", "standard", "i586"))
+
+
+class TestRepositoryMixin(unittest.TestCase):
+
+    def setUp(self):
+        self.mixin = RepositoryMixin()
+        self.mixin.obs = Mock()
+        self.repos = BuildServiceFakeRepos(self.mixin.obs)
+        boss.obs.PROJECT_CACHE = MetadataCache()
+
+    def test_project_repos_cached(self):
+        first = self.mixin.get_project_repos("project")
+        first["repo"]["architectures"].append("armv7l")
+        second = self.mixin.get_project_repos("project")
+        self.assertEqual(second["repo"]["architectures"], ["i586"])
+        self.assertEqual(self.mixin.obs.getProjectMeta.call_count, 1)
+
+    def test_map_binary_info(self):
+        def bininfo(project, target, package, binary):
+            if binary == "bad":
+                raise ValueError(binary)
+            return {"name": binary}
+        self.mixin.obs.getBinaryInfo.side_effect = bininfo
+        binaries = ["a", "bad", "c"]
+        self.assertRaises(ValueError, self.mixin.map_binary_info,
+                "project", "repo/i586", "package", binaries)
+        failed = []
+        result = self.mixin.map_binary_info("project", "repo/i586",
+                "package", binaries,
+                on_error=lambda binary, exc_info: failed.append(binary))
+        self.assertEqual(result, [("a", {"name": "a"}), ("c", {"name": "c"})])
+        self.assertEqual(failed, ["bad"])
+
+    def test_map_project_meta(self):
+        self.mixin.get_project_meta("project")
+        self.mixin.obs.getProjectMeta.reset_mock()
+        self.assertRaises(boss.obs.OBSError, self.mixin.map_project_meta,
+                ["project", "nonexistent"])
+        failed = []
+        result = self.mixin.map_project_meta(["nonexistent", "project"],
+                on_error=lambda project, exc_info: failed.append(project))
+        self.assertEqual([(project, meta.name) for project, meta in result],
+                [("project", "project")])
+        self.assertEqual(failed, ["nonexistent"])
+        # cached meta is not fetched again
+        self.assertEqual(
+                [args[0][0] for args in
+                 self.mixin.obs.getProjectMeta.call_args_list],
+                ["nonexistent", "nonexistent"])
+
+    def test_map_project_meta_uncached(self):
+        boss.obs.PROJECT_CACHE.configure(lifetime=0)
+        result = self.mixin.map_project_meta(["project", "project"])
+        self.assertEqual([(project, meta.name) for project, meta in result],
+                [("project", "project")] * 2)
+        self.assertEqual(self.mixin.obs.getProjectMeta.call_count, 1)
+        self.assertEqual(boss.obs.PROJECT_CACHE.stats()["misses"], 1)
+
+    def test_map_targets(self):
+        result = self.mixin.map_targets(["project"])
+        self.assertEqual(result, [("project", ["repo/i586"])])
+        self.assertRaises(HTTPError, self.mixin.map_targets, ["nonexistent"])
+        self.assertEqual(self.mixin.map_targets(["nonexistent"],
+                on_error=lambda project, exc_info: None), [])
+
+    def test_copy_packages(self):
+        packages = [("src", "a", "a", "1"), ("src", "b", "b2", "2")]
+        timings = self.mixin.copy_packages("trial", packages, expand=True)
+        self.assertEqual([package for package, _ in timings], ["a", "b2"])
+        calls = sorted(args for args, _ in
+                       self.mixin.obs.copyPackage.call_args_list)
+        apiurl = self.mixin.obs.apiurl
+        self.assertEqual(calls, [
+            (apiurl, "src", "a", apiurl, "trial", "a"),
+            (apiurl, "src", "b", apiurl, "trial", "b2")])
+        revisions = sorted(kwargs["revision"] for _, kwargs in
+                           self.mixin.obs.copyPackage.call_args_list)
+        self.assertEqual(revisions, ["1", "2"])
+        for _, kwargs in self.mixin.obs.copyPackage.call_args_list:
+            self.assertTrue(kwargs["expand"])
+
+        self.mixin.obs.copyPackage.side_effect = ValueError("failed")
+        self.assertRaises(ValueError, self.mixin.copy_packages, "trial",
+                          packages)
+
+
+if __name__ == '__main__':
+    unittest.main()
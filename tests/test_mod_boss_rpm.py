@@ -0,0 +1,323 @@
+import os, shutil, stat, struct, tempfile, threading, unittest, urllib, \
+        urllib2, zlib
+import BaseHTTPServer, SocketServer
+from StringIO import StringIO
+
+from mock import Mock, patch
+
+import boss.rpm
+from boss.keepalive import KeepAliveHandler
+from boss.rpm import extract_rpm, read_headers, read_rpm_files, \
+        read_rpm_info, fetch_rpm_info, RangeReader, RPM_HEADER_MAGIC
+
+
+def make_header(tags):
+    """Build RPM header structure from (tag, type, value) tuples."""
+    index = ""
+    store = ""
+    for tag, htype, value in tags:
+        if htype == 6:
+            data, count = value + "\0", 1
+        elif htype == 8:
+            data, count = "".join(val + "\0" for val in value), len(value)
+        else:
+            fmt = {3: "H", 4: "I"}[htype]
+            store += "\0" * (-len(store) % struct.calcsize(fmt))
+            data = struct.pack(">%d%s" % (len(value), fmt), *value)
+            count = len(value)
+        index += struct.pack(">iiii", tag, htype, len(store), count)
+        store += data
+    return RPM_HEADER_MAGIC + "\0" * 4 + \
+        struct.pack(">II", len(tags), len(store)) + index + store
+
+
+def make_cpio(members):
+    """Build newc cpio archive from (name, mode, data, ino, nlink) tuples."""
+    archive = ""
+    for name, mode, data, ino, nlink in members + [
+            ("TRAILER!!!", 0, "", 0, 1)]:
+        name += "\0"
+        fields = (ino, mode, 0, 0, nlink, 0, len(data), 0, 0, 0, 0,
+                  len(name), 0)
+        archive += "070701" + "".join("%08x" % val for val in fields) + name
+        archive += "\0" * (-len(archive) % 4) + data
+        archive += "\0" * (-len(archive) % 4)
+    return archive
+
+
+def make_rpm(path, members, compressor="gzip", tags=()):
+    """Write RPM package with gzip compressed payload of members."""
+    header = make_header([(1000, 6, "test"), (1118, 8, ["/a/", "/b/"]),
+                          (1124, 6, "cpio"), (1125, 6, compressor)] +
+                         list(tags))
+    compress = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    payload = compress.compress(make_cpio(members)) + compress.flush()
+    signature = make_header([(1000, 4, [len(header + payload)])])
+    with open(path, "wb") as rpm_file:
+        rpm_file.write("\xed\xab\xee\xdb" + "\0" * 92)
+        rpm_file.write(signature + "\0" * (-len(signature) % 8))
+        rpm_file.write(header + payload)
+
+
+class TestExtractRpm(unittest.TestCase):
+
+    MEMBERS = [
+        ("./usr", stat.S_IFDIR | 0o755, "", 1, 2),
+        ("./usr/share/test.ks", stat.S_IFREG | 0o644, "kickstart", 2, 1),
+        ("./usr/share/link.ks", stat.S_IFLNK | 0o777, "test.ks", 3, 1),
+        ("./usr/share/hard.ks", stat.S_IFREG | 0o644, "", 4, 2),
+        ("./usr/share/hard.xml", stat.S_IFREG | 0o600, "<xml/>" * 5000, 4, 2),
+        ("./usr/share/empty", stat.S_IFREG | 0o644, "", 5, 1),
+        ("../evil.ks", stat.S_IFREG | 0o644, "evil", 6, 1),
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.workdir = os.path.join(self.tmpdir, "work")
+        os.mkdir(self.workdir)
+        make_rpm(os.path.join(self.workdir, "test.rpm"), self.MEMBERS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_headers(self):
+        with open(os.path.join(self.workdir, "test.rpm"), "rb") as rpm_file:
+            signature, header = read_headers(rpm_file)
+            self.assertEqual(rpm_file.read(2), "\x1f\x8b")
+        self.assertEqual(signature.keys(), [1000])
+        self.assertEqual(header[1000], "test")
+        self.assertEqual(header[1118], ["/a/", "/b/"])
+
+    def test_extract_all(self):
+        self.assertEqual(extract_rpm("test.rpm", self.workdir),
+                         [name for name, _, _, _, _ in self.MEMBERS[:-1]])
+        path = os.path.join(self.workdir, "usr", "share")
+        self.assertEqual(open(os.path.join(path, "test.ks")).read(),
+                         "kickstart")
+        self.assertEqual(os.readlink(os.path.join(path, "link.ks")),
+                         "test.ks")
+        self.assertEqual(open(os.path.join(path, "hard.ks")).read(),
+                         "<xml/>" * 5000)
+        self.assertEqual(os.stat(os.path.join(path, "hard.ks")).st_ino,
+                         os.stat(os.path.join(path, "hard.xml")).st_ino)
+        self.assertEqual(
+            stat.S_IMODE(os.stat(os.path.join(path, "hard.xml")).st_mode),
+            0o600)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "evil.ks")))
+
+    def test_extract_patterns(self):
+        self.assertEqual(extract_rpm("test.rpm", self.workdir, ["*.ks"]),
+                         ["./usr/share/test.ks", "./usr/share/link.ks",
+                          "./usr/share/hard.ks"])
+        path = os.path.join(self.workdir, "usr", "share")
+        self.assertEqual(open(os.path.join(path, "hard.ks")).read(),
+                         "<xml/>" * 5000)
+        self.assertFalse(os.path.exists(os.path.join(path, "hard.xml")))
+        self.assertEqual(extract_rpm("test.rpm", self.workdir, "*test.ks"),
+                         ["./usr/share/test.ks"])
+        self.assertEqual(len(extract_rpm("test.rpm", self.workdir, [])), 6)
+
+    def test_fallback(self):
+        make_rpm(os.path.join(self.workdir, "other.rpm"), self.MEMBERS,
+                 compressor="unknown")
+        with patch.object(boss.rpm, "_extract_rpm_cpio",
+                          Mock(return_value=["./file"])) as fallback:
+            self.assertEqual(extract_rpm("other.rpm", self.workdir, ["*"]),
+                             ["./file"])
+            fallback.assert_called_once_with("other.rpm", self.workdir, ["*"])
+
+    def test_broken(self):
+        with open(os.path.join(self.workdir, "test.rpm"), "r+b") as rpm_file:
+            rpm_file.truncate(os.path.getsize(rpm_file.name) - 10)
+        self.assertRaises(ValueError, extract_rpm, "test.rpm", self.workdir)
+        with open(os.path.join(self.workdir, "test.rpm"), "wb") as rpm_file:
+            rpm_file.write("not an rpm" * 20)
+        self.assertRaises(ValueError, extract_rpm, "test.rpm", self.workdir)
+
+
+class TestReadRpmFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rpm = os.path.join(self.tmpdir, "test.rpm")
+        make_rpm(self.rpm, TestExtractRpm.MEMBERS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_file(self):
+        self.assertEqual(list(read_rpm_files(self.rpm, ["*.ks", "*empty"])),
+                         [("./usr/share/test.ks", "kickstart"),
+                          ("./usr/share/hard.ks", "<xml/>" * 5000),
+                          ("./usr/share/empty", "")])
+        self.assertEqual(os.listdir(self.tmpdir), ["test.rpm"])
+
+    def test_read_stream(self):
+        stream = StringIO(open(self.rpm, "rb").read())
+        self.assertEqual(dict(read_rpm_files(stream, "*.xml")),
+                         {"./usr/share/hard.xml": "<xml/>" * 5000})
+
+    def test_fallback(self):
+        make_rpm(self.rpm, TestExtractRpm.MEMBERS, compressor="unknown")
+
+        def extract(rpm_file, work_dir, patterns):
+            open(os.path.join(work_dir, "file.ks"), "w").write("fallback")
+            return ["./file.ks"]
+
+        with patch.object(boss.rpm, "_extract_rpm_cpio",
+                          Mock(side_effect=extract)):
+            self.assertEqual(list(read_rpm_files(self.rpm, ["*.ks"])),
+                             [("./file.ks", "fallback")])
+        self.assertEqual(os.listdir(self.tmpdir), ["test.rpm"])
+        stream = StringIO(open(self.rpm, "rb").read())
+        self.assertRaises(ValueError, list, read_rpm_files(stream))
+
+
+class TestRpmInfo(unittest.TestCase):
+
+    TAGS = [(1022, 6, "noarch"), (1044, 6, "test-1.0-1.src.rpm"),
+            (1001, 6, "1.0"), (1002, 6, "1"),
+            (1116, 4, [0, 1, 1]), (1117, 8, ["usr", "a.ts", "b"]),
+            (1028, 4, [0, 9, 5]),
+            (1030, 3, [stat.S_IFDIR | 0o755, stat.S_IFREG | 0o644,
+                       stat.S_IFLNK | 0o777]),
+            (1047, 8, ["test", "l10n"]), (1112, 4, [8, 0]),
+            (1113, 8, ["1.0-1", ""]),
+            (1049, 8, ["rpmlib(X)", "qt"]), (1048, 4, [8 | 2 | 16, 4]),
+            (1050, 8, ["4.0-1", "5"])]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rpm = os.path.join(self.tmpdir, "test.rpm")
+        make_rpm(self.rpm, TestExtractRpm.MEMBERS, tags=self.TAGS)
+        self.data = open(self.rpm, "rb").read()
+        self.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def urlopen(self, url, headers, ranges=True):
+        """Serve test package, honoring Range header if ranges is set"""
+        self.requests.append(headers.get("Range"))
+        if not ranges:
+            return urllib.addinfourl(StringIO(self.data), {}, url, 200)
+        start, end = [int(val) for val in
+                      headers["Range"].split("=")[1].split("-")]
+        if start >= len(self.data):
+            raise urllib2.HTTPError(url, 416, "Not satisfiable", {}, None)
+        end = min(end, len(self.data) - 1)
+        return urllib.addinfourl(
+            StringIO(self.data[start:end + 1]),
+            {"Content-Range": "bytes %d-%d/%d" % (start, end,
+                                                  len(self.data))},
+            url, 206)
+
+    def test_read_rpm_info(self):
+        with open(self.rpm, "rb") as rpm_file:
+            info = read_rpm_info(rpm_file)
+            self.assertEqual(rpm_file.tell(), info.payload_offset)
+        self.assertEqual((info.name, info.version, info.release, info.arch,
+                          info.epoch), ("test", "1.0", "1", "noarch", None))
+        self.assertEqual(info.size, len(self.data))
+        self.assertEqual(info.files, ["/a/usr", "/b/a.ts", "/b/b"])
+        self.assertEqual(info.regular_files, ["/b/a.ts"])
+        self.assertEqual(info.file_sizes["/b/a.ts"], 9)
+        self.assertEqual(info.files_matching("*.ts"), ["/b/a.ts"])
+        self.assertEqual(info.provides, [("test", "=", "1.0-1"),
+                                         ("l10n", "", "")])
+        self.assertEqual(info.requires, [("rpmlib(X)", "<=", "4.0-1"),
+                                         ("qt", ">", "5")])
+
+    def test_fetch_rpm_info(self):
+        info = fetch_rpm_info("http://obs/test.rpm", self.urlopen,
+                              chunk_size=128)
+        self.assertEqual(info.files, ["/a/usr", "/b/a.ts", "/b/b"])
+        self.assertTrue(self.requests[-1].endswith(
+            "-%d" % (info.payload_offset - 1)))
+        self.assertTrue(len(self.requests) <= 4)
+        self.assertEqual(read_rpm_info(StringIO(self.data)).header,
+                         info.header)
+
+        self.requests = []
+        fetch_rpm_info("http://obs/test.rpm", self.urlopen)
+        self.assertEqual(self.requests, ["bytes=0-65535"])
+
+    def test_range_reader(self):
+        reader = RangeReader("http://obs/test.rpm", self.urlopen,
+                             chunk_size=100)
+        self.assertEqual(reader.read(10), self.data[:10])
+        self.assertEqual(reader.read(200), self.data[10:210])
+        self.assertEqual(reader.read(len(self.data)), self.data[210:])
+        self.assertEqual(reader.read(10), "")
+        self.assertEqual(reader.requests, 3)
+
+        reader = RangeReader("http://obs/test.rpm",
+                             lambda url, headers: self.urlopen(
+                                 url, headers, ranges=False),
+                             chunk_size=100)
+        self.assertEqual(reader.read(10), self.data[:10])
+        self.assertEqual(reader.read(200), self.data[10:210])
+        self.assertEqual(reader.requests, 1)
+        reader.close()
+
+    def test_keepalive_without_ranges(self):
+        test = self
+        done = threading.Event()
+        # padding much bigger than the socket buffers
+        body = self.data + "\0" * (32 * 1024 * 1024)
+        sent = []
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                test.requests.append(self.headers.get("Range"))
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                    sent.append(True)
+                except EnvironmentError:
+                    sent.append(False)
+                finally:
+                    done.set()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                pass
+
+        server = Server(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        handler = KeepAliveHandler()
+        opener = urllib2.build_opener(handler)
+        try:
+            info = fetch_rpm_info(
+                "http://127.0.0.1:%d/test.rpm" % server.server_address[1],
+                lambda url, headers: opener.open(
+                    urllib2.Request(url, headers=headers)))
+            self.assertEqual(info.files, ["/a/usr", "/b/a.ts", "/b/b"])
+            self.assertEqual(self.requests, ["bytes=0-65535"])
+            # the rest of the body is dropped with the connection
+            self.assertTrue(done.wait(10))
+            self.assertEqual(sent, [False])
+        finally:
+            handler.close_all()
+            server.shutdown()
+            server.server_close()
+
+    def test_not_rpm(self):
+        self.data = "not an rpm" * 20
+        self.assertRaises(ValueError, fetch_rpm_info, "http://obs/test.rpm",
+                          self.urlopen)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import gzip, os, shutil, tempfile, unittest, urllib2
+from StringIO import StringIO
+
+from mock import Mock, patch
+
+import repo_diff
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <revision>1</revision>
+  <data type="primary">
+    <checksum type="sha256">abc</checksum>
+    <location href="repodata/abc-primary.xml.gz"/>
+    <timestamp>1400000000</timestamp>
+  </data>
+</repomd>
+"""
+
+PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common"
+    xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">
+%s
+</metadata>
+"""
+
+PACKAGE = """<package type="rpm">
+  <name>%s</name>
+  <arch>%s</arch>
+  <version epoch="0" ver="%s" rel="%s"/>
+  <summary>%s package</summary>
+</package>"""
+
+def make_repo(path, packages):
+    os.makedirs(os.path.join(path, "repodata"))
+    with open(os.path.join(path, "repodata", "repomd.xml"), "w") as repomd:
+        repomd.write(REPOMD)
+    primary = gzip.open(os.path.join(path, "repodata", "abc-primary.xml.gz"),
+                        "w")
+    primary.write(PRIMARY % (len(packages), "\n".join(
+        PACKAGE % (pkg + (pkg[0],)) for pkg in packages)))
+    primary.close()
+
+class TestRepoDiff(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old = os.path.join(self.tmpdir, "old")
+        self.new = os.path.join(self.tmpdir, "new")
+        make_repo(self.old, [
+            ("a", "src", "1.0", "1"), ("b", "src", "1.0", "1"),
+            ("c", "src", "2.0", "1"), ("c", "src", "1.0", "1"),
+            ("d", "i586", "1.0", "1")])
+        make_repo(self.new, [
+            ("a", "src", "1.0", "2"), ("c", "src", "2.1", "1"),
+            ("e", "src", "1.0", "1"), ("e", "i586", "1.0", "1")])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_repo_packages(self):
+        self.assertEqual(repo_diff.repo_packages(self.old), {
+            "a": ("0", "1.0", "1"), "b": ("0", "1.0", "1"),
+            "c": ("0", "2.0", "1")})
+        self.assertEqual(
+            repo_diff.repo_packages("file://" + self.old, ["i586"]),
+            {"d": ("0", "1.0", "1")})
+        self.assertRaises(RuntimeError, repo_diff.repo_packages,
+                          os.path.join(self.tmpdir, "missing"))
+
+    def test_short_diff(self):
+        diff = repo_diff.short_diff([self.new], [self.old])
+        self.assertEqual(diff, {"added": ["e"], "removed": ["b"],
+                                "modified": ["c"]})
+        self.assertEqual(repo_diff.short_diff([self.old], [self.old]), {})
+        self.assertEqual(
+            repo_diff.generate_short_diff([self.new], [self.old]),
+            repo_diff.format_short_diff(diff))
+
+    def test_compare_evr(self):
+        for one, two, result in [
+                (("0", "1.0", "1"), ("0", "1.0", "1"), 0),
+                (("1", "1.0", "1"), ("0", "2.0", "1"), 1),
+                ((None, "1.10", "1"), ("0", "1.9", "1"), 1),
+                (("0", "1.0", "1"), ("0", "1.0", "1.1"), -1),
+                (("0", "1.0a", "1"), ("0", "1.0.1", "1"), -1),
+                (("0", "1.0~rc1", "1"), ("0", "1.0", "1"), -1),
+                (("0", "1.0^git1", "1"), ("0", "1.0", "1"), 1),
+                (("0", "1.0^git1", "1"), ("0", "1.0.1", "1"), -1),
+                (("0", "1.01", "1"), ("0", "1.1", "1"), 0)]:
+            self.assertEqual(repo_diff.compare_evr(one, two), result)
+            self.assertEqual(repo_diff.compare_evr(two, one), -result)
+
+class TestWriteReport(unittest.TestCase):
+    ENTRIES = ["Header\n\n", "New package a", "b-1.0-1\n-------\n* log\n",
+               "Summary:", "Added Packages: 1"]
+
+    def test_write_report(self):
+        with patch.object(repo_diff, "iter_report",
+                          Mock(side_effect=lambda *args, **kwargs:
+                               iter(self.ENTRIES))):
+            out = StringIO()
+            lines = repo_diff.write_report(out, ["new"], ["old"])
+            self.assertEqual(out.getvalue(), "\n".join(self.ENTRIES))
+            self.assertEqual(lines, out.getvalue().split("\n"))
+
+            lines = repo_diff.write_report(StringIO(), ["new"], ["old"],
+                                           max_lines=5)
+            self.assertEqual(lines, ["Header", "", "", "New package a",
+                                     "b-1.0-1", "...", "Summary:",
+                                     "Added Packages: 1"])
+            self.assertEqual(
+                repo_diff.write_report(StringIO(), [], [], max_lines=0),
+                ["...", "Summary:", "Added Packages: 1"])
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmpdir, "repo")
+        make_repo(self.repo, [("a", "src", "1.0", "1")])
+        repo_diff.METADATA_CACHE = repo_diff.MetadataCache(
+            os.path.join(self.tmpdir, "cache"))
+
+    def tearDown(self):
+        repo_diff.METADATA_CACHE = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_primary_parsed_once(self):
+        parse = Mock(side_effect=repo_diff._parse_primary)
+        with patch.object(repo_diff, "_parse_primary", parse):
+            for _ in range(2):
+                self.assertEqual(repo_diff.repo_packages(self.repo),
+                                 {"a": ("0", "1.0", "1")})
+            self.assertEqual(parse.call_count, 1)
+            repo_diff.repo_packages(self.repo, ["i586"])
+            self.assertEqual(parse.call_count, 2)
+
+    def test_not_modified(self):
+        cache = repo_diff.METADATA_CACHE
+        repomd = cache.repomd(self.repo)
+        not_modified = urllib2.HTTPError("url", 304, "Not Modified", {},
+                                         None)
+        with patch("urllib2.urlopen", Mock(side_effect=not_modified)) as get:
+            self.assertEqual(cache.repomd(self.repo), repomd)
+            request = get.call_args[0][0]
+            self.assertTrue(request.has_header("If-modified-since"))
+            # nothing cached for other repositories
+            self.assertRaises(urllib2.HTTPError, cache.repomd, self.tmpdir)
+
+    def test_evict(self):
+        cache = repo_diff.METADATA_CACHE
+        cache.size = 1
+        other = os.path.join(self.tmpdir, "other")
+        make_repo(other, [("b", "src", "1.0", "1")])
+        repo_diff.repo_packages(self.repo)
+        os.utime(cache._entry(self.repo), (0, 0))
+        repo_diff.repo_packages(other)
+        self.assertEqual(os.listdir(cache.path),
+                         [os.path.basename(cache._entry(other))])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,39 +16,87 @@ class WorkQueueTestCase(unittest.TestCase):
     def setUp(self): # pylint: disable=C0103
         """Test setup."""
         os.mkdir(TMP)
+        self.store = obsticket.TicketStore(os.path.join(TMP, "test.db"))
         self.queuename = os.path.join(TMP, "wq")
 
     def tearDown(self): # pylint: disable=C0103
         """Test tear down."""
+        self.store.close()
         shutil.rmtree(TMP)
 
-    def test_constructor(self):
-        """Test WorkQueue.__init__()"""
-        # Test that pointers get created
-        wqueue = obsticket.WorkQueue(self.queuename)
-        self.assertTrue(os.path.exists(self.queuename + ".curr"))
-        self.assertTrue(os.path.exists(self.queuename + ".tail"))
+    def test_migrate(self):
+        """Test TicketStore.migrate()"""
+        open(self.queuename + ".curr", "w").write("1")
+        open(self.queuename + ".tail", "w").write("3")
+        open(self.queuename + ".1", "w").write("work 1")
+        open(self.queuename + ".2", "w").write("work 2")
+        self.assertEqual(self.store.migrate(TMP), ["wq"])
+        # Old queue files are removed
+        self.assertEqual([name for name in os.listdir(TMP)
+                          if not name.startswith("test.db")], [])
+
+        wqueue = obsticket.WorkQueue(self.store, "wq")
+        self.assertEqual(wqueue.head(), "work 1")
+        self.assertEqual(wqueue.next(), "work 2")
 
-        # Test that they are read correctly
+    def test_migrate_resume(self):
+        """Test TicketStore.migrate() with missing and left over files"""
         open(self.queuename + ".curr", "w").write("1")
-        open(self.queuename + ".tail", "w").write("2")
-        wqueue = obsticket.WorkQueue(self.queuename)
-        self.assertEqual(wqueue.curr, 1)
-        self.assertEqual(wqueue.tail, 2)
+        open(self.queuename + ".tail", "w").write("3")
+        open(self.queuename + ".2", "w").write("work 2")
+        log = Mock()
+        self.assertEqual(self.store.migrate(TMP, log), ["wq"])
+        self.assertEqual(log.warning.call_count, 1)
+
+        # Files left by an interrupted run are removed, not imported again
+        open(self.queuename + ".curr", "w").write("2")
+        open(self.queuename + ".tail", "w").write("3")
+        open(self.queuename + ".2", "w").write("work 2")
+        self.assertEqual(self.store.migrate(TMP), [])
+        self.assertEqual([name for name in os.listdir(TMP)
+                          if not name.startswith("test.db")], [])
+
+        wqueue = obsticket.WorkQueue(self.store, "wq")
+        self.assertEqual(wqueue.head(), "work 2")
+        self.assertRaises(obsticket.QueueEmpty, wqueue.next)
+
+    def test_add_if_quiet(self):
+        """Test WorkQueue.add_if_quiet()"""
+        wqueue = obsticket.WorkQueue(self.store, "wq")
+        self.assertTrue(wqueue.add_if_quiet("work 1"))
+        self.assertFalse(wqueue.add_if_quiet("work 2"))
+        self.assertEqual(wqueue.head(), "work 1")
+        self.assertRaises(obsticket.QueueEmpty, wqueue.next)
 
     def test_operations(self):
         """Test WorkQueue operations."""
-        wqueue = obsticket.WorkQueue(self.queuename)
+        wqueue = obsticket.WorkQueue(self.store, "wq")
         self.assertRaises(obsticket.QueueEmpty, wqueue.head)
         self.assertRaises(obsticket.QueueNoNext, wqueue.next)
 
         self.assertTrue(wqueue.add("work 1"))
         self.assertFalse(wqueue.add("work 2"))
+        # Queues are independent
+        self.assertTrue(obsticket.WorkQueue(self.store, "other").isquiet())
 
         self.assertEqual(wqueue.head(), "work 1")
         self.assertEqual(wqueue.next(), "work 2")
         self.assertEqual(wqueue.head(), "work 2")
         self.assertRaises(obsticket.QueueEmpty, wqueue.next)
+        self.assertTrue(wqueue.isquiet())
+
+    def test_locks(self):
+        """Test TicketStore.locks()"""
+        self.assertEqual(self.store.locks(), [])
+        self.store.add("a", "work 1")
+        self.store.add("a", "work 2")
+        self.store.add("b", "work 3")
+        locks = self.store.locks()
+        self.assertEqual([(lock["lock"], lock["waiting"]) for lock in locks],
+                         [("a", 1), ("b", 0)])
+        self.assertTrue(locks[0]["held"] >= 0)
+        self.assertTrue(locks[0]["wait"] >= 0)
+        self.assertEqual(locks[1]["wait"], 0.0)
 
 
 class ParticipantHandlerTestCase(unittest.TestCase):
@@ -64,6 +112,7 @@ class ParticipantHandlerTestCase(unittest.TestCase):
         ctrl.config.add_section("obsticket")
         ctrl.config.set("obsticket", "prjdir", TMP)
         self.participant = obsticket.ParticipantHandler()
+        self.participant.log = Mock()
         self.participant.handle_lifecycle_control(ctrl)
 
     def tearDown(self): # pylint: disable=C0103
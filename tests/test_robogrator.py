@@ -1,4 +1,4 @@
-import os, unittest, sys
+import os, unittest, sys, shutil, tempfile
 from ConfigParser import ConfigParser, NoSectionError, NoOptionError
 
 from mock import Mock
@@ -14,6 +14,17 @@ class TestParticipantHandler(BaseTestParticipantHandler):
     module_under_test = "robogrator"
 
     def launch_override(self, process, fields):
+        # runs in the launch queue thread, which logs exceptions, so the
+        # launches are checked in join_launches()
+        self.launched.append((process, fields))
+
+    def join_launches(self):
+        self.participant.launches.join()
+        launched, self.launched = self.launched, []
+        for process, fields in launched:
+            self.check_launch(process, fields)
+
+    def check_launch(self, process, fields):
         base = os.path.join(self.process_store, self.project.replace(':', '/'))
         pfile = os.path.join(base, self.evname)
         for psuffix in self.expected.keys():
@@ -35,6 +46,12 @@ class TestParticipantHandler(BaseTestParticipantHandler):
             self.assertEquals(fields, {"project": self.project})
         self.called_count = self.called_count + 1
 
+    def tearDown(self):
+        if self.participant.store:
+            self.participant.store.stop()
+        if self.participant.launches:
+            self.participant.launches.stop()
+
     def setup_ctrl(self):
         ctrl = Mock
         ctrl.message = "start"
@@ -75,6 +92,7 @@ class TestParticipantHandler(BaseTestParticipantHandler):
         self.setup_ctrl()
         self.participant.handle_lifecycle_control(self.ctrl)
         self.participant.launcher.launch = self.launch_override
+        self.launched = []
 
         self.process_store = os.path.join(os.getcwd(), TEST_PSTORE)
         pbase = "Chalk:Testing"
@@ -84,64 +102,77 @@ class TestParticipantHandler(BaseTestParticipantHandler):
         self.expected = None
         self.called_count = 0
         self.participant.launch(self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 0)
 
         self.project = pbase + ":singleold"
         self.expected = {"": None}
         self.called_count = 0
         self.participant.launch(self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 1)
 
         self.project = pbase + ":single"
         self.expected = {".foo.pdef": None}
         self.called_count = 0
         self.participant.launch(self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 1)
 
         self.project = pbase + ":single_with_conf"
         self.expected = {".foo.pdef": {'foo':'foo'}}
         self.called_count = 0
         self.participant.launch(self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 1)
 
         self.project = pbase + ":single_with_conf_comments"
         self.expected = {".foo.pdef": {'foo':'foo'}}
         self.called_count = 0
         self.participant.launch(self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 1)
 
         self.project = pbase + ":single_with_wrong_conf_permissions"
         self.expected = None
         os.chmod(os.path.join(self.process_store,self.project.replace(":","/"))
                 + '/' + self.evname + ".foo.conf" , 0)
+        self.participant.store.scan()
         self.called_count = 0
         self.assertRaises(RuntimeError, self.participant.launch,
                           self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 0)
         os.chmod(os.path.join(self.process_store,self.project.replace(":","/"))
                 + '/' + self.evname + ".foo.conf" , 0o644)
+        self.participant.store.scan()
 
         self.project = pbase + ":single_with_wrong_permissions"
         self.expected = None
         os.chmod(os.path.join(self.process_store,self.project.replace(":","/"))
                 + '/' + self.evname + ".foo.pdef" , 0)
+        self.participant.store.scan()
         self.called_count = 0
         self.participant.launch(self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 0)
         os.chmod(os.path.join(self.process_store,self.project.replace(":","/"))
                 + '/' + self.evname + ".foo.pdef" , 0o644)
+        self.participant.store.scan()
 
         self.project = pbase + ":single_with_invalid_conf"
         self.expected = None
         self.called_count = 0
         self.assertRaises(RuntimeError, self.participant.launch,
                           self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 0)
 
         self.project = pbase + ":multiple"
         self.expected = {".bar.pdef": None, ".foo.pdef": None}
         self.called_count = 0
         self.participant.launch(self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 2)
 
         self.project = pbase + ":multiple_with_conf"
@@ -149,7 +180,86 @@ class TestParticipantHandler(BaseTestParticipantHandler):
                          ".foo.pdef": {'foo': 'foo'}}
         self.called_count = 0
         self.participant.launch(self.evname, project=self.project)
+        self.join_launches()
         self.assertEquals(self.called_count, 2)
 
+    def test_launch_queue(self):
+        launcher = Mock()
+        launches = self.mut.LaunchQueue(launcher, Mock(), batch_size=2)
+        for num in range(3):
+            launches.put("process", {"project": "p%s" % num})
+        launches.start()
+        launches.join()
+        launches.stop()
+        self.assertEquals(launcher.launch.call_count, 3)
+        launcher.launch.assert_called_with("process", {"project": "p2"})
+        stats = launches.stats()
+        self.assertEquals(stats["depth"], 0)
+        self.assertEquals(stats["launched"], 3)
+        self.assertEquals(stats["batches"], 2)
+
+    def test_launch_queue_failure(self):
+        launcher = Mock()
+        launcher.launch.side_effect = [IOError("failed"), None]
+        launches = self.mut.LaunchQueue(launcher, Mock())
+        launches.start()
+        launches.put("process", {"project": "p1"})
+        launches.put("process", {"project": "p2"})
+        launches.stop()
+        stats = launches.stats()
+        self.assertEquals(stats["failed"], 1)
+        self.assertEquals(stats["launched"], 1)
+
+    def test_process_store_scan(self):
+        path = tempfile.mkdtemp()
+        try:
+            store = self.mut.ProcessStore(path, Mock())
+            pdir = os.path.join(path, "Chalk", "Testing")
+            os.makedirs(pdir)
+            store.scan()
+            self.assertEquals(store.get("REPO_PUBLISHED", "Chalk:Testing"),
+                              ())
+
+            with open(os.path.join(pdir, "REPO_PUBLISHED.foo.pdef"), "w") \
+                    as pdef:
+                pdef.write("process")
+            with open(os.path.join(pdir, "REPO_PUBLISHED.foo.conf"), "w") \
+                    as conf:
+                conf.write('# comment\n{"foo": "foo"}')
+            store.scan()
+            entries = store.get("REPO_PUBLISHED", "Chalk:Testing")
+            self.assertEquals([(e.config, e.process) for e in entries],
+                              [({"foo": "foo"}, "process")])
+
+            # unchanged directories are not read again
+            store._read_dir = Mock()
+            store.scan()
+            self.assertFalse(store._read_dir.called)
+            self.assertTrue(
+                    store.get("REPO_PUBLISHED", "Chalk:Testing") is entries)
+        finally:
+            shutil.rmtree(path)
+
+    def test_process_store_symlinks(self):
+        path = tempfile.mkdtemp()
+        try:
+            pdir = os.path.join(path, "Chalk", "Testing")
+            os.makedirs(pdir)
+            with open(os.path.join(pdir, "REPO_PUBLISHED.foo.pdef"), "w") \
+                    as pdef:
+                pdef.write("process")
+            # linked project directories are found, loops are not followed
+            os.symlink(pdir, os.path.join(path, "Linked"))
+            os.symlink(path, os.path.join(pdir, "loop"))
+            store = self.mut.ProcessStore(path, Mock())
+            store.scan()
+            self.assertEquals(len(store.get("REPO_PUBLISHED", "Linked")), 1)
+            self.assertEquals(
+                    len(store.get("REPO_PUBLISHED", "Chalk:Testing")), 1)
+            self.assertEquals(
+                    store.get("REPO_PUBLISHED", "Chalk:Testing:loop"), ())
+        finally:
+            shutil.rmtree(path)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,115 @@
+"""Unit tests for setup_build_trial BOSS participant."""
+
+import unittest
+from collections import defaultdict
+
+from lxml import etree
+from mock import Mock
+
+import setup_build_trial
+
+
+def make_chain(length, repos=("standard",), archs=("i586", "armv7el")):
+    """Project metas of a chain where every project builds against the
+    next one, ending to a base project with no paths."""
+    metas = {}
+    for num in range(length):
+        prjmeta = etree.Element("project", name="Chain:%s" % num)
+        for repo in repos:
+            repoelem = etree.SubElement(prjmeta, "repository", name=repo)
+            if num + 1 < length:
+                etree.SubElement(repoelem, "path",
+                                 project="Chain:%s" % (num + 1),
+                                 repository=repo)
+            for arch in archs:
+                etree.SubElement(repoelem, "arch").text = arch
+        metas["Chain:%s" % num] = prjmeta
+    return metas
+
+
+class PathResolverTestCase(unittest.TestCase):
+    """Test case for setup_build_trial.PathResolver."""
+
+    def setUp(self):
+        self.metas = make_chain(120)
+        self.fetched = defaultdict(int)
+        self.resolver = setup_build_trial.PathResolver(self.get_prjmeta)
+        self.repolinks = {"standard": set(["i586"])}
+
+    def get_prjmeta(self, project):
+        self.fetched[project] += 1
+        return self.metas[project]
+
+    def test_resolve_chain(self):
+        paths = self.resolver.resolve(self.repolinks, "Chain:0")
+        self.assertEqual(paths.keys(), ["standard"])
+        self.assertEqual(paths["standard"],
+                [("Chain:%s" % num, "standard", "i586")
+                 for num in range(120)])
+        self.assertEqual(len(self.fetched), 120)
+
+    def test_resolve_memoized(self):
+        paths = self.resolver.resolve(self.repolinks, "Chain:60")
+        self.assertEqual(len(paths["standard"]), 60)
+        # the results can be modified by the caller
+        paths["standard"].pop()
+        self.fetched.clear()
+        paths = self.resolver.resolve(self.repolinks, "Chain:0")
+        self.assertEqual(len(paths["standard"]), 120)
+        # only projects above the already resolved part are read
+        self.assertEqual(len(self.fetched), 60)
+        self.assertEqual(
+                len(self.resolver.resolve(self.repolinks, "Chain:60")
+                    ["standard"]), 60)
+
+    def test_resolve_cycle(self):
+        repoelem = self.metas["Chain:119"].find("repository")
+        repoelem.insert(0, etree.Element("path", project="Chain:0",
+                                         repository="standard"))
+        paths = self.resolver.resolve(self.repolinks, "Chain:0")
+        self.assertEqual(len(paths["standard"]), 120)
+
+    def test_prefetch_levels(self):
+        metas = make_chain(5)
+        repoelem = metas["Chain:0"].find("repository")
+        repoelem.insert(0, etree.Element("path", project="Chain:3",
+                                         repository="standard"))
+        levels = []
+        resolver = setup_build_trial.PathResolver(metas.__getitem__,
+                                                  levels.append)
+        resolver.resolve(self.repolinks, "Chain:0")
+        self.assertEqual(levels, [["Chain:0"], ["Chain:3", "Chain:1"],
+                                  ["Chain:4", "Chain:2"]])
+
+
+class ParticipantHandlerTestCase(unittest.TestCase):
+    """Test case for setup_build_trial.ParticipantHandler."""
+
+    def setUp(self):
+        self.participant = setup_build_trial.ParticipantHandler()
+        self.participant.obs = Mock()
+
+    def test_remove_invalid_paths(self):
+        project_targets = {"A": ["standard/i586", "missing/x86_64"],
+                           "B": ["other/i586"]}
+        self.participant.obs.getTargets.side_effect = project_targets.get
+        extra_paths = setup_build_trial.OrderedDefaultdict(list)
+        extra_paths["standard"] = [
+            ("Trial", "standard", "i586"), ("A", "standard", "i586"),
+            ("A", "standard", "armv7el"), ("B", "other", "i586")]
+        extra_paths["missing"] = [("A", "missing", "i586")]
+        targets = set(["A", "B"])
+        self.participant.remove_invalid_paths("Trial", extra_paths, targets)
+        self.assertEqual(extra_paths.items(), [
+            ("standard", [("A", "standard", "i586"), ("B", "other", "i586")])
+        ])
+        # B has no standard repository
+        self.assertEqual(targets, set(["A"]))
+        self.assertEqual(
+            sorted(args[0][0] for args in
+                   self.participant.obs.getTargets.call_args_list),
+            ["A", "B"])
+
+
+if __name__ == '__main__':
+    unittest.main()
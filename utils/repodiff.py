@@ -45,6 +45,8 @@ def parseArgs():
                       help="Output count of OBS commits")
     parser.add_option("--short", default=False, action='store_true',
                       help="Only report added, removed and modified package names")
+    parser.add_option("--cachedir", default=None,
+                      help="Directory for caching repository metadata")
     (opts, _) = parser.parse_args()
 
     if not opts.new or not opts.old:
@@ -66,18 +68,21 @@ if __name__ == "__main__":
         sys.stdout = codecs.getwriter(locale.getpreferredencoding())(sys.stdout)
 
     opts = parseArgs()
+    if opts.cachedir:
+        repo_diff.METADATA_CACHE = repo_diff.MetadataCache(opts.cachedir)
 
     try:
         if opts.short:
-            report = repo_diff.generate_short_diff(opts.new, opts.old)
+            print repo_diff.generate_short_diff(opts.new, opts.old)
         else:
-            report = repo_diff.generate_report(opts.new, opts.old, quiet=opts.quiet,
-                                               archlist=opts.archlist, size=opts.size,
-                                               rebuilds=opts.rebuilds, commits=opts.commits)
+            repo_diff.write_report(sys.stdout, opts.new, opts.old, max_lines=0,
+                                   quiet=opts.quiet, archlist=opts.archlist,
+                                   size=opts.size, rebuilds=opts.rebuilds,
+                                   commits=opts.commits)
+            print
     except RuntimeError, e:
         print e
         sys.exit(1)
     
-    print report
     sys.exit(0)
 